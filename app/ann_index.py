@@ -0,0 +1,168 @@
+# secure-rag/app/ann_index.py
+
+import dataclasses
+import json
+import math
+import os
+from dataclasses import dataclass
+
+import faiss
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+INDEX_SPEC_FILE = "index_spec.json" # 保存在向量存储目录中，记录索引类型和默认搜索参数
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+TRAIN_SAMPLE_SIZE = 100_000 # IVF / PQ 训练时最多使用的向量数
+MIN_POINTS_PER_CENTROID = 39 # 低于此值时 faiss 的 k-means 会告警，聚类质量也会下降
+DEFAULT_NPROBE = 16 # IVF: 每次查询探查的倒排列表数
+DEFAULT_EF_SEARCH = 64 # HNSW: 搜索时的候选队列长度
+
+
+@dataclass
+class IndexSpec:
+    """
+    FAISS 索引类型及其参数。
+
+    kind 为 flat (精确扫描)、ivf_flat、ivf_pq 或 hnsw。nlist 为 None 时按
+    约 4 * sqrt(N) 自动选择。nprobe / ef_search 是保存到索引旁边的默认搜索
+    参数，检索器可以覆盖它们。factory 是实际使用的 faiss.index_factory 字符串，
+    在构建时填入。
+    """
+    kind: str = "flat"
+    nlist: int | None = None
+    pq_m: int = 16 # PQ 子向量个数，必须整除向量维度
+    pq_bits: int = 8 # 每个子向量的编码位数
+    hnsw_m: int = 32 # HNSW 每个节点的邻居数
+    ef_construction: int = 80
+    nprobe: int = DEFAULT_NPROBE
+    ef_search: int = DEFAULT_EF_SEARCH
+    train_size: int = TRAIN_SAMPLE_SIZE
+    factory: str | None = None
+
+    def __post_init__(self):
+        if self.kind not in INDEX_KINDS:
+            raise ValueError(f"未知的索引类型 '{self.kind}'，可选: {', '.join(INDEX_KINDS)}")
+
+    @classmethod
+    def parse(cls, text: str) -> "IndexSpec":
+        """
+        解析命令行形式的规格，例如 "hnsw" 或 "ivf_pq:nlist=1024,pq_m=16,nprobe=32"。
+
+        Raises:
+            ValueError: 类型或参数名无效。
+        """
+        kind, _, options = text.partition(":")
+        fields = {f.name: f.type for f in dataclasses.fields(cls)}
+        params = {}
+        for option in filter(None, options.split(",")):
+            key, _, value = option.partition("=")
+            key = key.strip()
+            if key not in fields or key in ("kind", "factory"):
+                raise ValueError(f"未知的索引参数 '{key}'")
+            params[key] = int(value)
+        return cls(kind=kind.strip(), **params)
+
+
+def resolve_spec(spec: IndexSpec, n_vectors: int, dim: int) -> IndexSpec:
+    """
+    根据语料规模确定 factory 字符串和 nlist。
+
+    向量太少、不足以训练所需的聚类中心时退回精确的 Flat 索引，因为此时
+    近似索引既不会更快，召回率也更差。
+
+    Raises:
+        ValueError: PQ 子向量个数不能整除维度。
+    """
+    if spec.kind == "flat":
+        return dataclasses.replace(spec, factory="Flat")
+    if spec.kind == "hnsw":
+        return dataclasses.replace(spec, factory=f"HNSW{spec.hnsw_m}")
+
+    nlist = spec.nlist or max(1, int(4 * math.sqrt(n_vectors)))
+    nlist = min(nlist, max(1, n_vectors // MIN_POINTS_PER_CENTROID))
+    needed = max(nlist, 2 ** spec.pq_bits if spec.kind == "ivf_pq" else 0)
+    if n_vectors < needed:
+        logger.info("只有 %d 个向量，不足以训练 %s 索引，改用 Flat。", n_vectors, spec.kind)
+        return dataclasses.replace(spec, kind="flat", nlist=None, factory="Flat")
+
+    if spec.kind == "ivf_flat":
+        return dataclasses.replace(spec, nlist=nlist, factory=f"IVF{nlist},Flat")
+    if dim % spec.pq_m:
+        raise ValueError(f"PQ 子向量个数 {spec.pq_m} 不能整除向量维度 {dim}。")
+    return dataclasses.replace(spec, nlist=nlist, factory=f"IVF{nlist},PQ{spec.pq_m}x{spec.pq_bits}")
+
+
+def build_index(vectors: np.ndarray, spec: IndexSpec, seed: int = 0) -> tuple[faiss.Index, IndexSpec]:
+    """
+    按规格构建 FAISS 索引并按原顺序加入所有向量 (因此 FAISS id 与输入行号一致)。
+
+    需要训练的索引只用随机抽取的最多 train_size 个向量训练。
+
+    Returns:
+        (索引, 填好 factory 和 nlist 的规格)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dim = vectors.shape
+    spec = resolve_spec(spec, n_vectors, dim)
+    index = faiss.index_factory(dim, spec.factory)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample_size = min(spec.train_size, n_vectors)
+        sample = vectors[np.sort(rng.choice(n_vectors, sample_size, replace=False))]
+        logger.info("使用 %d 个向量训练 %s 索引...", sample_size, spec.factory)
+        index.train(sample)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efConstruction = spec.ef_construction
+
+    index.add(vectors)
+    apply_search_params(index, spec.nprobe, spec.ef_search)
+    return index, spec
+
+
+def convert_index(index: faiss.Index, spec: IndexSpec, seed: int = 0) -> tuple[faiss.Index, IndexSpec]:
+    """把已构建的 (通常是 Flat) 索引中的向量按规格重建为新索引，id 顺序保持不变。"""
+    return build_index(index.reconstruct_n(0, index.ntotal), spec, seed)
+
+
+def apply_search_params(index: faiss.Index, nprobe: int | None = None, ef_search: int | None = None):
+    """设置索引的默认搜索参数；与索引类型无关的参数会被忽略。"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe is not None:
+        ivf.nprobe = nprobe
+    if isinstance(index, faiss.IndexHNSW) and ef_search is not None:
+        index.hnsw.efSearch = ef_search
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector | None = None,
+                      nprobe: int | None = None, ef_search: int | None = None) -> faiss.SearchParameters:
+    """
+    返回与索引类型匹配的 SearchParameters。
+
+    IVF 和 HNSW 索引拒绝通用的 SearchParameters，因此带 ID 选择器搜索时
+    必须使用各自的子类，并同时传入 nprobe / efSearch。
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def save_index_spec(path: str, spec: IndexSpec):
+    with open(os.path.join(path, INDEX_SPEC_FILE), 'w', encoding='utf-8') as f:
+        json.dump(dataclasses.asdict(spec), f, ensure_ascii=False, indent=2)
+
+
+def load_index_spec(path: str) -> IndexSpec | None:
+    """加载索引规格；旧版本构建的向量存储没有此文件，返回 None (即 Flat)。"""
+    spec_path = os.path.join(path, INDEX_SPEC_FILE)
+    if not os.path.exists(spec_path):
+        return None
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        return IndexSpec(**json.load(f))
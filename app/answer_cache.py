@@ -0,0 +1,164 @@
+# secure-rag/app/answer_cache.py
+
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import dataclass
+
+import numpy as np
+from langchain_core.documents import Document
+
+# --- 配置 ---
+SIMILARITY_THRESHOLD = 0.95 # 新查询与缓存查询的余弦相似度至少为此值才视为命中
+TTL_SECONDS = 3600.0 # 缓存答案的有效期
+MAX_ENTRIES = 1000 # 超出后按最近最少使用淘汰
+
+
+def document_ids(docs: list[Document]) -> frozenset[str]:
+    """返回检索结果的文档 id 集合；旧索引中没有 chunk_id 的块使用内容哈希。"""
+    return frozenset(
+        doc.metadata.get("chunk_id") or hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+        for doc in docs
+    )
+
+
+@dataclass
+class _Entry:
+    scope: Hashable
+    embedding: np.ndarray # 已归一化的查询向量
+    doc_ids: frozenset[str]
+    answer: str
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """
+    按角色 (或权限集合) 隔离的语义答案缓存。
+
+    只有同时满足以下条件才会命中:
+      * 作用域相同 —— HR 的答案永远不会返回给 Engineer；
+      * 查询向量的余弦相似度不低于 threshold；
+      * 本次检索到的文档 id 集合与缓存时完全相同；
+      * 条目未过期，且向量存储版本未变化 (版本变化时整个缓存失效)。
+
+    热重载之后仍在旧索引上运行的请求带着旧版本调用时不会命中，也不会写入，
+    更不会让缓存退回旧版本。
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, ttl_seconds: float = TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[int, _Entry] = OrderedDict() # 按最近使用排序
+        self._by_scope: dict[Hashable, set[int]] = {}
+        self._ids = itertools.count()
+        self._index_version: str | None = None
+        self._retired_versions: set[str] = set() # 已被替换的版本 (版本 id 无法比较先后)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, scope: Hashable, query_embedding: list[float], doc_ids: frozenset[str],
+               index_version: str | None = None) -> str | None:
+        """返回可复用的缓存答案，没有则返回 None。"""
+        query = self._normalize(query_embedding)
+        with self._lock:
+            if not self._check_version(index_version):
+                self.misses += 1
+                return None
+            now = self._clock()
+            best_id, best_score = None, self.threshold
+            for entry_id in list(self._by_scope.get(scope, ())):
+                entry = self._entries[entry_id]
+                if now - entry.created_at > self.ttl_seconds:
+                    self._remove(entry_id)
+                    self.expirations += 1
+                    continue
+                if entry.doc_ids != doc_ids:
+                    continue
+                score = float(np.dot(entry.embedding, query))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id].answer
+
+    def store(self, scope: Hashable, query_embedding: list[float], doc_ids: frozenset[str], answer: str,
+              index_version: str | None = None):
+        """缓存一个新生成的答案。"""
+        entry = _Entry(scope, self._normalize(query_embedding), doc_ids, answer, self._clock())
+        with self._lock:
+            if not self._check_version(index_version):
+                return # 基于旧索引生成的答案
+            entry_id = next(self._ids)
+            self._entries[entry_id] = entry
+            self._by_scope.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+                self.evictions += 1
+
+    def invalidate(self):
+        """清空缓存，例如在向量存储重建之后。"""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        """返回命中率等指标。"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+        }
+
+    def _check_version(self, index_version: str | None) -> bool:
+        """
+        切换到新的向量存储版本时丢弃所有条目 (调用方需持有锁)。
+
+        返回 index_version 是否为当前版本；已被替换的旧版本返回 False，不改变缓存。
+        """
+        if index_version is None or index_version == self._index_version:
+            return True
+        if index_version in self._retired_versions:
+            return False
+        if self._index_version is not None:
+            self._retired_versions.add(self._index_version)
+            self._clear()
+        self._index_version = index_version
+        return True
+
+    def _clear(self):
+        if self._entries:
+            self.invalidations += 1
+        self._entries.clear()
+        self._by_scope.clear()
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        scope_ids = self._by_scope[entry.scope]
+        scope_ids.discard(entry_id)
+        if not scope_ids:
+            del self._by_scope[entry.scope]
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
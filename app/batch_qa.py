@@ -0,0 +1,92 @@
+# secure-rag/app/batch_qa.py
+
+"""
+Answers a JSONL file of (query, role) pairs in one batch run.
+
+Each input line is a JSON object with "query" and "user_role"; any other
+fields (e.g. an id or the expected answer of an evaluation set) are copied to
+the output line, which adds "answer". Finished answers are checkpointed next
+to the output file, so rerunning the same command after a crash only answers
+the remaining questions. The checkpoint is removed once every question has
+been answered.
+
+Usage:
+    python app/batch_qa.py --input questions.jsonl --output answers.jsonl --workers 8
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import logging
+
+# Add project root directory to Python path so this script can import the 'app' package
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.rag_chain import MAX_CONCURRENT_LLM_CALLS, RagService, get_default_service, load_batch_checkpoint
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+
+def read_requests(path: str) -> list[dict]:
+    """Reads the input JSONL, skipping blank lines. Raises ValueError on lines without query/user_role."""
+    requests = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or not all(key in record for key in ("query", "user_role")):
+                raise ValueError(f"{path}:{line_number}: expected an object with 'query' and 'user_role'")
+            requests.append(record)
+    return requests
+
+
+def run(input_path: str, output_path: str, checkpoint_path: str | None = None,
+        max_workers: int = MAX_CONCURRENT_LLM_CALLS, service: RagService | None = None) -> int:
+    """
+    Answers every request of input_path and writes them, in input order, to output_path.
+
+    Returns:
+        The number of questions that failed (they are retried on the next run).
+    """
+    service = service or get_default_service()
+    checkpoint_path = checkpoint_path or output_path + CHECKPOINT_SUFFIX
+    requests = read_requests(input_path)
+    pairs = [(record["query"], record["user_role"]) for record in requests]
+
+    answers = service.get_rag_responses(pairs, max_workers=max_workers, checkpoint_path=checkpoint_path)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for record, answer in zip(requests, answers):
+            f.write(json.dumps({**record, "answer": answer}, ensure_ascii=False) + "\n")
+
+    failed = len(pairs) - len(load_batch_checkpoint(checkpoint_path, pairs))
+    if failed:
+        logger.info(f"{failed} of {len(pairs)} questions failed; rerun the same command to retry them.")
+    else:
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        logger.info(f"Answered {len(pairs)} questions into {output_path}")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of (query, user_role) pairs.")
+    parser.add_argument("--input", required=True, help="JSONL file with one {\"query\", \"user_role\"} object per line.")
+    parser.add_argument("--output", required=True, help="JSONL file to write the answers to.")
+    parser.add_argument("--checkpoint", help=f"Checkpoint file (default: <output>{CHECKPOINT_SUFFIX}).")
+    parser.add_argument("--workers", type=int, default=MAX_CONCURRENT_LLM_CALLS, help="Concurrent LLM calls.")
+    args = parser.parse_args()
+
+    try:
+        failed = run(args.input, args.output, args.checkpoint, args.workers)
+    except (FileNotFoundError, ValueError) as e:
+        logger.info(f"Error reading requests from {args.input}: {e}")
+        sys.exit(1)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,156 @@
+# secure-rag/app/bm25_index.py
+
+import json
+import os
+import re
+from collections import Counter
+from collections.abc import Iterable
+
+import numpy as np
+
+# --- 配置 ---
+BM25_DIR = "bm25" # 保存在向量存储目录中的子目录 (必须与 indexing.py 保持一致)
+BM25_MANIFEST = "bm25.json" # 参数和词表
+INDPTR_FILE = "indptr.npy" # int64[V + 1]，词 t 的倒排列表为 postings[indptr[t]:indptr[t + 1]]
+POSTINGS_FILE = "postings.npy" # int32，块的行号 (即 FAISS id)
+TERM_FREQS_FILE = "term_freqs.npy" # float32，与 postings 对齐的词频
+DOC_LENGTHS_FILE = "doc_lengths.npy" # float32[N]，每个块的词数
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TOKEN_LENGTH = 64 # 更长的 "词" 多半是编码数据，不进入词表
+
+# 英文/数字词可以包含内部的 - _ . (例如 API 名称、政策编号 POL-7731、版本号 v2.1)；
+# 中文按单字切分，使没有分词器时也能匹配中文术语
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*|[\u4e00-\u9fff]")
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+class BM25Index:
+    """
+    以 CSR 数组存储倒排列表的 BM25 索引。
+
+    行号与 FAISS id 一致，因此可以直接使用同一个角色位掩码过滤。查询时只
+    访问查询词的倒排列表，用 NumPy 累加得分，不会逐个遍历语料中的块。
+    """
+
+    def __init__(self, vocabulary: dict[str, int], indptr: np.ndarray, postings: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, k1: float = BM25_K1, b: float = BM25_B):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.postings = postings
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(doc_lengths)
+        self.avg_doc_length = float(np.mean(doc_lengths)) if self.n_docs else 0.0
+        # 非负的 Lucene 风格 IDF
+        doc_freqs = np.diff(indptr).astype(np.float32)
+        self.idf = np.log1p((self.n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        """按给定顺序为每段文本建立一行 (第 i 段文本即第 i 行)。"""
+        vocabulary: dict[str, int] = {}
+        term_ids: list[int] = []
+        rows: list[int] = []
+        freqs: list[int] = []
+        doc_lengths: list[int] = []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                rows.append(row)
+                freqs.append(freq)
+
+        term_ids_array = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids_array, kind='stable') # 同一个词内保持行号递增
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids_array, minlength=len(vocabulary)), out=indptr[1:])
+        return cls(
+            vocabulary,
+            indptr,
+            np.asarray(rows, dtype=np.int32)[order],
+            np.asarray(freqs, dtype=np.float32)[order],
+            np.asarray(doc_lengths, dtype=np.float32),
+            k1, b,
+        )
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, INDPTR_FILE), self.indptr)
+        np.save(os.path.join(path, POSTINGS_FILE), self.postings)
+        np.save(os.path.join(path, TERM_FREQS_FILE), self.term_freqs)
+        np.save(os.path.join(path, DOC_LENGTHS_FILE), self.doc_lengths)
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(os.path.join(path, BM25_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({"k1": self.k1, "b": self.b, "terms": terms}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = 'r') -> "BM25Index | None":
+        """加载 BM25 索引；向量存储是在没有 BM25 索引时构建的，则返回 None。"""
+        manifest_path = os.path.join(path, BM25_MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return cls(
+            {term: i for i, term in enumerate(manifest["terms"])},
+            np.load(os.path.join(path, INDPTR_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, POSTINGS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, TERM_FREQS_FILE), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, DOC_LENGTHS_FILE), mmap_mode=mmap_mode),
+            manifest["k1"], manifest["b"],
+        )
+
+    def search(self, query: str, k: int, allowed: np.ndarray | None = None) -> list[tuple[int, float]]:
+        """
+        返回 BM25 得分最高的至多 k 个 (行号, 得分)，得分从高到低。
+
+        allowed 为布尔数组时只考虑其中为 True 的行；不含任何查询词的行不会返回。
+        """
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids or k <= 0:
+            return []
+
+        rows_parts, score_parts = [], []
+        for t in term_ids:
+            start, end = self.indptr[t], self.indptr[t + 1]
+            rows = np.asarray(self.postings[start:end])
+            tf = np.asarray(self.term_freqs[start:end])
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[rows] / self.avg_doc_length)
+            rows_parts.append(rows)
+            score_parts.append(self.idf[t] * tf * (self.k1 + 1) / (tf + norm))
+
+        rows = np.concatenate(rows_parts)
+        scores = np.concatenate(score_parts)
+        if allowed is not None:
+            keep = allowed[rows]
+            rows, scores = rows[keep], scores[keep]
+            if len(rows) == 0:
+                return []
+
+        # 同一行可能命中多个查询词，按行汇总得分
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+        top = np.argpartition(-totals, min(k, len(totals)) - 1)[:k]
+        top = top[np.argsort(-totals[top], kind='stable')]
+        return [(int(unique_rows[i]), float(totals[i])) for i in top]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int, rrf_k: int = 60) -> list[str]:
+    """
+    用倒数排名融合 (RRF) 合并多个排序列表，返回得分最高的 k 个键。
+
+    每个键的得分为 sum(1 / (rrf_k + rank))，rank 从 1 开始；只依赖名次，
+    因此 L2 距离和 BM25 得分无需归一化即可合并。
+    """
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda key: -scores[key])[:k]
@@ -0,0 +1,170 @@
+# secure-rag/app/context_packing.py
+
+import math
+import re
+from dataclasses import dataclass, field
+
+from langchain_core.documents import Document
+
+# --- 配置 ---
+CONTEXT_TOKEN_BUDGET = 3000 # 提示中上下文部分的 token 上限
+MIN_OVERLAP_CHARS = 20 # 两个块首尾至少重叠这么多字符才视为相邻块
+MAX_OVERLAP_CHARS = 400 # 只在块尾这么长的范围内寻找重叠 (应大于 indexing.py 中 CHUNK_OVERLAP 个 token 对应的字符数)
+MIN_TRUNCATED_TOKENS = 50 # 剩余预算少于此值时不再截断放入下一段
+SEPARATOR = "\n\n"
+TRUNCATION_MARK = " ..."
+
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计 token 数，无需加载分词器。
+
+    ASCII 文本按约 4 个字符一个 token 计算，非 ASCII 字符 (例如中文) 按
+    每个字符一个 token 计算；对 Gemini 的分词结果通常偏高，因此预算是保守的。
+    """
+    non_ascii = len(_NON_ASCII_RE.findall(text))
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+@dataclass
+class Segment:
+    """同一来源的一段连续文本，由一个或多个块合并而成。"""
+    source: str
+    text: str
+    rank: int # 成员块中最好的检索名次 (0 最好)
+    documents: list[Document] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    """打包后的上下文及其统计。"""
+    text: str
+    segments: list[Segment]
+    tokens: int # 打包后的估计 token 数
+    original_tokens: int # 直接拼接所有块时的估计 token 数
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.original_tokens - self.tokens)
+
+    @property
+    def documents(self) -> list[Document]:
+        """实际进入上下文的块。"""
+        return [doc for segment in self.segments for doc in segment.documents]
+
+    def stats(self) -> dict:
+        return {
+            "segments": len(self.segments),
+            "documents": len(self.documents),
+            "tokens": self.tokens,
+            "original_tokens": self.original_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+def source_of(doc: Document) -> str:
+    return str(doc.metadata.get("title") or doc.metadata.get("source") or "")
+
+
+def overlap_length(left: str, right: str) -> int:
+    """返回 left 的后缀与 right 的前缀最长的重叠长度 (不足 MIN_OVERLAP_CHARS 时为 0)。"""
+    if len(left) < MIN_OVERLAP_CHARS or len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = right[:MIN_OVERLAP_CHARS]
+    start = max(0, len(left) - MAX_OVERLAP_CHARS)
+    while (i := left.find(probe, start)) != -1:
+        # 候选重叠必须一直延伸到 left 的末尾
+        if right.startswith(left[i:]):
+            return len(left) - i
+        start = i + 1
+    return 0
+
+
+def _try_merge(left: Segment, right: Segment) -> bool:
+    """把 right 并入 left (重复、被包含或首尾重叠时)，返回是否合并。"""
+    if left.source != right.source:
+        return False
+    if right.text in left.text:
+        pass
+    elif left.text in right.text:
+        left.text = right.text
+    elif n := overlap_length(left.text, right.text):
+        left.text += right.text[n:]
+    elif n := overlap_length(right.text, left.text):
+        left.text = right.text + left.text[n:]
+    else:
+        return False
+    left.documents.extend(right.documents)
+    left.rank = min(left.rank, right.rank)
+    return True
+
+
+def merge_segments(docs: list[Document]) -> list[Segment]:
+    """
+    把同一来源的块合并成段，按最好的名次排序。
+
+    合并是反复进行的: 块 A 和 C 不相邻，但块 B 到达后可以把三者连成一段。
+    """
+    segments = [Segment(source_of(doc), doc.page_content, rank, [doc]) for rank, doc in enumerate(docs)]
+    merged = True
+    while merged:
+        merged = False
+        for i, left in enumerate(segments):
+            for j in range(i + 1, len(segments)):
+                if _try_merge(left, segments[j]):
+                    del segments[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return sorted(segments, key=lambda segment: segment.rank)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """把文本截断到至多 max_tokens 个 token (含省略标记)，尽量在空白处断开。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_tokens -= estimate_tokens(TRUNCATION_MARK)
+    cut = text
+    while estimate_tokens(cut) > max_tokens:
+        cut = cut[:max(0, int(len(cut) * max_tokens / estimate_tokens(cut)))]
+    if cut:
+        space = cut.rfind(" ", len(cut) // 2)
+        if space > 0:
+            cut = cut[:space]
+    return cut + TRUNCATION_MARK
+
+
+def pack_context(docs: list[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """
+    把检索到的块组装成提示上下文。
+
+    docs 按检索得分从高到低排列。同一来源中重复、被包含或首尾重叠的块
+    (RecursiveCharacterTextSplitter 的 chunk_overlap) 合并为一段，去掉重复的
+    重叠文本；各段按其中最好的名次排序，依次放入直到用完 token_budget。
+    放不下的段会被跳过，让后面较短的段仍有机会放入；如果剩余预算足够，
+    第一个放不下的段会被截断放入。
+    """
+    original_tokens = estimate_tokens(SEPARATOR.join(doc.page_content for doc in docs))
+
+    packed: list[Segment] = []
+    used = 0
+    truncated = False
+    for segment in merge_segments(docs):
+        separator_tokens = estimate_tokens(SEPARATOR) if packed else 0
+        cost = estimate_tokens(segment.text) + separator_tokens
+        if used + cost <= token_budget:
+            packed.append(segment)
+            used += cost
+            continue
+        remaining = token_budget - used - separator_tokens
+        if not truncated and remaining >= MIN_TRUNCATED_TOKENS:
+            segment.text = _truncate(segment.text, remaining)
+            packed.append(segment)
+            used += estimate_tokens(segment.text) + separator_tokens
+            truncated = True
+
+    text = SEPARATOR.join(segment.text for segment in packed)
+    return PackedContext(text=text, segments=packed, tokens=estimate_tokens(text), original_tokens=original_tokens)
@@ -0,0 +1,191 @@
+# secure-rag/app/embedding_cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+EMBEDDING_CACHE_PATH = "../embedding_cache.sqlite" # 相对于此脚本 (app/) 的路径
+MAX_MEMORY_ITEMS = 10000 # 内存 LRU 中最多保留的向量数
+
+
+def resolve_cache_path(cache_path: str) -> str:
+    """将相对路径解析为相对于 app/ 目录的绝对路径 (与向量存储路径的处理方式一致)。"""
+    if os.path.isabs(cache_path):
+        return cache_path
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.normpath(os.path.join(current_dir, cache_path))
+
+
+def embed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """
+    批量嵌入多个查询。
+
+    Embeddings 接口只有逐条的 embed_query；Google 嵌入模型可以用 embed_documents
+    加上查询的 task_type 一次请求嵌入整批查询，结果与 embed_query 相同。
+    其他嵌入对象退回逐条调用。
+    """
+    if not texts:
+        return []
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    if isinstance(embeddings, GoogleGenerativeAIEmbeddings):
+        return embeddings.embed_documents(texts, task_type=embeddings.task_type or "RETRIEVAL_QUERY")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    为任意 Embeddings 对象加上持久化缓存。
+
+    缓存键为 (模型名, 调用类型, sha256(文本))。调用类型区分 embed_query 与
+    embed_documents，因为 Google 嵌入模型对查询和文档使用不同的 task_type，
+    同一文本的两种向量并不相同。查找顺序: 内存 LRU -> SQLite -> 上游模型。
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_path: str = EMBEDDING_CACHE_PATH,
+                 max_memory_items: int = MAX_MEMORY_ITEMS):
+        """
+        Args:
+            embeddings: 实际计算向量的嵌入对象。
+            model_name: 嵌入模型名称，作为缓存键的一部分。
+            cache_path: SQLite 缓存文件的路径；":memory:" 表示不落盘。
+            max_memory_items: 内存 LRU 的容量。
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[tuple[str, str], list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_path != ":memory:":
+            cache_path = resolve_cache_path(cache_path)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, kind TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, kind, text_hash))"
+        )
+        self._db.commit()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """嵌入文档，只把缓存中没有的文本发送给上游模型。"""
+        keys = [("document", self._hash(text)) for text in texts]
+        vectors = self._lookup(keys)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            # 同一批次中重复的文本只嵌入一次
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            self._store([(("document", self._hash(text)), computed[text]) for text in unique_texts])
+            for i in missing:
+                vectors[i] = list(computed[texts[i]])
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        """嵌入查询；重复的问题直接从内存 LRU 返回。"""
+        key = ("query", self._hash(text))
+        vector = self._lookup([key])[0]
+        if vector is None:
+            vector = list(self.embeddings.embed_query(text))
+            self._store([(key, vector)])
+        return vector
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """批量嵌入查询 (见 embed_queries)，只把缓存中没有的查询发送给上游模型。"""
+        keys = [("query", self._hash(text)) for text in texts]
+        vectors = self._lookup(keys)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = dict(zip(unique_texts, embed_queries(self.embeddings, unique_texts)))
+            self._store([(("query", self._hash(text)), computed[text]) for text in unique_texts])
+            for i in missing:
+                vectors[i] = list(computed[texts[i]])
+        return vectors
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """embed_query 的异步版本；未命中时使用上游模型的异步接口。"""
+        key = ("query", self._hash(text))
+        vector = self._lookup([key])[0]
+        if vector is None:
+            vector = list(await self.embeddings.aembed_query(text))
+            self._store([(key, vector)])
+        return vector
+
+    def stats(self) -> dict:
+        """返回命中/未命中计数和命中率。"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def _hash(self, text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys: list[tuple[str, str]]) -> list[list[float] | None]:
+        """先查内存 LRU，再批量查询 SQLite，并把磁盘命中提升到内存中。"""
+        vectors: list[list[float] | None] = [None] * len(keys)
+        disk_lookups = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                else:
+                    disk_lookups.append(i)
+
+            for i in disk_lookups:
+                kind, text_hash = keys[i]
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND kind = ? AND text_hash = ?",
+                    (self.model_name, kind, text_hash)
+                ).fetchone()
+                if row is not None:
+                    vectors[i] = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._remember(keys[i], vectors[i])
+
+            found = sum(vector is not None for vector in vectors)
+            self.hits += found
+            self.misses += len(keys) - found
+        return vectors
+
+    def _store(self, items: list[tuple[tuple[str, str], list[float]]]):
+        """把新计算的向量写入 SQLite 和内存 LRU。"""
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, kind, text_hash, vector) VALUES (?, ?, ?, ?)",
+                [
+                    (self.model_name, kind, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                    for (kind, text_hash), vector in items
+                ]
+            )
+            self._db.commit()
+            for key, vector in items:
+                self._remember(key, list(vector))
+
+    def _remember(self, key: tuple[str, str], vector: list[float]):
+        """放入内存 LRU，超出容量时淘汰最久未使用的条目 (调用方需持有锁)。"""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
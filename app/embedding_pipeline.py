@@ -0,0 +1,126 @@
+# secure-rag/app/embedding_pipeline.py
+
+import itertools
+import random
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100 # Chunks sent to the embedding API per request
+MAX_WORKERS = 4 # Batches in flight at the same time
+MAX_RETRIES = 5 # Attempts per batch after the first failure
+BACKOFF_SECONDS = 1.0 # Base delay of the exponential backoff
+RATE_LIMIT_BACKOFF_SECONDS = 10.0 # Base delay when the API reports a quota / rate-limit error
+
+RATE_LIMIT_MARKERS = ("429", "resource_exhausted", "resourceexhausted", "quota", "rate limit")
+
+
+@dataclass
+class PipelineResult:
+    """Outcome of embedding a stream of chunks into a FAISS vector store."""
+    vectorstore: FAISS | None
+    embedded: int = 0 # Number of chunks added to the index
+    failed: list[Document] = field(default_factory=list)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Returns True if the error looks like an API quota or rate-limit rejection."""
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in RATE_LIMIT_MARKERS)
+
+
+def batched(chunks: Iterable[Document], batch_size: int) -> Iterator[list[Document]]:
+    """Groups chunks into lists of at most batch_size items without materializing the whole stream."""
+    iterator = iter(chunks)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def embed_with_retry(embeddings: Embeddings, texts: list[str], max_retries: int = MAX_RETRIES,
+                     sleep: Callable[[float], None] = time.sleep) -> list[list[float]]:
+    """
+    Embeds one batch, retrying with jittered exponential backoff.
+
+    Rate-limit errors back off from RATE_LIMIT_BACKOFF_SECONDS so the quota
+    window has time to reset; other errors use the shorter BACKOFF_SECONDS.
+    """
+    for attempt in itertools.count():
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            base = RATE_LIMIT_BACKOFF_SECONDS if is_rate_limit_error(e) else BACKOFF_SECONDS
+            delay = base * (2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.info(f"Embedding batch of {len(texts)} failed (attempt {attempt + 1}), retrying in {delay:.1f}s: {e}")
+            sleep(delay)
+
+
+def add_chunks(vectorstore: FAISS | None, chunks: Iterable[Document], embeddings: Embeddings,
+               batch_size: int = BATCH_SIZE, max_workers: int = MAX_WORKERS, max_retries: int = MAX_RETRIES,
+               sleep: Callable[[float], None] = time.sleep) -> PipelineResult:
+    """
+    Embeds chunks in concurrent batches and adds each batch to the index as soon as it finishes.
+
+    At most max_workers batches are in flight, so the chunk stream is consumed
+    lazily. A batch that still fails after its retries is reported in
+    PipelineResult.failed instead of aborting the run; the caller can save the
+    partial index and embed the remaining chunks later with an incremental run.
+    Chunks are expected to carry a 'chunk_id' in their metadata.
+
+    Args:
+        vectorstore: The store to extend, or None to create one from the first finished batch.
+        chunks: The chunks to embed.
+        embeddings: The embedding model.
+    """
+    result = PipelineResult(vectorstore=vectorstore)
+    batches = batched(chunks, batch_size)
+
+    def add_batch(batch: list[Document], vectors: list[list[float]]):
+        text_embeddings = list(zip([c.page_content for c in batch], vectors))
+        metadatas = [c.metadata for c in batch]
+        ids = [c.metadata["chunk_id"] for c in batch]
+        if result.vectorstore is None:
+            result.vectorstore = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+        else:
+            result.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        result.embedded += len(batch)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight: dict[Future, list[Document]] = {}
+
+        def submit_next() -> bool:
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            texts = [c.page_content for c in batch]
+            in_flight[executor.submit(embed_with_retry, embeddings, texts, max_retries, sleep)] = batch
+            return True
+
+        for _ in range(max_workers):
+            if not submit_next():
+                break
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                try:
+                    # FAISS is only mutated from this thread, never from the workers
+                    add_batch(batch, future.result())
+                except Exception as e:
+                    logger.info(f"Giving up on a batch of {len(batch)} chunks: {e}")
+                    result.failed.extend(batch)
+                submit_next()
+
+    logger.info(f"Embedded {result.embedded} chunks, {len(result.failed)} failed.")
+    return result
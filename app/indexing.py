@@ -1,15 +1,41 @@
 # secure-rag/app/indexing.py
 
+import argparse
+import hashlib
 import json
 import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
+from typing import TextIO
 from langchain_community.vectorstores import FAISS
 
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
 
 from dotenv import load_dotenv
 import logging
+
+# Add project root directory to Python path so this script can import the 'app' package
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.ann_index import IndexSpec, convert_index, load_index_spec, resolve_spec, save_index_spec
+from app.bm25_index import BM25_DIR, BM25Index
+from app.context_packing import estimate_tokens
+from app.embedding_cache import EMBEDDING_CACHE_PATH, CachedEmbeddings
+from app.embedding_pipeline import add_chunks
+from app.permissions import PermissionIndex
+from app.retriever import build_embeddings
+from app.serving_store import SERVING_DIR, VECTOR_DTYPES, stored_vector_dtype, write_serving_store
+
 load_dotenv() # Load environment variables from .env file
 
 # Configure logging
@@ -18,17 +44,132 @@ logger = logging.getLogger(__name__)
 
 DATA_PATH = "../data/docs.json" # Path relative to this script
 VECTORSTORE_PATH = "../vectorstore" # Directory to save the FAISS index
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 150
+CHUNK_SIZE = 256 # Tokens per chunk
+CHUNK_OVERLAP = 40 # Tokens shared by neighbouring chunks of a document
+TOKENIZER = "cl100k_base" # tiktoken encoding used to size chunks (a local estimate is used if it cannot be loaded)
+# Split on paragraphs first, then lines, sentences (Chinese and Latin) and words
+CHUNK_SEPARATORS = ["\n\n", "\n", "。", ". ", " ", ""]
+CHUNK_WORKERS = os.cpu_count() or 1 # Processes used to split documents
+CHUNK_BATCH_DOCS = 64 # Documents sent to a splitting process at a time
+READ_SIZE = 1 << 16 # Characters read at a time when streaming a JSON export
+
+MANIFEST_FILE = "manifest.json" # Chunk content hashes per document, used for incremental updates
+VERSION_FILE = "version.json" # Identifies each saved index so serving processes can hot-reload it (must match retriever.py)
+
+# Layout of a permission-partitioned vector store (must match retriever.py)
+PARTITIONS_MANIFEST = "partitions.json" # Lists every partition and the roles allowed to read it
+PARTITIONS_DIR = "partitions" # Sub-directory holding one FAISS index per permission set
+
+# Scan precision of the serving copy: float32, or float16 / int8 with exact float32 re-scoring (flat indexes only)
+SERVING_VECTOR_DTYPE = "float32"
 
 # Use a standard Google embedding model compatible with the Gemini API
 GOOGLE_EMBEDDING_MODEL = "models/embedding-001"
 
+def validate_record(item) -> Document | None:
+    """Validates one raw record and turns it into a Document, or returns None if it is unusable."""
+    if not isinstance(item, dict):
+        logger.info(f"Warning: Skipping record that is not a JSON object: {str(item)[:80]}")
+        return None
+    if not all(k in item for k in ["title", "content", "permission"]):
+        logger.info(f"Warning: Skipping item due to missing fields: {item.get('title', 'N/A')}")
+        return None
+    if not isinstance(item["title"], str) or not isinstance(item["content"], str):
+        logger.info(f"Warning: Skipping item with non-string title or content: {item.get('title', 'N/A')}")
+        return None
+    permission = item["permission"]
+    if not isinstance(permission, list) or not all(isinstance(role, str) for role in permission):
+        logger.info(f"Warning: Skipping item whose permission is not a list of role names: {item['title']}")
+        return None
+    deny = item.get("deny", [])
+    if not isinstance(deny, list) or not all(isinstance(role, str) for role in deny):
+        logger.info(f"Warning: Skipping item whose deny is not a list of role names: {item['title']}")
+        return None
+
+    metadata = {
+        "title": item["title"],
+        "category": item.get("category", "Uncategorized"),
+        "permission": permission
+    }
+    if deny:
+        # Roles/groups that may never read the document, even if they also hold an allowed role
+        metadata["deny"] = deny
+    if isinstance(item.get("id"), (str, int)) and not isinstance(item["id"], bool):
+        # Stable document id used in chunk ids; defaults to the title
+        metadata["doc_id"] = str(item["id"])
+    return Document(page_content=item["content"], metadata=metadata)
+
+def iter_json_array(f: TextIO, read_size: int = READ_SIZE) -> Iterator:
+    """
+    Yields the elements of a top-level JSON array one by one.
+
+    Only the current element and at most read_size characters of look-ahead
+    are held in memory, so arbitrarily large exports can be parsed.
+
+    Raises:
+        json.JSONDecodeError: The file is not a JSON array or is truncated.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    started = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise json.JSONDecodeError("Expected a JSON array", buffer, 0)
+            buffer = buffer[1:].lstrip()
+            started = True
+        if started and buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if started and buffer.startswith(']'):
+            return
+        try:
+            if not started or not buffer:
+                raise json.JSONDecodeError("Need more data", buffer, 0)
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(read_size)
+            eof = not more
+            buffer += more
+            continue
+        yield item
+        buffer = buffer[end:]
+
+def iter_jsonl(f) -> Iterator:
+    """Yields the JSON value on each non-empty line, skipping (and logging) lines that do not parse."""
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            logger.info(f"Warning: Skipping line {line_number} that is not valid JSON: {e}")
+
+def iter_docs(file_path: str) -> Iterator[Document]:
+    """
+    Streams valid Documents from a JSON array file or, for '.jsonl' files, one JSON object per line.
+
+    Invalid records (including unparsable JSONL lines) are logged and skipped.
+    Raises FileNotFoundError or json.JSONDecodeError if the file is missing or
+    is a malformed JSON array.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        if file_path.endswith(".jsonl"):
+            records = iter_jsonl(f)
+        else:
+            records = iter_json_array(f)
+        for item in records:
+            doc = validate_record(item)
+            if doc is not None:
+                yield doc
+
 def load_docs_from_json(file_path: str) -> list[Document]:
     """Loads documents from a JSON file and creates LangChain Document objects."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        langchain_docs = list(iter_docs(file_path))
     except FileNotFoundError:
         logger.info(f"Error: The file {file_path} was not found.")
         return []
@@ -36,67 +177,462 @@ def load_docs_from_json(file_path: str) -> list[Document]:
         logger.info(f"Error: Could not decode JSON from the file {file_path}.")
         return []
 
-    langchain_docs = []
-    for item in data:
-        if not all(k in item for k in ["title", "content", "permission"]):
-            logger.info(f"Warning: Skipping item due to missing fields: {item.get('title', 'N/A')}")
-            continue
-            
-        metadata = {
-            "title": item.get("title", "Unknown Title"),
-            "category": item.get("category", "Uncategorized"),
-            "permission": item["permission"] 
-        }
-        
-        doc = Document(page_content=item["content"], metadata=metadata)
-        langchain_docs.append(doc)
-        
     logger.info(f"Loaded {len(langchain_docs)} documents from {file_path}")
     return langchain_docs
 
-def create_and_save_vectorstore(docs: list[Document], save_path: str):
-    """Creates and saves a FAISS vector store from documents using Google Embeddings."""
-    if not docs:
-        logger.info("No documents loaded, skipping vector store creation.")
-        return
+def init_embeddings(cache_path: str | None = EMBEDDING_CACHE_PATH) -> Embeddings | None:
+    """
+    Initializes the Google embedding model, returning None if it cannot be created.
 
-    logger.info(f"Processing {len(docs)} documents for vectorization...")
-    
-    # 1. Split Documents into Chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len
-    )
-    chunks = text_splitter.split_documents(docs)
-    logger.info(f"Split documents into {len(chunks)} chunks.")
-
-    # 2. Initialize Embedding Model (Using Google)
+    The model is built like the query-side embeddings (see
+    retriever.build_embeddings), so it goes through the resilient model
+    client unless model_client.USE_RESILIENT_CLIENT is False. Unless
+    cache_path is None, it is wrapped in an on-disk embedding cache so
+    identical chunks are never sent to the API twice.
+    """
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL)
+        return build_embeddings(GOOGLE_EMBEDDING_MODEL, cache_path)
     except Exception as e:
         logger.info(f"Error initializing Google Embeddings. Ensure GOOGLE_API_KEY is set correctly. Error: {e}")
+        return None
+
+_tokenizers: dict[str, tuple[str, Callable[[str], int]]] = {}
+_splitters: dict[str, RecursiveCharacterTextSplitter] = {}
+
+def load_tokenizer(name: str = TOKENIZER) -> tuple[str, Callable[[str], int]]:
+    """
+    Returns (tokenizer id, token count function) used to size chunks.
+
+    tiktoken downloads its encoding once and caches it (see TIKTOKEN_CACHE_DIR);
+    if it cannot be loaded, e.g. offline, chunks are sized with the local
+    estimate_tokens instead. The id is recorded in the manifest, so an index
+    split with one tokenizer is rebuilt rather than updated with the other.
+    """
+    if name == "estimate":
+        return name, estimate_tokens
+    if name not in _tokenizers:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(name)
+            _tokenizers[name] = (f"tiktoken:{name}", lambda text: len(encoding.encode(text, disallowed_special=())))
+        except Exception as e:
+            logger.info(f"Warning: Could not load the {name} tokenizer, sizing chunks with a local estimate. Error: {e}")
+            _tokenizers[name] = ("estimate", estimate_tokens)
+    return _tokenizers[name]
+
+def _splitter(tokenizer_id: str) -> RecursiveCharacterTextSplitter:
+    if tokenizer_id not in _splitters:
+        _, length_function = load_tokenizer(tokenizer_id.removeprefix("tiktoken:"))
+        _splitters[tokenizer_id] = RecursiveCharacterTextSplitter(
+            separators=CHUNK_SEPARATORS,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=length_function
+        )
+    return _splitters[tokenizer_id]
+
+def content_hash(text: str, metadata: dict) -> str:
+    payload = json.dumps([text, metadata], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def chunk_id(doc_id: str, start: int, text: str, metadata: dict) -> str:
+    """
+    Returns a deterministic chunk id: "<doc id hash>-<start offset>-<content hash>".
+
+    The content hash covers the chunk text and the document metadata, so a
+    chunk gets a new id (and is re-embedded by incremental updates) when its
+    text, permissions or any other metadata change.
+    """
+    doc_key = hashlib.sha256(doc_id.encode('utf-8')).hexdigest()[:16]
+    return f"{doc_key}-{start}-{content_hash(text, metadata)[:32]}"
+
+def split_documents(docs: list[Document], tokenizer_id: str) -> list[Document]:
+    """
+    Splits documents into token-sized chunks. Runs in the chunking worker processes.
+
+    Each chunk's metadata gets the document id ('doc_id', the record id or
+    title), its character offsets in the document ('start_index' and
+    'end_index') and its 'chunk_id'.
+    """
+    text_splitter = _splitter(tokenizer_id)
+    chunks = []
+    for doc in docs:
+        doc_id = str(doc.metadata.get("doc_id") or doc.metadata.get("title", ""))
+        metadata = {**doc.metadata, "doc_id": doc_id}
+        start = -1
+        for text in text_splitter.split_text(doc.page_content):
+            # Chunks come in document order and overlap, so each one starts after the previous start
+            start = doc.page_content.find(text, start + 1)
+            chunks.append(Document(page_content=text, metadata={
+                **metadata,
+                "start_index": start,
+                "end_index": start + len(text),
+                "chunk_id": chunk_id(doc_id, start, text, metadata),
+            }))
+    return chunks
+
+def _split_batches(docs: Iterable[Document], tokenizer_id: str, workers: int) -> Iterator[list[Document]]:
+    """Yields the chunks of each batch of CHUNK_BATCH_DOCS documents, in document order."""
+    doc_iter = iter(docs)
+    batches = iter(lambda: list(islice(doc_iter, CHUNK_BATCH_DOCS)), [])
+    head = list(islice(batches, 2))
+    if len(head) < 2 or workers <= 1:
+        # A single batch is split in-process; starting worker processes would cost more than it saves
+        for batch in chain(head, batches):
+            yield split_documents(batch, tokenizer_id)
         return
 
-    # 3. Create FAISS Vector Store
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Bounded look-ahead keeps every worker busy without reading the whole corpus into memory
+        pending = deque()
+        for batch in chain(head, batches):
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(pool.submit(split_documents, batch, tokenizer_id))
+        while pending:
+            yield pending.popleft().result()
+
+def iter_chunks(docs: Iterable[Document], workers: int = CHUNK_WORKERS) -> Iterator[Document]:
+    """
+    Lazily splits documents into chunks across a pool of worker processes.
+
+    Chunks are sized in tokens (see load_tokenizer) and yielded in document
+    order, so the resulting index is the same for any number of workers.
+    Exact duplicates (same text and same permission / deny lists, e.g. a
+    disclaimer repeated across documents) are dropped, so no text is
+    embedded twice for the same readers; the first occurrence is kept.
+    """
+    tokenizer_id, _ = load_tokenizer()
+    seen = set()
+    for chunks in _split_batches(docs, tokenizer_id, workers):
+        for chunk in chunks:
+            key = content_hash(chunk.page_content, {
+                "permission": sorted(chunk.metadata.get("permission") or []),
+                "deny": sorted(chunk.metadata.get("deny") or []),
+            })
+            if key in seen:
+                continue
+            seen.add(key)
+            yield chunk
+
+def manifest_settings() -> dict:
+    """Settings that must match for an existing index to be updated incrementally."""
+    return {
+        "embedding_model": GOOGLE_EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "tokenizer": load_tokenizer()[0],
+    }
+
+def build_manifest(vectorstore: FAISS) -> dict:
+    """Builds the manifest that records which chunk hashes are in the index, grouped by document."""
+    documents: dict[str, list[str]] = {}
+    for docstore_id in vectorstore.index_to_docstore_id.values():
+        chunk = vectorstore.docstore.search(docstore_id)
+        doc_id = chunk.metadata.get("doc_id") or chunk.metadata.get("title", "Unknown Title")
+        documents.setdefault(doc_id, []).append(chunk.metadata["chunk_id"])
+    return {**manifest_settings(), "documents": documents}
+
+def load_manifest(save_path: str) -> dict | None:
+    """Loads the chunk manifest of an existing vector store, or None if there is none."""
+    manifest_path = os.path.join(save_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_version(path: str) -> str:
+    """Writes a new, unique version id for the index being saved at path and returns it."""
+    version = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(path, VERSION_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"version": version, "created_at": time.time()}, f)
+    return version
+
+def replace_directory(tmp_path: str, save_path: str):
+    """Moves a fully written directory into place, so readers never see a half-written index."""
+    old_path = None
+    if os.path.exists(save_path):
+        old_path = f"{save_path}.old-{uuid.uuid4().hex[:8]}"
+        os.rename(save_path, old_path)
+    os.rename(tmp_path, save_path)
+    if old_path:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+def save_vectorstore(vectorstore: FAISS, save_path: str, index_spec: IndexSpec | None = None,
+                     vector_dtype: str | None = None):
+    """
+    Writes the index, its spec, role bitmask, BM25 index, chunk manifest and read-only
+    serving copy to a temporary directory, then swaps it in.
+
+    index_spec describes vectorstore.index (see build_index_for_store); None means a flat index.
+    vector_dtype selects the serving copy's scan vectors (see write_serving_store); None keeps
+    the type of the index being replaced, or SERVING_VECTOR_DTYPE for a new one.
+    """
+    save_path = os.path.abspath(save_path)
+    vector_dtype = vector_dtype or stored_vector_dtype(os.path.join(save_path, SERVING_DIR)) or SERVING_VECTOR_DTYPE
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".vectorstore-new-", dir=os.path.dirname(save_path))
+    try:
+        vectorstore.save_local(tmp_path)
+        index_spec = index_spec or IndexSpec()
+        if index_spec.factory is None:
+            index_spec = resolve_spec(index_spec, vectorstore.index.ntotal, vectorstore.index.d)
+        save_index_spec(tmp_path, index_spec)
+
+        # Save the per-vector allow/deny bitsets used by the retriever's pre-filter
+        permissions = PermissionIndex.from_vectorstore(vectorstore)
+        permissions.save(tmp_path)
+        logger.info(f"Saved role bitmask for {len(permissions)} vectors and {len(permissions.role_bits)} roles/groups"
+                    f"{' with deny rules' if permissions.deny is not None else ''}.")
+
+        # Lexical index over the same rows, fused with the vector results by the retriever
+        BM25Index.build(
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content
+            for i in range(vectorstore.index.ntotal)
+        ).save(os.path.join(tmp_path, BM25_DIR))
+
+        # Memory-mapped copy that retriever processes open without unpickling the docstore
+        write_serving_store(vectorstore, os.path.join(tmp_path, SERVING_DIR), vector_dtype)
+
+        # The manifest lists only chunks that are actually in the index, so a rerun picks up failures
+        with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(build_manifest(vectorstore), f, ensure_ascii=False, indent=2)
+
+        # Written last: a new version id tells serving processes a complete index is ready to load
+        write_version(tmp_path)
+
+        # The new directory replaces everything, including any earlier partitioned build
+        replace_directory(tmp_path, save_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+def build_index_for_store(vectorstore: FAISS, index_spec: IndexSpec | None) -> IndexSpec:
+    """
+    Replaces the store's flat index with the ANN index described by index_spec.
+
+    Chunks are always embedded into a flat index first; its vectors are then
+    used to train (on a sample) and fill the requested index in the same id
+    order, so the docstore mapping stays valid. Returns the resolved spec.
+    """
+    index_spec = index_spec or IndexSpec()
+    if index_spec.kind == "flat":
+        return resolve_spec(index_spec, vectorstore.index.ntotal, vectorstore.index.d)
+    vectorstore.index, index_spec = convert_index(vectorstore.index, index_spec)
+    logger.info(f"Built {index_spec.factory} index over {vectorstore.index.ntotal} vectors.")
+    return index_spec
+
+def create_and_save_vectorstore(docs: Iterable[Document], save_path: str, embeddings: Embeddings | None = None,
+                                index_spec: IndexSpec | None = None, vector_dtype: str | None = None):
+    """
+    Creates and saves a FAISS vector store from documents using Google Embeddings.
+
+    docs may be a lazy iterator (see iter_docs); documents are split and
+    embedded as they stream in, so only a few batches of chunks are held in
+    memory at a time besides the index itself. index_spec selects the FAISS
+    index type (flat, ivf_flat, ivf_pq or hnsw); the default is an exact flat index.
+    vector_dtype is passed on to save_vectorstore.
+    """
+    if isinstance(docs, list):
+        if not docs:
+            logger.info("No documents loaded, skipping vector store creation.")
+            return
+        logger.info(f"Processing {len(docs)} documents for vectorization...")
+
+    # 1. Initialize Embedding Model (Using Google)
+    if embeddings is None:
+        embeddings = init_embeddings()
+        if embeddings is None:
+            return
+
+    # 2. Split documents lazily and create the FAISS Vector Store, embedding chunks in concurrent batches
     logger.info("Creating FAISS vector store... This might take a moment.")
+    result = add_chunks(None, iter_chunks(docs), embeddings)
+    if result.vectorstore is None:
+        logger.info("Error creating FAISS index: no chunk could be embedded.")
+        return
+    if result.failed:
+        logger.info(f"Warning: {len(result.failed)} chunks could not be embedded. Run with --incremental to resume.")
+
+    # 3. Switch to the requested ANN index type, training it on a sample of the vectors
+    index_spec = build_index_for_store(result.vectorstore, index_spec)
+
+    # 4. Save Vector Store Locally (index, index spec, role bitmask and chunk manifest)
+    save_vectorstore(result.vectorstore, save_path, index_spec, vector_dtype)
+    logger.info(f"FAISS vector store created and saved successfully at {save_path}")
+
+def update_vectorstore(docs: Iterable[Document], save_path: str, embeddings: Embeddings | None = None,
+                       index_spec: IndexSpec | None = None, vector_dtype: str | None = None):
+    """
+    Incrementally updates a saved FAISS vector store.
+
+    Chunks whose content hash is already in the manifest are kept as-is, only
+    new or changed chunks are embedded, and chunks that no longer exist are
+    deleted by id. Falls back to a full rebuild if there is no compatible
+    manifest (first run, partitioned layout, or changed chunking settings),
+    if index_spec asks for a different index type, or if the index is an ANN
+    index: HNSW cannot delete vectors and IVF / PQ centroids should be
+    retrained on the new corpus. The embedding cache keeps such rebuilds cheap.
+    Like create_and_save_vectorstore, docs may be a lazy iterator.
+    """
+    manifest = load_manifest(save_path)
+    if manifest is None or any(manifest.get(key) != value for key, value in manifest_settings().items()):
+        logger.info("No compatible chunk manifest found, running a full rebuild.")
+        create_and_save_vectorstore(docs, save_path, embeddings, index_spec, vector_dtype)
+        return
+
+    stored_spec = load_index_spec(save_path) or IndexSpec()
+    if index_spec is not None and index_spec.kind != stored_spec.kind:
+        logger.info(f"Index type changes from {stored_spec.kind} to {index_spec.kind}, running a full rebuild.")
+        create_and_save_vectorstore(docs, save_path, embeddings, index_spec, vector_dtype)
+        return
+    if stored_spec.kind != "flat":
+        logger.info(f"The {stored_spec.kind} index is rebuilt and retrained on every update, running a full rebuild.")
+        create_and_save_vectorstore(docs, save_path, embeddings, index_spec or stored_spec, vector_dtype)
+        return
+
+    if embeddings is None:
+        embeddings = init_embeddings()
+        if embeddings is None:
+            return
+
     try:
-        vectorstore = FAISS.from_documents(chunks, embeddings)
+        vectorstore = FAISS.load_local(save_path, embeddings, allow_dangerous_deserialization=True)
     except Exception as e:
-         logger.info(f"Error creating FAISS index: {e}")
-         return
+        logger.info(f"Error loading FAISS index for update: {e}")
+        return
+
+    old_ids = {cid for cids in manifest["documents"].values() for cid in cids}
+    current_ids = set()
 
-    # 4. Save Vector Store Locally
+    def new_chunks() -> Iterator[Document]:
+        # Records every current chunk hash while passing only unseen chunks on to the embedder
+        for chunk in iter_chunks(docs):
+            current_ids.add(chunk.metadata["chunk_id"])
+            if chunk.metadata["chunk_id"] not in old_ids:
+                yield chunk
+
+    result = add_chunks(vectorstore, new_chunks(), embeddings)
+    removed = list(old_ids - current_ids)
+    logger.info(f"Incremental update: {result.embedded} new or changed chunks embedded, {len(removed)} removed, {len(current_ids & old_ids)} unchanged.")
+    if result.failed:
+        logger.info(f"Warning: {len(result.failed)} chunks could not be embedded. Run with --incremental again to resume.")
+
+    dtype_changed = vector_dtype is not None and vector_dtype != stored_vector_dtype(os.path.join(save_path, SERVING_DIR))
+    if not result.embedded and not removed and not dtype_changed:
+        logger.info("Vector store is already up to date.")
+        return
+
+    try:
+        if removed:
+            vectorstore.delete(removed)
+    except Exception as e:
+        logger.info(f"Error updating FAISS index: {e}")
+        return
+
+    save_vectorstore(vectorstore, save_path, stored_spec, vector_dtype)
+    logger.info(f"FAISS vector store updated successfully at {save_path}")
+
+def permission_key(permission: list[str]) -> tuple[str, ...]:
+    """Normalizes a permission list so documents readable by the same roles share a partition."""
+    return tuple(sorted(set(permission)))
+
+def create_and_save_partitioned_vectorstore(docs: list[Document], save_path: str, embeddings: Embeddings | None = None):
+    """
+    Creates one FAISS index per distinct (permission, deny) pair and saves them under save_path.
+
+    The retriever only searches the partitions a user may read, so permission
+    filtering (deny rules included) happens before top-k instead of after it.
+    """
+    if not docs:
+        logger.info("No documents loaded, skipping vector store creation.")
+        return
+
+    logger.info(f"Processing {len(docs)} documents for partitioned vectorization...")
+    chunks = list(iter_chunks(docs))
+
+    if embeddings is None:
+        embeddings = init_embeddings()
+        if embeddings is None:
+            return
+
+    # Group chunks by the (normalized) sets of roles allowed and denied, so every chunk
+    # of a partition is readable by exactly the same users
+    groups: dict[tuple[tuple[str, ...], tuple[str, ...]], list[Document]] = {}
+    for chunk in chunks:
+        allow = permission_key(chunk.metadata["permission"])
+        if not allow:
+            logger.info(f"Warning: Skipping chunk of '{chunk.metadata.get('title', 'N/A')}' with an empty permission list.")
+            continue
+        deny = permission_key(chunk.metadata.get("deny", []))
+        groups.setdefault((allow, deny), []).append(chunk)
+
+    # Each chunk lives in exactly one partition, so it is embedded exactly once
+    save_path = os.path.abspath(save_path)
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    vectorstore.save_local(save_path)
-    logger.info(f"FAISS vector store created and saved successfully at {save_path}")
+    tmp_path = tempfile.mkdtemp(prefix=".vectorstore-new-", dir=os.path.dirname(save_path))
+    manifest = {"partitions": []}
+    for i, key in enumerate(sorted(groups)):
+        name = f"p{i:03d}"
+        allow, deny = key
+        logger.info(f"Creating partition {name} for roles {list(allow)} (denied: {list(deny)}) with {len(groups[key])} chunks...")
+        result = add_chunks(None, groups[key], embeddings)
+        if result.vectorstore is None or result.failed:
+            logger.info(f"Error creating FAISS index for partition {name}: {len(result.failed)} chunks could not be embedded.")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        result.vectorstore.save_local(os.path.join(tmp_path, PARTITIONS_DIR, name))
+        manifest["partitions"].append({"name": name, "permission": list(allow), "deny": list(deny),
+                                       "chunks": len(groups[key])})
+
+    with open(os.path.join(tmp_path, PARTITIONS_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    write_version(tmp_path)
+    replace_directory(tmp_path, save_path)
+    logger.info(f"Saved {len(manifest['partitions'])} permission partitions at {save_path}")
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the SecureRAG vector store.")
+    parser.add_argument("--data", default=DATA_PATH, help="Path to the documents (.json array or .jsonl).")
+    parser.add_argument("--save-path", default=VECTORSTORE_PATH,
+                        help="Vector store directory, e.g. tenants/<name> for a multi-tenant deployment.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--partitioned", action="store_true", help="Build one FAISS index per distinct permission set.")
+    mode.add_argument("--incremental", action="store_true", help="Embed only new or changed chunks of an existing index.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the on-disk embedding cache.")
+    parser.add_argument("--index", type=IndexSpec.parse, default=None, metavar="SPEC",
+                        help="FAISS index type: flat (default), ivf_flat, ivf_pq or hnsw, optionally with "
+                             "parameters, e.g. 'ivf_pq:nlist=1024,pq_m=16,nprobe=32' or 'hnsw:hnsw_m=32,ef_search=64'.")
+    parser.add_argument("--vector-dtype", choices=VECTOR_DTYPES, default=None,
+                        help="Scan vectors of the serving copy of a flat index: float16 or int8 shrink the resident "
+                             "matrix 2x / 4x, with the top candidates re-scored exactly. Defaults to the type of the "
+                             f"existing index, or {SERVING_VECTOR_DTYPE}.")
+    args = parser.parse_args()
+    if args.partitioned and args.index is not None:
+        parser.error("--index is not supported with --partitioned (partitions are always flat).")
+    if args.partitioned and args.vector_dtype is not None:
+        parser.error("--vector-dtype is not supported with --partitioned (partitions have no serving copy).")
+
     logger.info("Starting SecureRAG indexing process using Google Embeddings...")
     
-    documents = load_docs_from_json(DATA_PATH)
-    
-    create_and_save_vectorstore(documents, VECTORSTORE_PATH)
+    embeddings = init_embeddings(cache_path=None if args.no_cache else EMBEDDING_CACHE_PATH)
+    if embeddings is None:
+        sys.exit(1)
+
+    try:
+        if args.partitioned:
+            # Partitions are grouped in memory, so this mode loads the whole corpus
+            create_and_save_partitioned_vectorstore(load_docs_from_json(args.data), args.save_path, embeddings)
+        elif args.incremental:
+            update_vectorstore(iter_docs(args.data), args.save_path, embeddings, args.index, args.vector_dtype)
+        else:
+            create_and_save_vectorstore(iter_docs(args.data), args.save_path, embeddings, args.index, args.vector_dtype)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.info(f"Error reading documents from {args.data}: {e}")
+        sys.exit(1)
+
+    if isinstance(embeddings, CachedEmbeddings):
+        logger.info(f"Embedding cache stats: {embeddings.stats()}")
     
     logger.info("Indexing process finished.")
\ No newline at end of file
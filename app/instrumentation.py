@@ -0,0 +1,293 @@
+# secure-rag/app/instrumentation.py
+
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from .context_packing import estimate_tokens
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+METRIC_PREFIX = "secure_rag"
+# 阶段耗时直方图的桶上限 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class Span:
+    """一个阶段的耗时，start_ms 相对于所属追踪的开始时间。"""
+    name: str
+    start_ms: float
+    duration_ms: float
+
+
+@dataclass
+class Trace:
+    """一次请求中各阶段的耗时和计数。"""
+    started: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    counters: dict[str, float] = field(default_factory=dict)
+    attributes: dict[str, str] = field(default_factory=dict) # 例如所用的索引版本
+
+    def stage_ms(self) -> dict[str, float]:
+        """按阶段名汇总的耗时 (同名阶段可能出现多次，例如批量检索)。"""
+        totals: dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return {name: round(ms, 3) for name, ms in totals.items()}
+
+    def to_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages": self.stage_ms(),
+            "spans": [
+                {"name": span.name, "start_ms": round(span.start_ms, 3), "duration_ms": round(span.duration_ms, 3)}
+                for span in self.spans
+            ],
+            "counters": dict(self.counters),
+            **self.attributes,
+        }
+
+
+class MetricsRegistry:
+    """
+    进程内的阶段耗时直方图和计数器，可导出为 Prometheus 文本格式。
+
+    所有请求共用；只有调用 enable_metrics() 后才会记录。
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # 阶段名 -> [各桶计数..., 总次数, 总秒数]
+        self._histograms: dict[str, list[float]] = {}
+        self._counters: dict[str, float] = {}
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        """返回 {"stages": {阶段: {"count", "sum_seconds"}}, "counters": {...}}。"""
+        with self._lock:
+            return {
+                "stages": {stage: {"count": int(h[-2]), "sum_seconds": h[-1]} for stage, h in self._histograms.items()},
+                "counters": dict(self._counters),
+            }
+
+    def render_prometheus(self) -> str:
+        """按 Prometheus 文本格式 (0.0.4) 导出所有指标。"""
+        name = f"{METRIC_PREFIX}_stage_duration_seconds"
+        lines = [f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                for bound, bucket_count in zip(self.buckets, histogram):
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {int(bucket_count)}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {int(histogram[-2])}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram[-1]}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {int(histogram[-2])}')
+            for counter, value in sorted(self._counters.items()):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+                lines.append(f"{METRIC_PREFIX}_{counter}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+METRICS = MetricsRegistry()
+
+_current_trace: ContextVar[Trace | None] = ContextVar("secure_rag_trace", default=None)
+_metrics_enabled = False
+_otel_tracer = None
+_NULL_SPAN = nullcontext()
+
+
+def enable_metrics(enabled: bool = True):
+    """开启 (或关闭) 进程级指标收集，见 METRICS.render_prometheus()。"""
+    global _metrics_enabled
+    _metrics_enabled = enabled
+
+
+def enable_opentelemetry(tracer=None):
+    """
+    把每个阶段同时作为 OpenTelemetry span 上报。
+
+    tracer 为 None 时使用全局 TracerProvider 的 tracer；导出器 (OTLP 等) 由
+    应用按 OpenTelemetry SDK 的方式配置。传入 False 关闭。
+
+    Raises:
+        ImportError: 未安装 opentelemetry-api。
+    """
+    global _otel_tracer
+    if tracer is False:
+        _otel_tracer = None
+        return
+    if tracer is None:
+        from opentelemetry import trace
+        tracer = trace.get_tracer("secure-rag")
+    _otel_tracer = tracer
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def instrumentation_enabled() -> bool:
+    """是否有任何观测方 (当前追踪、指标或 OpenTelemetry) 需要记录。"""
+    return _current_trace.get() is not None or _metrics_enabled or _otel_tracer is not None
+
+
+@contextmanager
+def start_trace() -> Iterator[Trace]:
+    """在当前上下文 (线程 / 协程) 中开始一次请求追踪。"""
+    trace = Trace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+class _Span:
+    __slots__ = ("name", "trace", "start", "otel_span")
+
+    def __init__(self, name: str, trace: Trace | None):
+        self.name = name
+        self.trace = trace
+        self.otel_span = None
+
+    def __enter__(self):
+        if _otel_tracer is not None:
+            self.otel_span = _otel_tracer.start_as_current_span(self.name)
+            self.otel_span.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_span(self.name, self.start, time.perf_counter() - self.start, self.trace)
+        if self.otel_span is not None:
+            self.otel_span.__exit__(*exc_info)
+        return False
+
+
+def span(name: str):
+    """
+    计时一个阶段: with span("vector_search"): ...
+
+    没有任何观测方时返回共享的空上下文管理器，开销只有一次 ContextVar 读取。
+    """
+    trace = _current_trace.get()
+    if trace is None and not _metrics_enabled and _otel_tracer is None:
+        return _NULL_SPAN
+    return _Span(name, trace)
+
+
+def record_span(name: str, start: float, seconds: float, trace: Trace | None = None):
+    """记录一个已经结束的阶段 (start 为 time.perf_counter() 的值)。"""
+    if trace is not None:
+        trace.spans.append(Span(name, (start - trace.started) * 1000, seconds * 1000))
+    if _metrics_enabled:
+        METRICS.observe(name, seconds)
+
+
+def count(name: str, value: float = 1, trace: Trace | None = None):
+    """累加一个计数 (例如检索到的文档数)，同时计入当前追踪和进程级指标。"""
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+    if _metrics_enabled:
+        METRICS.inc(name, value)
+
+
+class LLMTimingCallback(BaseCallbackHandler):
+    """
+    记录聊天模型调用的耗时、首个 token 的延迟和输入/输出 token 数。
+
+    作为 LangChain 回调传入链的 config，因此无需改动链本身，流式输出也不受
+    影响。模型报告了 usage_metadata 时使用实际 token 数，否则按
+    estimate_tokens 估计。
+    """
+
+    def __init__(self, trace: Trace | None = None):
+        self.trace = trace
+        self._starts: dict[UUID, float] = {}
+        self._first_token: set[UUID] = set()
+        self._input_estimates: dict[UUID, int] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+        self._input_estimates[run_id] = sum(estimate_tokens(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+        self._input_estimates[run_id] = sum(estimate_tokens(p) for p in prompts)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        if run_id in self._starts and run_id not in self._first_token:
+            self._first_token.add(run_id)
+            start = self._starts[run_id]
+            record_span("llm_first_token", start, time.perf_counter() - start, self.trace)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        start = self._starts.pop(run_id, None)
+        self._first_token.discard(run_id)
+        input_estimate = self._input_estimates.pop(run_id, 0)
+        if start is None:
+            return
+        record_span("llm", start, time.perf_counter() - start, self.trace)
+
+        input_tokens = output_tokens = None
+        texts = []
+        for generations in response.generations:
+            for generation in generations:
+                texts.append(generation.text)
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens = (input_tokens or 0) + usage.get("input_tokens", 0)
+                    output_tokens = (output_tokens or 0) + usage.get("output_tokens", 0)
+        count("llm_input_tokens", input_estimate if input_tokens is None else input_tokens, self.trace)
+        count("llm_output_tokens",
+              sum(estimate_tokens(text) for text in texts) if output_tokens is None else output_tokens, self.trace)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        start = self._starts.pop(run_id, None)
+        self._first_token.discard(run_id)
+        self._input_estimates.pop(run_id, None)
+        if start is not None:
+            record_span("llm", start, time.perf_counter() - start, self.trace)
+        count("llm_errors", 1, self.trace)
+
+
+def callback_config() -> dict | None:
+    """
+    返回要传给链的 config: 有观测方时附带 LLMTimingCallback，否则为 None。
+
+    回调捕获调用时的当前追踪，因此在线程池或事件循环中触发时仍记入同一个追踪。
+    """
+    if not instrumentation_enabled():
+        return None
+    return {"callbacks": [LLMTimingCallback(_current_trace.get())]}
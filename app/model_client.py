@@ -0,0 +1,564 @@
+# secure-rag/app/model_client.py
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, TypeVar
+
+import httpx
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from .instrumentation import count, record_span
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# --- 配置 ---
+# 是否通过本模块的客户端调用 Gemini (False 时使用 langchain_google_genai 的默认实现)
+USE_RESILIENT_CLIENT = True
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta" # 可用环境变量 GEMINI_API_BASE 覆盖
+POOL_CONNECTIONS = 32 # 连接池中的最大连接数 (所有模型共用)
+KEEPALIVE_SECONDS = 120.0 # 空闲连接保留多久
+CHAT_TIMEOUT = 30.0 # 单个聊天模型一次尝试的时限 (秒)，超时后改用后备模型
+CHAT_DEADLINE = 60.0 # 一次聊天调用 (含所有后备模型) 的总时限
+EMBED_TIMEOUT = 5.0
+EMBED_DEADLINE = 15.0
+CHAT_HEDGE_DELAY = 10.0 # 延迟样本不足时，聊天请求多久没有返回就发出对冲请求
+EMBED_HEDGE_DELAY = 1.0
+HEDGE_QUANTILE = 95 # 样本足够后，对冲延迟取该模型近期成功调用延迟的这个分位数
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 256 # 每个模型保留的近期延迟样本数
+BREAKER_FAILURES = 5 # 连续失败这么多次后熔断该模型
+BREAKER_COOLDOWN = 30.0 # 熔断多久后放行一个试探请求
+EMBED_BATCH_SIZE = 100 # batchEmbedContents 每次请求的文本数上限
+HEDGE_WORKERS = 64 # 执行 (可能被对冲的) 上游请求的线程数
+# 换一个模型或稍后重试可能成功的状态码 (404: 模型已下线或名称错误)
+RETRYABLE_STATUS = frozenset({404, 408, 429, 500, 502, 503, 504})
+
+
+class ModelCallError(RuntimeError):
+    """一次上游调用失败。retryable 为 False 时 (例如请求本身不合法) 不会尝试后备模型。"""
+
+    def __init__(self, model: str, message: str, status: int | None = None, retryable: bool = True,
+                 timeout: bool = False):
+        super().__init__(f"{model}: {message}")
+        self.model = model
+        self.status = status
+        self.retryable = retryable
+        self.timeout = timeout
+
+
+class AllModelsFailedError(RuntimeError):
+    """所有模型都失败、被熔断或超过总时限。"""
+
+    def __init__(self, errors: dict[str, str]):
+        super().__init__("所有模型均不可用: " + "; ".join(f"{model}: {error}" for model, error in errors.items()))
+        self.errors = errors
+
+
+def model_path(model: str) -> str:
+    return model if model.startswith("models/") else f"models/{model}"
+
+
+class GeminiTransport:
+    """
+    Gemini REST API 的 HTTP 传输，所有模型和线程共用一个保持连接的连接池。
+
+    api_key 和 base_url 为 None 时分别取环境变量 GOOGLE_API_KEY 和 GEMINI_API_BASE
+    (测试时指向本地的模拟服务器)。
+    """
+
+    def __init__(self, api_key: str | None = None, base_url: str | None = None,
+                 max_connections: int = POOL_CONNECTIONS):
+        api_key = api_key or os.environ.get("GOOGLE_API_KEY")
+        self.base_url = base_url or os.environ.get("GEMINI_API_BASE", GEMINI_API_BASE)
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            headers={"x-goog-api-key": api_key} if api_key else {},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=KEEPALIVE_SECONDS),
+        )
+
+    def post(self, model: str, method: str, payload: dict, timeout: float) -> dict:
+        """调用 models/{model}:{method}，返回解析后的 JSON。"""
+        response = self._client.post(f"/{model_path(model)}:{method}", json=payload, timeout=timeout)
+        self._raise_for_status(model, response)
+        return response.json()
+
+    def stream(self, model: str, payload: dict, timeout: float) -> Iterator[dict]:
+        """调用 streamGenerateContent (SSE)，逐个产出事件的 JSON。timeout 限制每次读取的等待时间。"""
+        with self._client.stream("POST", f"/{model_path(model)}:streamGenerateContent", params={"alt": "sse"},
+                                 json=payload, timeout=timeout) as response:
+            if response.status_code >= 400:
+                response.read()
+            self._raise_for_status(model, response)
+            for line in response.iter_lines():
+                if line.startswith("data:"):
+                    yield json.loads(line[5:])
+
+    @staticmethod
+    def _raise_for_status(model: str, response: httpx.Response):
+        if response.status_code < 400:
+            return
+        try:
+            message = response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = response.text[:200]
+        raise ModelCallError(model, f"HTTP {response.status_code}: {message}", status=response.status_code,
+                             retryable=response.status_code in RETRYABLE_STATUS)
+
+    def close(self):
+        self._client.close()
+
+
+_shared_transport: GeminiTransport | None = None
+_shared_executor: ThreadPoolExecutor | None = None
+_shared_lock = threading.Lock()
+
+
+def shared_transport() -> GeminiTransport:
+    """进程共用的传输 (聊天模型、嵌入和各租户共用同一个连接池)。"""
+    global _shared_transport
+    with _shared_lock:
+        if _shared_transport is None:
+            _shared_transport = GeminiTransport()
+        return _shared_transport
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="model-call")
+        return _shared_executor
+
+
+class CircuitBreaker:
+    """
+    连续失败 failures 次后打开 (拒绝调用)，cooldown 秒后进入半开状态，只放行
+    一个试探调用: 成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._consecutive = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """结束一个没有记录结果的调用 (例如引发了意外的异常)，放行下一个试探调用。"""
+        with self._lock:
+            self._probing = False
+
+
+class ModelStats:
+    """单个模型的调用计数和近期延迟 (用于计算对冲延迟)。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0 # 前面的模型失败后由本模型接手的次数
+        self.rejected = 0 # 熔断期间被跳过的次数
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.lock = threading.Lock()
+
+    def hedge_delay(self, default: float) -> float:
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return default
+            return float(np.percentile(self.latencies, HEDGE_QUANTILE))
+
+    def add(self, **increments):
+        with self.lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            latencies = list(self.latencies)
+            result = {name: getattr(self, name) for name in
+                      ("calls", "successes", "failures", "timeouts", "hedges", "hedge_wins", "fallbacks", "rejected")}
+        if latencies:
+            result["latency_ms"] = {"p50": round(float(np.percentile(latencies, 50)) * 1000, 2),
+                                    "p95": round(float(np.percentile(latencies, 95)) * 1000, 2)}
+        return result
+
+
+class ResilientClient:
+    """
+    按顺序尝试多个模型的上游调用包装。
+
+    每个模型的一次尝试有 timeout 秒的时限，整次调用 (含后备模型) 有 deadline 秒
+    的总时限。尝试超过该模型近期延迟的 p95 (样本不足时为 hedge_delay) 仍未返回
+    时，再发出一个相同的对冲请求，取先成功的结果。失败或超时的模型计入它的熔断器，
+    熔断期间直接跳过，改用列表中的下一个模型。每个模型的调用、失败、对冲和后备
+    次数见 stats()，成功调用的耗时记为 model:<模型> 阶段 (见 instrumentation)。
+    """
+
+    def __init__(self, models: list[str], transport: GeminiTransport | None = None, timeout: float = CHAT_TIMEOUT,
+                 deadline: float = CHAT_DEADLINE, hedge_delay: float | None = CHAT_HEDGE_DELAY,
+                 breaker_failures: int = BREAKER_FAILURES, breaker_cooldown: float = BREAKER_COOLDOWN):
+        """
+        Args:
+            models: 按优先级排列的模型名称。
+            transport: HTTP 传输；为 None 时使用进程共用的 shared_transport()。
+            timeout: 单个模型一次尝试的时限 (秒)。
+            deadline: 整次调用的总时限 (秒)。
+            hedge_delay: 延迟样本不足时的对冲延迟；None 表示不发出对冲请求。
+            breaker_failures: 连续失败多少次后熔断一个模型。
+            breaker_cooldown: 熔断多久后放行试探请求 (秒)。
+        """
+        if not models:
+            raise ValueError("至少需要一个模型")
+        self.models = list(dict.fromkeys(models))
+        self.transport = transport or shared_transport()
+        self.timeout = timeout
+        self.deadline = deadline
+        self.hedge_delay = hedge_delay
+        self.breakers = {model: CircuitBreaker(breaker_failures, breaker_cooldown) for model in self.models}
+        self._stats = {model: ModelStats() for model in self.models}
+
+    def call(self, request: Callable[[str, float], T]) -> T:
+        """
+        依次用各模型调用 request(模型, 时限) 直到成功。
+
+        Raises:
+            ModelCallError: 不可重试的错误 (例如请求不合法)。
+            AllModelsFailedError: 所有模型都失败、被熔断或超过总时限。
+        """
+        deadline = time.monotonic() + self.deadline
+        errors: dict[str, str] = {}
+        for model in self.models:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                errors[model] = "超过总时限"
+                break
+            if not self.breakers[model].allow():
+                self._stats[model].add(rejected=1)
+                errors[model] = "熔断中"
+                continue
+            if errors:
+                self._stats[model].add(fallbacks=1)
+                count("model_fallbacks")
+                logger.info("改用后备模型 %s (%s)", model, "; ".join(errors.values()))
+            try:
+                return self._call_model(model, request, min(self.timeout, remaining))
+            except ModelCallError as e:
+                if not e.retryable:
+                    raise
+                errors[model] = str(e)
+        raise AllModelsFailedError(errors)
+
+    def _call_model(self, model: str, request: Callable[[str, float], T], timeout: float) -> T:
+        """对一个模型发出请求，必要时对冲；超时或失败时记入熔断器并引发 ModelCallError。"""
+        try:
+            return self._hedged_call(model, request, timeout)
+        finally:
+            # 结果已记录时不改变状态；否则 (意外的异常) 不能让半开的熔断器一直等待试探结果
+            self.breakers[model].release()
+
+    def _hedged_call(self, model: str, request: Callable[[str, float], T], timeout: float) -> T:
+        stats, breaker = self._stats[model], self.breakers[model]
+        stats.add(calls=1)
+        start = time.perf_counter()
+        end = start + timeout
+        hedge_at = None if self.hedge_delay is None else start + stats.hedge_delay(self.hedge_delay)
+        pending: dict[Future, bool] = {_executor().submit(self._attempt, model, request, timeout): False}
+        error: ModelCallError | None = None
+
+        while pending:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            if hedge_at is not None and now >= hedge_at:
+                # 只对冲一次，时限与原请求一起结束
+                hedge_at = None
+                stats.add(hedges=1)
+                count("model_hedges")
+                pending[_executor().submit(self._attempt, model, request, end - now)] = True
+                continue
+            wake = end if hedge_at is None else min(end, hedge_at)
+            done, _ = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                is_hedge = pending.pop(future)
+                try:
+                    result = future.result()
+                except ModelCallError as e:
+                    if not e.retryable:
+                        # 模型本身正常响应，错误出在请求上，不计入熔断器
+                        stats.add(failures=1)
+                        breaker.record_success()
+                        raise
+                    error = e
+                    continue
+                seconds = time.perf_counter() - start
+                with stats.lock:
+                    stats.latencies.append(seconds)
+                stats.add(successes=1, hedge_wins=int(is_hedge))
+                breaker.record_success()
+                record_span(f"model:{model}", start, seconds)
+                return result
+            if error is not None and not pending:
+                break # 出错时不等待对冲，直接改用后备模型
+
+        if error is None:
+            error = ModelCallError(model, f"{timeout:.1f} 秒内没有响应", timeout=True)
+        stats.add(failures=1, timeouts=int(error.timeout))
+        count("model_errors")
+        breaker.record_failure()
+        raise error
+
+    @staticmethod
+    def _attempt(model: str, request: Callable[[str, float], T], timeout: float) -> T:
+        try:
+            return request(model, timeout)
+        except ModelCallError:
+            raise
+        except httpx.TimeoutException as e:
+            raise ModelCallError(model, f"超时: {e}", timeout=True) from e
+        except httpx.TransportError as e:
+            raise ModelCallError(model, f"连接错误: {e}") from e
+
+    def stream(self, open_stream: Callable[[str, float], Iterator[T]]) -> Iterator[tuple[str, T]]:
+        """
+        流式调用: 依次尝试各模型，直到某个模型产出第一个事件，之后产出 (模型, 事件)。
+
+        第一个事件到达之前失败可以改用后备模型；之后的错误直接引发 (已经输出的
+        内容无法撤回)。流式调用不发出对冲请求。
+        """
+        deadline = time.monotonic() + self.deadline
+        errors: dict[str, str] = {}
+        for model in self.models:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            stats, breaker = self._stats[model], self.breakers[model]
+            if not breaker.allow():
+                stats.add(rejected=1)
+                errors[model] = "熔断中"
+                continue
+            if errors:
+                stats.add(fallbacks=1)
+                count("model_fallbacks")
+            stats.add(calls=1)
+            start = time.perf_counter()
+            events: Iterator[T] | None = None
+            try:
+                events = iter(self._attempt(model, open_stream, min(self.timeout, remaining)))
+                first = self._attempt(model, lambda *_: next(events, None), 0)
+            except ModelCallError as e:
+                stats.add(failures=1, timeouts=int(e.timeout))
+                if not e.retryable:
+                    breaker.record_success() # 错误出在请求上，见 _hedged_call
+                    raise
+                breaker.record_failure()
+                errors[model] = str(e)
+                _close(events)
+                continue
+            except BaseException:
+                breaker.release() # 意外的异常，见 _call_model
+                _close(events)
+                raise
+            record_span(f"model:{model}", start, time.perf_counter() - start)
+            try:
+                if first is not None:
+                    yield model, first
+                for event in events:
+                    yield model, event
+            except GeneratorExit:
+                # 调用方提前停止读取 (例如客户端断开)，模型本身已正常输出
+                stats.add(successes=1)
+                breaker.record_success()
+                raise
+            except BaseException:
+                stats.add(failures=1)
+                count("model_errors")
+                breaker.record_failure()
+                raise
+            finally:
+                _close(events)
+            stats.add(successes=1)
+            breaker.record_success()
+            return
+        raise AllModelsFailedError(errors)
+
+    def stats(self) -> dict:
+        """每个模型的调用统计和熔断状态。"""
+        return {model: {**self._stats[model].to_dict(), "circuit": self.breakers[model].state}
+                for model in self.models}
+
+
+def _close(events: Iterator | None):
+    """关闭上游事件流 (归还连接)。"""
+    close = getattr(events, "close", None)
+    if close is not None:
+        close()
+
+
+def _response_text(response: dict) -> str:
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    通过 ResilientClient 调用 Gemini generateContent 的 LangChain 聊天模型。
+
+    可以直接替换 ChatGoogleGenerativeAI 用在链中；response_metadata["model_name"]
+    记录实际生成答案的模型 (可能是后备模型)。
+    """
+
+    client: Any # ResilientClient
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "gemini-resilient"
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"models": self.client.models, "temperature": self.temperature}
+
+    def _payload(self, messages: list[BaseMessage], stop: list[str] | None) -> dict:
+        system = [message.content for message in messages if isinstance(message, SystemMessage)]
+        payload = {
+            "contents": [
+                {"role": "model" if isinstance(message, AIMessage) else "user", "parts": [{"text": message.content}]}
+                for message in messages if not isinstance(message, SystemMessage)
+            ],
+            "generationConfig": {"temperature": self.temperature, **({"stopSequences": stop} if stop else {})},
+        }
+        if system:
+            payload["systemInstruction"] = {"parts": [{"text": "\n\n".join(system)}]}
+        return payload
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager: CallbackManagerForLLMRun | None = None, **kwargs) -> ChatResult:
+        payload = self._payload(messages, stop)
+        response, model = self.client.call(
+            lambda model, timeout: (self.client.transport.post(model, "generateContent", payload, timeout), model))
+        message = AIMessage(content=_response_text(response), response_metadata={"model_name": model})
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"model_name": model})
+
+    def _stream(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                run_manager: CallbackManagerForLLMRun | None = None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        payload = self._payload(messages, stop)
+        for model, event in self.client.stream(
+                lambda model, timeout: self.client.transport.stream(model, payload, timeout)):
+            text = _response_text(event)
+            if not text:
+                continue
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=text, response_metadata={"model_name": model}))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(text, chunk=chunk)
+            yield chunk
+
+    def model_stats(self) -> dict:
+        return self.client.stats()
+
+
+class ResilientEmbeddings(Embeddings):
+    """
+    通过 ResilientClient 调用 Gemini batchEmbedContents 的嵌入对象。
+
+    不同嵌入模型的向量空间不同，因此只使用一个模型 (没有后备模型)；超时、对冲
+    和熔断同样生效。
+    """
+
+    def __init__(self, client: ResilientClient, batch_size: int = EMBED_BATCH_SIZE):
+        if len(client.models) != 1:
+            raise ValueError("嵌入只能使用一个模型 (各模型的向量空间不同)")
+        self.client = client
+        self.batch_size = batch_size
+
+    def _embed(self, texts: list[str], task_type: str) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+
+            def request(model: str, timeout: float) -> list[list[float]]:
+                payload = {"requests": [
+                    {"model": model_path(model), "content": {"parts": [{"text": text}]}, "taskType": task_type}
+                    for text in batch
+                ]}
+                response = self.client.transport.post(model, "batchEmbedContents", payload, timeout)
+                return [embedding["values"] for embedding in response["embeddings"]]
+
+            vectors.extend(self.client.call(request))
+        return vectors
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, "RETRIEVAL_DOCUMENT")
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text], "RETRIEVAL_QUERY")[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """一次请求嵌入多个查询 (见 embedding_cache.embed_queries)。"""
+        return self._embed(texts, "RETRIEVAL_QUERY")
+
+    def model_stats(self) -> dict:
+        return self.client.stats()
+
+
+def build_resilient_chat_model(models: list[str], temperature: float = 0.0,
+                               transport: GeminiTransport | None = None, **client_options) -> ResilientChatModel:
+    """按优先级排列的模型列表创建聊天模型；client_options 传给 ResilientClient。"""
+    return ResilientChatModel(client=ResilientClient(models, transport, **client_options), temperature=temperature)
+
+
+def build_resilient_embeddings(model: str, transport: GeminiTransport | None = None,
+                               batch_size: int = EMBED_BATCH_SIZE, **client_options) -> ResilientEmbeddings:
+    """创建嵌入对象；client_options 传给 ResilientClient (默认使用嵌入的时限和对冲延迟)。"""
+    options = {"timeout": EMBED_TIMEOUT, "deadline": EMBED_DEADLINE, "hedge_delay": EMBED_HEDGE_DELAY, **client_options}
+    return ResilientEmbeddings(ResilientClient([model], transport, **options), batch_size)
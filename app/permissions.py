@@ -0,0 +1,193 @@
+# secure-rag/app/permissions.py
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+# --- 配置 ---
+ROLE_BITMASK_FILE = "role_bitmask.npy" # N x W 的 uint64 允许位集 (旧版本为长度 N 的一维数组)
+DENY_BITMASK_FILE = "deny_bitmask.npy" # 与允许位集同形状的拒绝位集；没有拒绝规则时不写出
+ROLE_BITS_FILE = "role_bits.json" # 角色/组名 -> 位序号
+PERMISSION_KEY = "permission" # 元数据中允许读取的角色/组列表
+DENY_KEY = "deny" # 元数据中禁止读取的角色/组列表，优先于允许
+ALLOWED_CACHE_SIZE = 32 # 缓存多少个 "角色集合 -> 全语料可读掩码"
+
+
+def as_principals(user_role: str | Iterable[str]) -> frozenset[str]:
+    """把单个角色名或用户持有的角色/组集合统一为 frozenset。"""
+    if isinstance(user_role, str):
+        return frozenset((user_role,))
+    return frozenset(user_role)
+
+
+def permits(metadata: dict, principals: frozenset[str]) -> bool:
+    """
+    按块的元数据判断持有 principals 的用户能否读取 (与 PermissionIndex 的规则相同)。
+
+    至少持有一个允许的角色/组、且不持有任何被拒绝的角色/组时可读；
+    缺少 'permission' 元数据的块一律拒绝。
+    """
+    allowed = metadata.get(PERMISSION_KEY)
+    if not allowed:
+        return False
+    return not principals.isdisjoint(allowed) and principals.isdisjoint(metadata.get(DENY_KEY) or ())
+
+
+def build_role_bits(permissions: Iterable[Iterable[str]]) -> dict[str, int]:
+    """为出现过的每个角色/组分配一个固定的位序号 (按名称排序，保证可复现)。"""
+    roles = sorted({role for permission in permissions for role in permission})
+    return {role: bit for bit, role in enumerate(roles)}
+
+
+class PermissionIndex:
+    """
+    编译好的逐块访问控制列表。
+
+    索引时把角色和组名映射为位序号，每个块的允许列表和拒绝列表各存为 W 个
+    uint64 组成的位集 (因此角色数不受 64 的限制)。查询时把用户持有的
+    角色/组编译成同样的位集，一次 NumPy 按位运算即可判断整批候选或整个语料:
+
+        可读 = any(allow & user) and not any(deny & user)
+
+    行号与 FAISS id 一致。全语料的可读掩码按角色集合缓存，同一组角色的
+    后续查询不再扫描位集。
+    """
+
+    def __init__(self, allow: np.ndarray, role_bits: dict[str, int], deny: np.ndarray | None = None):
+        if allow.ndim == 1:
+            allow = allow.reshape(-1, 1) # 旧版本的单字位掩码
+        if deny is not None and deny.ndim == 1:
+            deny = deny.reshape(-1, 1)
+        self.allow = allow
+        self.deny = deny
+        self.role_bits = role_bits
+        self._cache: OrderedDict[frozenset[str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.allow)
+
+    @property
+    def words(self) -> int:
+        return self.allow.shape[1]
+
+    @classmethod
+    def build(cls, metadatas: Iterable[dict]) -> "PermissionIndex":
+        """按给定顺序为每个块的元数据编译 ACL (第 i 个元数据即第 i 行)。"""
+        allows, denies = [], []
+        for metadata in metadatas:
+            allows.append(list(metadata.get(PERMISSION_KEY) or []))
+            denies.append(list(metadata.get(DENY_KEY) or []))
+
+        role_bits = build_role_bits(allows + denies)
+        words = max(1, -(-len(role_bits) // 64))
+        allow = cls._encode(allows, role_bits, words)
+        deny = cls._encode(denies, role_bits, words) if any(denies) else None
+        return cls(allow, role_bits, deny)
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore: "FAISS") -> "PermissionIndex":
+        """按 FAISS id 顺序为向量存储中的每个块编译 ACL。"""
+        return cls.build(
+            vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata
+            for i in range(vectorstore.index.ntotal)
+        )
+
+    @staticmethod
+    def _encode(principal_lists: list[list[str]], role_bits: dict[str, int], words: int) -> np.ndarray:
+        bits = np.zeros((len(principal_lists), words), dtype=np.uint64)
+        for row, principals in enumerate(principal_lists):
+            for principal in principals:
+                bit = role_bits[principal]
+                bits[row, bit >> 6] |= np.uint64(1 << (bit & 63))
+        return bits
+
+    def compile(self, user_role: str | Iterable[str]) -> np.ndarray | None:
+        """把用户持有的角色/组编译为 W 个 uint64；一个都不认识时返回 None。"""
+        query = np.zeros(self.words, dtype=np.uint64)
+        known = False
+        for principal in as_principals(user_role):
+            bit = self.role_bits.get(principal)
+            if bit is not None:
+                query[bit >> 6] |= np.uint64(1 << (bit & 63))
+                known = True
+        return query if known else None
+
+    def allowed(self, user_role: str | Iterable[str], rows: np.ndarray | None = None) -> np.ndarray:
+        """
+        返回布尔数组，标记用户可读的行。
+
+        rows 为 None 时评估整个语料 (结果按角色集合缓存)；否则只评估给定的候选行，
+        结果与 rows 一一对应。
+        """
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            query = self.compile(user_role)
+            if query is None:
+                return np.zeros(len(rows), dtype=bool)
+            return self._evaluate(self.allow[rows], None if self.deny is None else self.deny[rows], query)
+
+        key = as_principals(user_role)
+        with self._lock:
+            mask = self._cache.get(key)
+            if mask is not None:
+                self._cache.move_to_end(key)
+                return mask
+        query = self.compile(key)
+        if query is None:
+            mask = np.zeros(len(self), dtype=bool)
+        else:
+            mask = self._evaluate(self.allow, self.deny, query)
+        mask.flags.writeable = False # 缓存的掩码被多个请求共享
+        with self._lock:
+            self._cache[key] = mask
+            while len(self._cache) > ALLOWED_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return mask
+
+    @staticmethod
+    def _evaluate(allow: np.ndarray, deny: np.ndarray | None, query: np.ndarray) -> np.ndarray:
+        if allow.shape[1] == 1:
+            # 常见情况 (不超过 64 个角色/组): 一维运算，不产生 N x 1 的临时数组
+            mask = (np.asarray(allow[:, 0]) & query[0]) != 0
+            if deny is not None:
+                mask &= (np.asarray(deny[:, 0]) & query[0]) == 0
+            return mask
+        mask = (np.asarray(allow) & query).any(axis=1)
+        if deny is not None:
+            mask &= ~(np.asarray(deny) & query).any(axis=1)
+        return mask
+
+    def save(self, path: str):
+        """将位集和位序号保存到向量存储目录中。"""
+        np.save(os.path.join(path, ROLE_BITMASK_FILE), self.allow)
+        if self.deny is not None:
+            np.save(os.path.join(path, DENY_BITMASK_FILE), self.deny)
+        with open(os.path.join(path, ROLE_BITS_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.role_bits, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str | None = None) -> "PermissionIndex | None":
+        """
+        加载位集；如果向量存储是在没有位集时构建的，则返回 None。
+
+        mmap_mode 为 'r' 时以只读内存映射方式打开，多个进程共享同一份页缓存。
+        """
+        allow_path = os.path.join(path, ROLE_BITMASK_FILE)
+        bits_path = os.path.join(path, ROLE_BITS_FILE)
+        if not (os.path.exists(allow_path) and os.path.exists(bits_path)):
+            return None
+        with open(bits_path, 'r', encoding='utf-8') as f:
+            role_bits = json.load(f)
+        deny_path = os.path.join(path, DENY_BITMASK_FILE)
+        deny = np.load(deny_path, mmap_mode=mmap_mode) if os.path.exists(deny_path) else None
+        return cls(np.load(allow_path, mmap_mode=mmap_mode), role_bits, deny)
+
@@ -1,38 +1,58 @@
 # secure-rag/app/rag_chain.py
 
+import asyncio
+import json
 import os
+import threading
+import weakref
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from operator import itemgetter # 用于 LCEL 链操作
+from typing import TYPE_CHECKING
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough, RunnableParallel
+from langchain.schema.runnable import Runnable, RunnableLambda, RunnablePassthrough, RunnableParallel
 from langchain_core.documents import Document # 用于类型提示
 
-# 导入自定义检索器
-# 确保 retriever.py 在同一目录或 Python 路径已正确设置
-# 注意：如果 PermissionRetriever 依赖 .env, 它内部的 load_dotenv() 会处理
-from .retriever import PermissionRetriever
+from .answer_cache import SemanticAnswerCache, document_ids
+from .context_packing import CONTEXT_TOKEN_BUDGET, PackedContext, pack_context
+from .embedding_cache import embed_queries
+from .instrumentation import callback_config, count, current_trace, span, start_trace
+from .permissions import as_principals
+from .rerank import MMRReranker, Reranker
 
-# 在此脚本的顶层也加载 .env 文件，以确保环境变量可用
-# (如果 PermissionRetriever 内部也加载，重复加载通常无害)
-from dotenv import load_dotenv
 import logging
 
+if TYPE_CHECKING:
+    # 仅用于类型提示；真正的导入推迟到第一次需要检索器时 (会加载 FAISS)
+    from langchain_core.embeddings import Embeddings
+    from .retriever import PermissionRetriever
+
 # 配置日志记录
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
-logger.info("Attempted to load .env file from rag_chain.py")
-
 
 # --- 配置 ---
-# 假设 GOOGLE_API_KEY 已通过 .env 加载
+# 假设 GOOGLE_API_KEY 已通过 .env 加载 (RagService 在首次构建组件时加载 .env)
 VECTORSTORE_PATH = "../vectorstore" # 相对于此脚本 (app/) 的路径
 GOOGLE_EMBEDDING_MODEL = "models/embedding-001"
 # 使用你验证过的可用模型名称
 GOOGLE_CHAT_MODEL = "gemini-2.5-pro-exp-03-25"
+# 主模型失败、超时或被熔断时依次改用的后备模型 (见 app/model_client.py)
+CHAT_FALLBACK_MODELS = ("gemini-2.0-flash", "gemini-1.5-flash")
+# 异步接口中同时进行的 RAG 链调用上限，避免超出 Gemini 的速率限制
+MAX_CONCURRENT_LLM_CALLS = 8
+# 默认服务是否启用按角色隔离的语义答案缓存
+ENABLE_ANSWER_CACHE = True
+# 批量问答时每批一起嵌入和搜索的查询数
+BATCH_RETRIEVAL_SIZE = 64
+# 默认服务检查向量存储是否被重建的间隔 (秒)；None 表示不自动重载
+INDEX_WATCH_INTERVAL = 30.0
+# 默认服务是否先多取回候选再重排序 (见 app/rerank.py)
+ENABLE_RERANK = True
 
 # --- 辅助函数：格式化文档 ---
 def format_docs(docs: list[Document]) -> str:
@@ -41,30 +61,7 @@ def format_docs(docs: list[Document]) -> str:
 
 # --- RAG 链实现 ---
 
-# 1. 初始化检索器
-# PermissionRetriever 的 __init__ 现在处理路径解析
-try:
-    # 传递相对于此脚本位置的路径
-    retriever = PermissionRetriever(vectorstore_path=VECTORSTORE_PATH, embedding_model_name=GOOGLE_EMBEDDING_MODEL)
-except FileNotFoundError as e:
-    logger.info(f"初始化检索器时出错: {e}")
-    logger.info("请确保向量存储在指定路径存在。")
-    retriever = None
-except Exception as e:
-    logger.info(f"检索器初始化期间发生意外错误: {e}")
-    retriever = None
-
-# 2. 初始化聊天模型
-try:
-    llm = ChatGoogleGenerativeAI(model=GOOGLE_CHAT_MODEL, temperature=0, convert_system_message_to_human=True)
-    # temperature=0 使回答更具确定性
-    # convert_system_message_to_human=True 可能对某些 Gemini 提示结构有帮助
-except Exception as e:
-    logger.info(f"初始化 Google Chat 模型时出错 (使用 {GOOGLE_CHAT_MODEL}): {e}")
-    logger.info("请确保 GOOGLE_API_KEY 有效且模型名称正确。")
-    llm = None
-
-# 3. 定义提示模板
+# 定义提示模板
 template = """
 You are an assistant for question-answering tasks for 'AI Tech Solutions Inc.'.
 Use the following pieces of retrieved context to answer the question.
@@ -80,61 +77,794 @@ Question:
 Answer:"""
 prompt = ChatPromptTemplate.from_template(template)
 
-# 4. 构建 RAG 链 (使用 LCEL)
+# 构建 RAG 链 (使用 LCEL)
+def build_answer_chain(llm, token_budget: int = CONTEXT_TOKEN_BUDGET, on_packed=None) -> Runnable:
+    """
+    构建根据已检索文档生成答案的链: {"documents", "question"} -> 答案字符串。
 
-rag_chain = None # 初始化为 None
-if retriever and llm:
-    # 用于将查询和角色传递给检索器的函数
-    def retrieve_documents(input_dict):
-        return retriever.get_relevant_documents(
-            query=input_dict["query"],
-            user_role=input_dict["user_role"]
-        )
+    文档先经过 pack_context 去重、合并相邻块并裁剪到 token_budget 以内；
+    每次打包的结果会传给可选的 on_packed 回调 (用于统计节省的 token)。
+    """
+    def build_context(input_dict) -> str:
+        with span("pack_context"):
+            packed = pack_context(input_dict["documents"], token_budget)
+        logger.info("上下文打包: %d 个块 -> %d 段，约 %d -> %d tokens (节省 %d)", len(input_dict["documents"]),
+                    len(packed.segments), packed.original_tokens, packed.tokens, packed.tokens_saved)
+        count("context_tokens", packed.tokens)
+        count("context_tokens_saved", packed.tokens_saved)
+        if on_packed is not None:
+            on_packed(packed)
+        return packed.text
 
-    # 定义使用 RunnableParallel 和序列操作符 | 的步骤
-    rag_chain_from_docs = (
-        RunnablePassthrough.assign(context=(lambda x: format_docs(x["documents"])))
-        | prompt
+    def format_prompt(input_dict):
+        with span("format_prompt"):
+            return prompt.invoke(input_dict)
+
+    return (
+        RunnablePassthrough.assign(context=build_context)
+        | RunnableLambda(format_prompt)
         | llm
         | StrOutputParser()
     )
 
+def retrieve_documents(retriever: "PermissionRetriever", query: str, user_role: str | Iterable[str],
+                       reranker: Reranker | None = None, query_embedding: list[float] | None = None) -> list[Document]:
+    """
+    检索送入提示的文档。
+
+    没有 reranker 时直接返回检索器的结果；否则先取回 reranker.candidates 个已授权的
+    候选，再交给 reranker 选出送入提示的块 (查询只嵌入一次，同时用于检索和重排序)。
+    """
+    if reranker is None:
+        if query_embedding is None:
+            return retriever.get_relevant_documents(query=query, user_role=user_role)
+        return retriever.get_relevant_documents(query, user_role, query_embedding=query_embedding)
+
+    if query_embedding is None:
+        with span("embed_query"):
+            query_embedding = retriever.embeddings.embed_query(query)
+    docs = retriever.get_relevant_documents(query, user_role, k=reranker.candidates, query_embedding=query_embedding)
+    return rerank_documents(retriever, reranker, query, query_embedding, docs)
+
+def rerank_documents(retriever: "PermissionRetriever", reranker: Reranker, query: str,
+                     query_embedding: list[float] | None, docs: list[Document]) -> list[Document]:
+    """用索引中已存储的候选向量 (检索器能提供时) 重排序并截断候选。"""
+    with span("rerank"):
+        vectors = retriever.document_vectors(docs) if hasattr(retriever, "document_vectors") else None
+        reranked = reranker.rerank(query, query_embedding, docs, vectors)
+    count("documents_reranked_out", len(docs) - len(reranked))
+    logger.info("重排序: %d 个候选 -> %d 个块", len(docs), len(reranked))
+    return reranked
+
+def build_rag_chain(retriever: "PermissionRetriever", llm, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                    on_packed=None, reranker: Reranker | None = None) -> Runnable:
+    """
+    用给定的检索器和聊天模型构建 RAG 链。
+
+    链的输入为 {"query", "user_role"}，输出为 {"documents", "question", "answer"}。
+    流式调用时，先输出 documents/question，随后逐块输出 answer。设置了 reranker 时，
+    检索和生成之间先重排序 (见 retrieve_documents)。
+    """
+    # 用于将查询和角色传递给检索器的函数
+    def retrieve(input_dict):
+        with span("retrieve"):
+            return retrieve_documents(retriever, input_dict["query"], input_dict["user_role"], reranker)
+
+    # ainvoke 时使用的异步版本：嵌入和 FAISS 搜索不会阻塞事件循环
+    async def aretrieve(input_dict):
+        with span("retrieve"):
+            if reranker is None:
+                return await retriever.aget_relevant_documents(
+                    query=input_dict["query"],
+                    user_role=input_dict["user_role"]
+                )
+            with span("embed_query"):
+                query_embedding = await retriever.embeddings.aembed_query(input_dict["query"])
+            return await asyncio.to_thread(retrieve_documents, retriever, input_dict["query"],
+                                           input_dict["user_role"], reranker, query_embedding)
+
+    # 定义使用 RunnableParallel 和序列操作符 | 的步骤
+    rag_chain_from_docs = build_answer_chain(llm, token_budget, on_packed)
+
     # 主要的链结构
-    rag_chain = RunnableParallel(
+    return RunnableParallel(
         {
-            "documents": retrieve_documents, # 基于查询和角色检索文档
+            "documents": RunnableLambda(retrieve, afunc=aretrieve), # 基于查询和角色检索 (并重排序) 文档
             "question": itemgetter("query") # 直接传递原始查询
         }
     ).assign(answer=rag_chain_from_docs) # 将检索到的文档和问题传递给最终步骤
 
-    logger.info("RAG chain created successfully.")
-else:
-    logger.info("由于初始化错误，无法创建 RAG 链。")
 
+def build_chat_model(chat_model_name: str = GOOGLE_CHAT_MODEL, fallback_models: Iterable[str] = CHAT_FALLBACK_MODELS):
+    """
+    创建用于生成答案的 Gemini 聊天模型 (此时才加载 .env)。
+
+    默认通过 model_client 调用: 每次尝试有时限，慢请求会被对冲，失败或被熔断时
+    依次改用 fallback_models。model_client.USE_RESILIENT_CLIENT 为 False 时使用
+    langchain_google_genai 的 ChatGoogleGenerativeAI (没有后备模型)。
+    """
+    from dotenv import load_dotenv
+    from . import model_client
+
+    load_dotenv()
+    if model_client.USE_RESILIENT_CLIENT:
+        return model_client.build_resilient_chat_model([chat_model_name, *fallback_models], temperature=0)
+
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # temperature=0 使回答更具确定性
+    # convert_system_message_to_human=True 可能对某些 Gemini 提示结构有帮助
+    return ChatGoogleGenerativeAI(model=chat_model_name, temperature=0, convert_system_message_to_human=True)
+
+
+class RagService:
+    """
+    按需构建并缓存检索器、聊天模型和 RAG 链。
 
-# --- 获取响应的函数 ---
-def get_rag_response(query: str, user_role: str) -> str:
+    导入本模块不会加载 .env、反序列化 FAISS 索引或连接 Gemini；这些工作推迟到
+    第一次请求 (或显式调用 warmup()) 时完成，成功后结果会被缓存。构建失败时
+    异常会被记录到 health() 中，下一次访问时会重试，而不是被静默地变成 None。
     """
-    为给定的查询和用户角色从 RAG 链获取响应。
 
-    Args:
-        query: 用户的问题。
-        user_role: 用户的角色 ('HR', 'Engineer', 'PM')。
+    def __init__(self, vectorstore_path: str = VECTORSTORE_PATH, embedding_model_name: str = GOOGLE_EMBEDDING_MODEL,
+                 chat_model_name: str = GOOGLE_CHAT_MODEL, retriever: "PermissionRetriever | None" = None, llm=None,
+                 answer_cache: SemanticAnswerCache | None = None, context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 watch_interval: float | None = None, embeddings: "Embeddings | None" = None,
+                 reranker: Reranker | None = None):
+        """
+        Args:
+            vectorstore_path: 保存的 FAISS 索引目录的路径 (相对于 app/)。
+            embedding_model_name: 索引时使用的嵌入模型的名称。
+            chat_model_name: 用于生成答案的 Gemini 模型名称。
+            retriever: 可选的现成检索器 (例如测试中的本地检索器)。
+            llm: 可选的现成聊天模型或任何可接收提示的 Runnable。
+            answer_cache: 可选的语义答案缓存；设置后，相同角色的近似重复问题在
+                检索结果不变时直接复用之前的答案，不再调用 Gemini。
+            context_token_budget: 提示中上下文部分的 token 上限 (按本地估计)。
+            watch_interval: 设置后，后台线程每隔这么多秒检查向量存储是否被重建，
+                是则加载新版本并切换 (见 reload_index)。
+            embeddings: 可选的嵌入对象，传给延迟构建的检索器 (例如多个租户共用
+                同一个嵌入客户端)；为 None 时由检索器自行创建。
+            reranker: 可选的重排序器 (例如 MMRReranker)；设置后先取回更多候选，
+                重排序后只把选出的块送入提示。
+        """
+        self.vectorstore_path = vectorstore_path
+        self.embedding_model_name = embedding_model_name
+        self.chat_model_name = chat_model_name
+        self.embeddings = embeddings
+        self._retriever = retriever
+        self._llm = llm
+        self._chain: Runnable | None = None
+        self._answer_chain: Runnable | None = None
+        self.answer_cache = answer_cache
+        self.reranker = reranker
+        self.context_token_budget = context_token_budget
+        # 上下文打包的累计统计，见 health()["context"]
+        self._context_stats = {"requests": 0, "original_tokens": 0, "tokens": 0, "tokens_saved": 0}
+        self._errors: dict[str, str] = {}
+        self._lock = threading.RLock()
+        # 每个事件循环各自的并发限制器 (asyncio.Semaphore 不能跨事件循环使用)
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+        # 热重载: 每个检索器 (即索引版本) 上正在进行的请求数，以及切换次数
+        self._readers: dict[object, int] = {}
+        self._reloads = 0
+        self._reload_lock = threading.Lock()
+        self._stop_watching = threading.Event()
+        self._watcher: threading.Thread | None = None
+        if watch_interval is not None:
+            self.start_watching(watch_interval)
+
+    # --- 组件的延迟构建 ---
+    @property
+    def retriever(self) -> "PermissionRetriever":
+        """检索器；第一次访问时加载向量存储。"""
+        if self._retriever is None:
+            with self._lock:
+                if self._retriever is None:
+                    self._retriever = self._build("retriever", self._build_retriever)
+        return self._retriever
+
+    @property
+    def llm(self):
+        """聊天模型；第一次访问时创建。"""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self._llm = self._build("llm", self._build_llm)
+        return self._llm
+
+    @property
+    def chain(self) -> Runnable:
+        """RAG 链；第一次访问时连同检索器和聊天模型一起构建。"""
+        if self._chain is None:
+            with self._lock:
+                if self._chain is None:
+                    self._chain = self._build("chain", lambda: build_rag_chain(
+                        self.retriever, self.llm, self.context_token_budget, self._record_context, self.reranker))
+                    logger.info("RAG chain created successfully.")
+        return self._chain
+
+    @property
+    def answer_chain(self) -> Runnable:
+        """根据已检索文档生成答案的链 (答案缓存路径使用)。"""
+        if self._answer_chain is None:
+            with self._lock:
+                if self._answer_chain is None:
+                    self._answer_chain = build_answer_chain(self.llm, self.context_token_budget, self._record_context)
+        return self._answer_chain
+
+    def _record_context(self, packed: PackedContext):
+        with self._lock:
+            self._context_stats["requests"] += 1
+            self._context_stats["original_tokens"] += packed.original_tokens
+            self._context_stats["tokens"] += packed.tokens
+            self._context_stats["tokens_saved"] += packed.tokens_saved
+
+    def _build(self, component: str, factory):
+        """调用 factory 构建组件，记录 (并重新引发) 构建错误。"""
+        try:
+            result = factory()
+        except Exception as e:
+            self._errors[component] = str(e)
+            logger.info("初始化 %s 时出错: %s", component, e)
+            raise
+        self._errors.pop(component, None)
+        return result
+
+    def _build_retriever(self) -> "PermissionRetriever":
+        from .retriever import PermissionRetriever
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        # PermissionRetriever 的 __init__ 处理路径解析
+        return PermissionRetriever(vectorstore_path=self.vectorstore_path, embedding_model_name=self.embedding_model_name,
+                                   embeddings=self.embeddings)
+
+    def _build_llm(self):
+        return build_chat_model(self.chat_model_name)
+
+    # --- 索引热重载 ---
+    def reload_index(self) -> bool:
+        """
+        如果磁盘上的向量存储已被重建，在当前线程加载新版本并原子地切换。
+
+        新的检索器和链完全构建好之后才在锁内替换引用，因此请求要么使用旧版本，
+        要么使用新版本，不会失败或等待。已经开始的请求继续使用它们租用的旧版本
+        直到结束 (见 _lease)；之后旧版本不再被引用，其内存映射随之释放。
+        尚未加载检索器时什么也不做，因为第一次加载总会读取最新版本。
+
+        Returns:
+            是否切换到了新版本。
+
+        Raises:
+            FileNotFoundError: 目录正处于替换过程中 (稍后重试即可)。
+        """
+        with self._reload_lock:
+            current = self._retriever
+            if current is None or not hasattr(current, "reopen"):
+                return False
+            if current.disk_version() == current.index_version:
+                return False
+
+            new_retriever = current.reopen()
+            if new_retriever.disk_version() != new_retriever.index_version:
+                # 加载期间目录又被替换，读到的文件可能来自两个版本；下次再试
+                logger.info("加载索引版本 %s 期间目录再次被替换，稍后重试。", new_retriever.index_version)
+                return False
+            new_chain = build_rag_chain(new_retriever, self.llm, self.context_token_budget, self._record_context,
+                                        self.reranker)
+            with self._lock:
+                self._retriever, self._chain = new_retriever, new_chain
+                self._reloads += 1
+            logger.info("索引已从版本 %s 切换到 %s", current.index_version, new_retriever.index_version)
+            return True
+
+    def start_watching(self, interval: float = INDEX_WATCH_INTERVAL):
+        """启动后台线程，每隔 interval 秒调用一次 reload_index。"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop_watching.clear()
+
+        def watch():
+            while not self._stop_watching.wait(interval):
+                try:
+                    self.reload_index()
+                except Exception as e:
+                    logger.info("检查或加载新索引版本时出错，稍后重试: %s", e)
+
+        self._watcher = threading.Thread(target=watch, name="index-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    @contextmanager
+    def _lease(self, retriever: "PermissionRetriever | None" = None):
+        """
+        取得一致的 (检索器, 链) 快照，并在请求结束前把它计为该版本的读者。
+
+        调用方必须已经构建好链。retriever 不为 None 时沿用调用方已有的快照
+        (可能已被热重载替换)，此时只有它仍是当前版本才返回链，否则返回 None。
+        """
+        with self._lock:
+            if retriever is None:
+                retriever, chain = self._retriever, self._chain
+            else:
+                chain = self._chain if retriever is self._retriever else None
+            self._readers[retriever] = self._readers.get(retriever, 0) + 1
+        trace = current_trace()
+        version = getattr(retriever, "index_version", None)
+        if trace is not None and version is not None:
+            trace.attributes["index_version"] = version
+        try:
+            yield retriever, chain
+        finally:
+            with self._lock:
+                self._readers[retriever] -= 1
+                if not self._readers[retriever]:
+                    del self._readers[retriever]
+                    if retriever is not self._retriever:
+                        logger.info("旧索引版本 %s 上的请求已全部完成。", version)
+
+    def warmup(self) -> dict:
+        """立即构建所有组件 (例如在服务启动时)，返回 health() 的结果。"""
+        try:
+            self.chain
+        except Exception:
+            pass # 错误已记录在 health() 中
+        return self.health()
+
+    def health(self) -> dict:
+        """报告各组件的状态: "ready"、"not_loaded" 或错误信息。不会触发构建。"""
+        def status(component: str, value) -> str:
+            if value is not None:
+                return "ready"
+            if component in self._errors:
+                return f"error: {self._errors[component]}"
+            return "not_loaded"
+
+        components = {
+            "retriever": status("retriever", self._retriever),
+            "llm": status("llm", self._llm),
+            "chain": status("chain", self._chain),
+        }
+        result = {"ready": self._chain is not None, **components}
+        version = getattr(self._retriever, "index_version", None)
+        if version is not None:
+            with self._lock:
+                draining = sum(n for retriever, n in self._readers.items() if retriever is not self._retriever)
+            result["index"] = {"version": version, "reloads": self._reloads, "draining_requests": draining}
+        if self._context_stats["requests"]:
+            result["context"] = dict(self._context_stats)
+        if self.answer_cache is not None:
+            result["answer_cache"] = self.answer_cache.stats()
+        model_stats = getattr(self._llm, "model_stats", None)
+        if callable(model_stats):
+            result["models"] = model_stats()
+        return result
+
+    def _unavailable_message(self, e: Exception) -> str:
+        return f"错误: RAG 链不可用: {e}"
+
+    # --- 获取响应 ---
+    def get_rag_response(self, query: str, user_role: str | Iterable[str]) -> str:
+        """
+        为给定的查询和用户角色从 RAG 链获取响应。
 
-    Returns:
-        生成的答案字符串，或错误消息。
+        Args:
+            query: 用户的问题。
+            user_role: 用户的角色 ('HR', 'Engineer', 'PM')，或其持有的角色/组集合。
+
+        Returns:
+            生成的答案字符串，或错误消息。
+        """
+        with span("request"):
+            return self._get_rag_response(query, user_role)
+
+    def get_rag_response_with_trace(self, query: str, user_role: str | Iterable[str]) -> tuple[str, dict]:
+        """
+        与 get_rag_response 相同，另外返回本次请求的追踪: 各阶段耗时 (嵌入、
+        向量搜索、权限过滤、BM25、上下文打包、提示格式化、LLM) 和计数
+        (取回/保留的文档数、上下文和 LLM 的 token 数)，见 Trace.to_dict()。
+        """
+        with start_trace() as trace:
+            answer = self.get_rag_response(query, user_role)
+        return answer, trace.to_dict()
+
+    def _get_rag_response(self, query: str, user_role: str) -> str:
+        try:
+            self.chain
+        except Exception as e:
+            return self._unavailable_message(e)
+
+        with self._lease() as (retriever, chain):
+            return self._invoke(query, user_role, retriever, chain)
+
+    def _invoke(self, query: str, user_role: str, retriever: "PermissionRetriever", chain: Runnable) -> str:
+        if self.answer_cache is not None:
+            try:
+                return self._get_cached_or_generate(query, user_role, retriever)
+            except Exception as e:
+                return f"RAG 链调用期间发生错误: {e}"
+
+        try:
+            # 链期望一个包含 'query' 和 'user_role' 的字典
+            response = chain.invoke({"query": query, "user_role": user_role}, config=callback_config())
+            # 我们想要的最终输出在 'answer' 键中
+            return response.get("answer", "错误: 无法从链响应中解析答案。")
+        except Exception as e:
+            # 如果可能，更具体地说明潜在的 API 错误
+            return f"RAG 链调用期间发生错误: {e}"
+
+    def _get_cached_or_generate(self, query: str, user_role: str, retriever: "PermissionRetriever") -> str:
+        """
+        答案缓存路径: 先嵌入查询并检索，再按 (角色, 查询向量, 文档 id 集合) 查找缓存。
+
+        查询向量同时用于检索和缓存查找，因此只嵌入一次。
+        """
+        with span("embed_query"):
+            query_embedding = retriever.embeddings.embed_query(query)
+        with span("retrieve"):
+            docs = retrieve_documents(retriever, query, user_role, self.reranker, query_embedding)
+        return self._answer_from_documents(query, user_role, query_embedding, docs, retriever)
+
+    def get_rag_responses(self, pairs: list[tuple[str, str | list[str]]], max_workers: int = MAX_CONCURRENT_LLM_CALLS,
+                          checkpoint_path: str | None = None) -> list[str]:
+        """
+        批量获取多个 (查询, 角色) 的响应，答案顺序与 pairs 一致。
+
+        每 BATCH_RETRIEVAL_SIZE 个查询一起嵌入和检索 (见
+        PermissionRetriever.get_relevant_documents_batch)，生成答案的 LLM 调用
+        则在最多 max_workers 个线程中并行进行；下一批的检索与上一批的 LLM
+        调用重叠。设置 checkpoint_path 时，每个成功的答案都会立即追加到检查点
+        文件，再次以相同的 pairs 调用时跳过已完成的问题，因此崩溃的任务可以
+        续跑。失败的问题返回错误消息，不写入检查点，续跑时会重试。
+
+        Args:
+            pairs: (查询, 角色) 列表。
+            max_workers: 同时进行的 LLM 调用数上限。
+            checkpoint_path: 可选的检查点 (JSONL) 文件路径。
+
+        Returns:
+            与 pairs 顺序一致的答案字符串 (或错误消息) 列表。
+        """
+        try:
+            self.chain
+        except Exception as e:
+            return [self._unavailable_message(e)] * len(pairs)
+        # 整个批次使用同一个索引版本
+        with self._lease() as (retriever, _):
+            return self._answer_batch(pairs, max_workers, checkpoint_path, retriever)
+
+    def _answer_batch(self, pairs: list[tuple[str, str | list[str]]], max_workers: int, checkpoint_path: str | None,
+                      retriever: "PermissionRetriever") -> list[str]:
+
+        answers: list[str | None] = [None] * len(pairs)
+        if checkpoint_path is not None:
+            for index, answer in load_batch_checkpoint(checkpoint_path, pairs).items():
+                answers[index] = answer
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        logger.info("批量问答: 共 %d 个问题，%d 个已在检查点中完成", len(pairs), len(pairs) - len(pending))
+
+        checkpoint_lock = threading.Lock()
+        checkpoint = open(checkpoint_path, 'a', encoding='utf-8') if checkpoint_path is not None else None
+
+        def answer_one(index: int, query_embedding: list[float], docs: list[Document]):
+            query, user_role = pairs[index]
+            try:
+                answers[index] = self._answer_from_documents(query, user_role, query_embedding, docs, retriever)
+            except Exception as e:
+                answers[index] = f"RAG 链调用期间发生错误: {e}"
+                return
+            if checkpoint is not None:
+                line = json.dumps({"index": index, "query": query, "user_role": user_role,
+                                   "answer": answers[index]}, ensure_ascii=False)
+                with checkpoint_lock:
+                    checkpoint.write(line + "\n")
+                    checkpoint.flush()
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                previous = []
+                for start in range(0, len(pending), BATCH_RETRIEVAL_SIZE):
+                    batch = pending[start:start + BATCH_RETRIEVAL_SIZE]
+                    queries = [pairs[i][0] for i in batch]
+                    user_roles = [pairs[i][1] for i in batch]
+                    try:
+                        query_embeddings = embed_queries(retriever.embeddings, queries)
+                        docs_per_query = self._retrieve_batch(retriever, queries, user_roles, query_embeddings)
+                    except Exception as e:
+                        for i in batch:
+                            answers[i] = f"RAG 链调用期间发生错误: {e}"
+                        continue
+                    current = [pool.submit(answer_one, i, embedding, docs)
+                               for i, embedding, docs in zip(batch, query_embeddings, docs_per_query)]
+                    # 最多保留两批在途，限制内存中的检索结果
+                    wait(previous)
+                    previous = current
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        return answers
+
+    def _retrieve_batch(self, retriever: "PermissionRetriever", queries: list[str],
+                        user_roles: list[str | Iterable[str]], query_embeddings: list[list[float]]) -> list[list[Document]]:
+        """用已计算的查询向量批量检索 (设置了 reranker 时逐个重排序)，结果与 queries 顺序一致。"""
+        with span("retrieve"):
+            if self.reranker is None:
+                return retriever.get_relevant_documents_batch(queries, user_roles, query_embeddings=query_embeddings)
+            candidates = retriever.get_relevant_documents_batch(
+                queries, user_roles, k=self.reranker.candidates, query_embeddings=query_embeddings)
+        return [
+            rerank_documents(retriever, self.reranker, query, embedding, docs)
+            for query, embedding, docs in zip(queries, query_embeddings, candidates)
+        ]
+
+    # --- 分阶段的批量接口 (HTTP 服务层把并发请求合并成批后调用，见 app/server.py) ---
+    @contextmanager
+    def lease(self) -> Iterator["PermissionRetriever"]:
+        """
+        取得当前索引版本的检索器快照，在 with 块结束前把它计为该版本的读者。
+
+        把它传给 retrieve_batch 和 answer_from_documents，检索、答案缓存和报告的
+        index_version 就都使用同一个版本，即使期间发生了热重载。需要时构建链，
+        构建失败时引发异常。以下三个方法同样如此 (而不是返回错误消息)。
+        """
+        self.chain
+        with self._lease() as (retriever, _):
+            yield retriever
+
+    def embed_query_batch(self, queries: list[str]) -> list[list[float]]:
+        """一次嵌入多个查询 (见 embedding_cache.embed_queries)。"""
+        with self.lease() as retriever, span("embed_query"):
+            return embed_queries(retriever.embeddings, queries)
+
+    def retrieve_batch(self, queries: list[str], user_roles: list[str | Iterable[str]],
+                       query_embeddings: list[list[float]],
+                       retriever: "PermissionRetriever | None" = None) -> list[list[Document]]:
+        """
+        按已计算的查询向量批量检索每个查询有权读取的文档，结果与 queries 顺序一致。
+
+        retriever 为 lease() 取得的快照；为 None 时使用当前版本。
+        """
+        self.chain
+        with self._lease(retriever) as (retriever, _):
+            return self._retrieve_batch(retriever, queries, user_roles, query_embeddings)
+
+    def answer_from_documents(self, query: str, user_role: str | Iterable[str], query_embedding: list[float],
+                              docs: list[Document], retriever: "PermissionRetriever | None" = None) -> str:
+        """
+        根据已检索的文档生成答案 (启用答案缓存时先查缓存)。
+
+        retriever 应是检索出 docs 的快照，答案缓存按它的 index_version 查找和写入；
+        为 None 时使用当前版本。
+        """
+        self.chain
+        with self._lease(retriever) as (retriever, _):
+            return self._answer_from_documents(query, user_role, query_embedding, docs, retriever)
+
+    def _answer_from_documents(self, query: str, user_role: str, query_embedding: list[float],
+                               docs: list[Document], retriever: "PermissionRetriever") -> str:
+        """根据已检索的文档生成答案；启用答案缓存时先查缓存。"""
+        if self.answer_cache is None:
+            return self.answer_chain.invoke({"documents": docs, "question": query}, config=callback_config())
+        cache_key = (as_principals(user_role), query_embedding, document_ids(docs))
+        answer = self.answer_cache.lookup(*cache_key, index_version=retriever.index_version)
+        if answer is None:
+            answer = self.answer_chain.invoke({"documents": docs, "question": query}, config=callback_config())
+            self.answer_cache.store(*cache_key, answer, index_version=retriever.index_version)
+        else:
+            count("answer_cache_hits")
+        return answer
+
+    def stream_rag_response(self, query: str, user_role: str | Iterable[str], include_trace: bool = False) -> Iterator[dict]:
+        """
+        以流式方式获取 RAG 响应，模型每生成一段文本就立即产出。
+
+        产出的事件依次为:
+            {"documents": [...]}  检索到的 (已按权限过滤的) 文档，总是第一个事件
+            {"answer": "..."}     答案的增量文本片段，可能有多个
+            {"trace": {...}}      include_trace 为 True 时的最后一个事件 (见 get_rag_response_with_trace)
+        出错时产出 {"error": "..."} 并结束。
+
+        Args:
+            query: 用户的问题。
+            user_role: 用户的角色 ('HR', 'Engineer', 'PM')，或其持有的角色/组集合。
+            include_trace: 是否在最后产出本次请求的追踪。
+        """
+        if not include_trace:
+            with span("request"):
+                yield from self._stream_rag_response(query, user_role)
+            return
+        with start_trace() as trace:
+            with span("request"):
+                yield from self._stream_rag_response(query, user_role)
+        yield {"trace": trace.to_dict()}
+
+    def _stream_rag_response(self, query: str, user_role: str) -> Iterator[dict]:
+        try:
+            self.chain
+        except Exception as e:
+            yield {"error": self._unavailable_message(e)}
+            return
+
+        with self._lease() as (retriever, chain):
+            yield from self._stream(query, user_role, retriever, chain)
+
+    def _stream(self, query: str, user_role: str, retriever: "PermissionRetriever", chain: Runnable) -> Iterator[dict]:
+        if self.answer_cache is not None:
+            yield from self._stream_cached_or_generate(query, user_role, retriever)
+            return
+
+        try:
+            for chunk in chain.stream({"query": query, "user_role": user_role}, config=callback_config()):
+                # RunnableParallel.assign 先输出已就绪的 documents/question，再逐块输出 answer
+                if "documents" in chunk:
+                    yield self._documents_event(chunk["documents"], retriever)
+                if chunk.get("answer"):
+                    yield {"answer": chunk["answer"]}
+        except Exception as e:
+            yield {"error": f"RAG 链调用期间发生错误: {e}"}
+
+    def _stream_cached_or_generate(self, query: str, user_role: str,
+                                   retriever: "PermissionRetriever") -> Iterator[dict]:
+        """stream_rag_response 的答案缓存路径；命中时整个答案作为一个片段产出。"""
+        try:
+            with span("embed_query"):
+                query_embedding = retriever.embeddings.embed_query(query)
+            with span("retrieve"):
+                docs = retrieve_documents(retriever, query, user_role, self.reranker, query_embedding)
+            yield self._documents_event(docs, retriever)
+
+            cache_key = (as_principals(user_role), query_embedding, document_ids(docs))
+            answer = self.answer_cache.lookup(*cache_key, index_version=retriever.index_version)
+            if answer is not None:
+                count("answer_cache_hits")
+                yield {"answer": answer}
+                return
+
+            parts = []
+            for chunk in self.answer_chain.stream({"documents": docs, "question": query}, config=callback_config()):
+                parts.append(chunk)
+                yield {"answer": chunk}
+            self.answer_cache.store(*cache_key, "".join(parts), index_version=retriever.index_version)
+        except Exception as e:
+            yield {"error": f"RAG 链调用期间发生错误: {e}"}
+
+    @staticmethod
+    def _documents_event(docs: list[Document], retriever: "PermissionRetriever") -> dict:
+        """流式响应的第一个事件；检索器有版本标识时附带所用的索引版本。"""
+        version = getattr(retriever, "index_version", None)
+        if version is None:
+            return {"documents": docs}
+        return {"documents": docs, "index_version": version}
+
+    def _llm_semaphore(self) -> asyncio.Semaphore:
+        """返回当前事件循环的 RAG 链并发限制器。"""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+        return semaphore
+
+    async def aget_rag_response(self, query: str, user_role: str | Iterable[str]) -> str:
+        """
+        get_rag_response 的异步版本，基于链的 ainvoke。
+
+        同一事件循环中最多有 MAX_CONCURRENT_LLM_CALLS 个调用同时进行，
+        其余调用在限制器上排队等待，而不是占用工作线程。
+
+        Args:
+            query: 用户的问题。
+            user_role: 用户的角色 ('HR', 'Engineer', 'PM')，或其持有的角色/组集合。
+
+        Returns:
+            生成的答案字符串，或错误消息。
+        """
+        with span("request"):
+            return await self._aget_rag_response(query, user_role)
+
+    async def aget_rag_response_with_trace(self, query: str, user_role: str | Iterable[str]) -> tuple[str, dict]:
+        """get_rag_response_with_trace 的异步版本。"""
+        with start_trace() as trace:
+            answer = await self.aget_rag_response(query, user_role)
+        return answer, trace.to_dict()
+
+    async def _aget_rag_response(self, query: str, user_role: str) -> str:
+        try:
+            # 构建 (加载索引) 是阻塞操作，放到线程池中执行
+            self._chain or await asyncio.to_thread(lambda: self.chain)
+        except Exception as e:
+            return self._unavailable_message(e)
+
+        with self._lease() as (retriever, chain):
+            return await self._ainvoke(query, user_role, retriever, chain)
+
+    async def _ainvoke(self, query: str, user_role: str, retriever: "PermissionRetriever", chain: Runnable) -> str:
+        try:
+            if self.answer_cache is not None:
+                return await self._aget_cached_or_generate(query, user_role, retriever)
+            async with self._llm_semaphore():
+                response = await chain.ainvoke({"query": query, "user_role": user_role}, config=callback_config())
+            return response.get("answer", "错误: 无法从链响应中解析答案。")
+        except Exception as e:
+            return f"RAG 链调用期间发生错误: {e}"
+
+    async def _aget_cached_or_generate(self, query: str, user_role: str, retriever: "PermissionRetriever") -> str:
+        """_get_cached_or_generate 的异步版本；缓存命中时不占用并发限制器。"""
+        with span("embed_query"):
+            query_embedding = await retriever.embeddings.aembed_query(query)
+        with span("retrieve"):
+            docs = await asyncio.to_thread(retrieve_documents, retriever, query, user_role, self.reranker,
+                                           query_embedding)
+        cache_key = (as_principals(user_role), query_embedding, document_ids(docs))
+
+        answer = self.answer_cache.lookup(*cache_key, index_version=retriever.index_version)
+        if answer is None:
+            async with self._llm_semaphore():
+                answer = await self.answer_chain.ainvoke({"documents": docs, "question": query},
+                                                         config=callback_config())
+            self.answer_cache.store(*cache_key, answer, index_version=retriever.index_version)
+        else:
+            count("answer_cache_hits")
+        return answer
+
+
+def load_batch_checkpoint(checkpoint_path: str, pairs: list[tuple[str, str | list[str]]]) -> dict[int, str]:
+    """
+    读取批量问答的检查点，返回 {序号: 答案}。
+
+    检查点是 JSONL 文件，每个已完成的问题一行。只采用序号、问题和角色都与
+    pairs 一致的记录，因此输入改变后旧的检查点不会被误用；进程崩溃时写了
+    一半的最后一行会被忽略。
     """
-    if not rag_chain:
-        return "错误: RAG 链不可用。"
-
-    try:
-        # 链期望一个包含 'query' 和 'user_role' 的字典
-        response = rag_chain.invoke({"query": query, "user_role": user_role})
-        # 我们想要的最终输出在 'answer' 键中
-        return response.get("answer", "错误: 无法从链响应中解析答案。")
-    except Exception as e:
-        # 如果可能，更具体地说明潜在的 API 错误
-        return f"RAG 链调用期间发生错误: {e}"
-
-# 注意：此文件现在只包含核心逻辑和 get_rag_response 函数。
+    answers: dict[int, str] = {}
+    if not os.path.exists(checkpoint_path):
+        return answers
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                index = record["index"]
+                if 0 <= index < len(pairs) and (record["query"], record["user_role"]) == tuple(pairs[index]):
+                    answers[index] = record["answer"]
+            except (ValueError, KeyError, TypeError):
+                continue
+    return answers
+
+
+# --- 默认服务和模块级便捷函数 ---
+_default_service: RagService | None = None
+_default_service_lock = threading.Lock()
+
+def get_default_service() -> RagService:
+    """返回进程内共享的默认 RagService (只创建对象，不构建任何组件)。"""
+    global _default_service
+    if _default_service is None:
+        with _default_service_lock:
+            if _default_service is None:
+                _default_service = RagService(answer_cache=SemanticAnswerCache() if ENABLE_ANSWER_CACHE else None,
+                                              watch_interval=INDEX_WATCH_INTERVAL,
+                                              reranker=MMRReranker() if ENABLE_RERANK else None)
+    return _default_service
+
+def get_rag_response(query: str, user_role: str | Iterable[str]) -> str:
+    """使用默认服务获取响应，参见 RagService.get_rag_response。"""
+    return get_default_service().get_rag_response(query, user_role)
+
+def get_rag_responses(pairs: list[tuple[str, str | list[str]]], **kwargs) -> list[str]:
+    """使用默认服务批量获取响应，参见 RagService.get_rag_responses。"""
+    return get_default_service().get_rag_responses(pairs, **kwargs)
+
+def stream_rag_response(query: str, user_role: str | Iterable[str]) -> Iterator[dict]:
+    """使用默认服务流式获取响应，参见 RagService.stream_rag_response。"""
+    return get_default_service().stream_rag_response(query, user_role)
+
+async def aget_rag_response(query: str, user_role: str | Iterable[str]) -> str:
+    """使用默认服务异步获取响应，参见 RagService.aget_rag_response。"""
+    return await get_default_service().aget_rag_response(query, user_role)
+
+# 注意：此文件现在只包含核心逻辑和获取响应的函数。
 # 测试/示例用法已移至单独的脚本 (例如 tests/test_rag_chain.py)。
@@ -0,0 +1,117 @@
+# secure-rag/app/rerank.py
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+from langchain_core.documents import Document
+
+from .bm25_index import tokenize
+
+# --- 配置 ---
+RERANK_CANDIDATES = 50 # 重排序前取回的 (已通过权限过滤的) 候选数
+RERANK_TOP_K = 4 # 重排序后最多保留的块数
+MMR_LAMBDA = 0.7 # MMR 中相关性的权重；其余为与已选块的差异度
+LEXICAL_WEIGHT = 0.3 # 相关性 = (1 - w) * 向量余弦相似度 + w * 查询词覆盖率
+SCORE_RATIO_CUTOFF = 0.8 # 相关性低于最好候选的这个比例时不再选入，上下文因此可以少于 top_k 块
+
+
+class Reranker(ABC):
+    """
+    检索和生成之间的重排序阶段。
+
+    子类实现 rerank()；链先取回 candidates 个候选，再交给重排序器选出
+    送入提示的块。可以替换为交叉编码器等更重的实现。
+    """
+
+    candidates: int = RERANK_CANDIDATES
+
+    @abstractmethod
+    def rerank(self, query: str, query_embedding: list[float] | None, docs: list[Document],
+               vectors: np.ndarray | None = None) -> list[Document]:
+        """
+        Args:
+            query: 用户的问题。
+            query_embedding: 查询向量；未知时为 None。
+            docs: 检索得到的候选，按检索名次排列。
+            vectors: 可选的候选向量 (第 i 行对应 docs[i])，即索引中已存储的向量。
+
+        Returns:
+            送入提示的块，按重要性排列。
+        """
+
+
+def lexical_overlap(query_tokens: set[str], docs: list[Document]) -> np.ndarray:
+    """每个块覆盖了多少比例的 (去重后的) 查询词。"""
+    if not query_tokens:
+        return np.zeros(len(docs), dtype=np.float32)
+    return np.array([len(query_tokens.intersection(tokenize(doc.page_content))) / len(query_tokens) for doc in docs],
+                    dtype=np.float32)
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _jaccard_matrix(docs: list[Document]) -> np.ndarray:
+    """没有向量时用词集合的 Jaccard 相似度衡量块之间的冗余。"""
+    token_sets = [set(tokenize(doc.page_content)) for doc in docs]
+    similarity = np.eye(len(docs), dtype=np.float32)
+    for i in range(len(docs)):
+        for j in range(i + 1, len(docs)):
+            union = len(token_sets[i] | token_sets[j])
+            similarity[i, j] = similarity[j, i] = len(token_sets[i] & token_sets[j]) / union if union else 0.0
+    return similarity
+
+
+class MMRReranker(Reranker):
+    """
+    只在 CPU 上运行的轻量重排序器，不调用任何模型。
+
+    相关性结合查询与块向量的余弦相似度 (使用索引中已存储的向量，无需重新
+    嵌入) 和查询词覆盖率；再用最大边际相关性 (MMR) 逐个选块，避免选入内容
+    重复的相邻块。相关性低于最好候选的 score_ratio 时停止，因此问题只与少数
+    块相关时送入提示的块会更少。没有向量时只按词覆盖率计算相关性，冗余度
+    改用词集合的 Jaccard 相似度。
+    """
+
+    def __init__(self, top_k: int = RERANK_TOP_K, candidates: int = RERANK_CANDIDATES,
+                 lambda_mult: float = MMR_LAMBDA, lexical_weight: float = LEXICAL_WEIGHT,
+                 score_ratio: float = SCORE_RATIO_CUTOFF):
+        self.top_k = top_k
+        self.candidates = candidates
+        self.lambda_mult = lambda_mult
+        self.lexical_weight = lexical_weight
+        self.score_ratio = score_ratio
+
+    def scores(self, query: str, query_embedding: list[float] | None, docs: list[Document],
+               vectors: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """返回 (每个候选的相关性, 候选两两之间的相似度矩阵)。"""
+        lexical = lexical_overlap(set(tokenize(query)), docs)
+        if vectors is None or query_embedding is None:
+            return lexical, _jaccard_matrix(docs)
+
+        unit = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        query_unit = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        relevance = (1 - self.lexical_weight) * (unit @ query_unit) + self.lexical_weight * lexical
+        return relevance, unit @ unit.T
+
+    def rerank(self, query: str, query_embedding: list[float] | None, docs: list[Document],
+               vectors: np.ndarray | None = None) -> list[Document]:
+        if not docs:
+            return []
+        relevance, similarity = self.scores(query, query_embedding, docs, vectors)
+        # 只有相关性不低于最好候选的 score_ratio 的块才可能被选入 (相关性都不为正时不截断)
+        best_relevance = float(relevance.max())
+        remaining = relevance >= self.score_ratio * best_relevance if best_relevance > 0 else np.ones(len(docs), bool)
+
+        selected: list[int] = []
+        # 每个候选与已选块的最大相似度 (尚未选块时不惩罚)
+        redundancy = np.zeros(len(docs), dtype=np.float32)
+        while len(selected) < self.top_k and remaining.any():
+            mmr = self.lambda_mult * relevance - (1 - self.lambda_mult) * redundancy
+            best = int(np.argmax(np.where(remaining, mmr, -np.inf)))
+            selected.append(best)
+            remaining[best] = False
+            redundancy = similarity[best] if len(selected) == 1 else np.maximum(redundancy, similarity[best])
+        return [docs[i] for i in selected]
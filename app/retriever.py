@@ -1,9 +1,23 @@
 # secure-rag/app/retriever.py
 
+import asyncio
+import json
 import os
+from collections.abc import Iterable
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.docstore.document import Document # 用于类型提示
+from langchain_core.embeddings import Embeddings
+
+from .ann_index import IndexSpec, apply_search_params, load_index_spec, search_parameters
+from .bm25_index import BM25_DIR, BM25Index, reciprocal_rank_fusion
+from .embedding_cache import EMBEDDING_CACHE_PATH, CachedEmbeddings, embed_queries
+from . import model_client
+from .instrumentation import count, span
+from .permissions import PermissionIndex, as_principals, permits
+from .serving_store import SERVING_DIR, SERVING_MANIFEST, ServingStore
 
 # 加载 .env 文件中的环境变量 (例如 GOOGLE_API_KEY)
 # 确保 .env 文件在项目根目录中
@@ -19,90 +33,621 @@ load_dotenv()
 # --- 配置 ---
 VECTORSTORE_PATH = "../vectorstore" # 相对于此脚本的路径 (app/)
 GOOGLE_EMBEDDING_MODEL = "models/embedding-001" # 必须与 indexing.py 中使用的模型匹配
+# 按权限分区的向量存储布局 (必须与 indexing.py 保持一致)
+PARTITIONS_MANIFEST = "partitions.json"
+PARTITIONS_DIR = "partitions"
+VERSION_FILE = "version.json" # 每次保存时写入的索引版本标识 (必须与 indexing.py 保持一致)
+OVERFETCH_FACTOR = 4 # 位掩码模式下首轮取回 k * OVERFETCH_FACTOR 个候选，之后每轮翻倍
+HYBRID_CANDIDATE_FACTOR = 2 # 混合检索时向量和 BM25 各取回 k * HYBRID_CANDIDATE_FACTOR 个候选再融合
+RRF_K = 60 # 倒数排名融合的平滑常数
+ROW_ATTRIBUTE = "_faiss_row" # 单索引中取出的块记录自己的行号 (不写入元数据，不会被序列化)
+
+
+def _row_of(doc: Document) -> int | None:
+    """块在单索引中的行号 (FAISS id)；不是由 PermissionRetriever._document 取出的块返回 None。"""
+    return getattr(doc, ROW_ATTRIBUTE, None)
+
+
+def read_index_version(vectorstore_path: str) -> str:
+    """
+    读取向量存储目录的版本标识。
+
+    新版本的 indexing.py 每次保存都写入 version.json；旧目录没有该文件，
+    此时用目录的 inode 和修改时间代替 (目录被整体替换后同样会变化)。
+
+    Raises:
+        FileNotFoundError: 目录不存在 (例如正处于替换过程中)。
+    """
+    version_path = os.path.join(vectorstore_path, VERSION_FILE)
+    try:
+        with open(version_path, 'r', encoding='utf-8') as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, ValueError, KeyError):
+        stat = os.stat(vectorstore_path)
+        return f"{stat.st_ino}-{stat.st_mtime_ns}"
+
+
+def resolve_vectorstore_path(vectorstore_path: str) -> str:
+    """相对路径按本文件所在的目录 (app/) 解析，返回规范化的绝对路径。"""
+    # 调整路径，使其相对于当前文件位置的父目录中的 vectorstore
+    if not os.path.isabs(vectorstore_path):
+        # 获取当前脚本文件所在的目录
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        # 构建相对于当前脚本的绝对路径
+        vectorstore_path = os.path.join(current_dir, vectorstore_path)
+    return os.path.normpath(vectorstore_path) # 规范化路径 (处理 ../)
+
+
+def build_embeddings(embedding_model_name: str = GOOGLE_EMBEDDING_MODEL,
+                     embedding_cache_path: str | None = EMBEDDING_CACHE_PATH) -> Embeddings:
+    """
+    创建查询用的嵌入对象；embedding_cache_path 不为 None 时加上嵌入缓存。
+
+    默认通过 model_client 调用 (有时限、对冲请求和熔断)；
+    model_client.USE_RESILIENT_CLIENT 为 False 时使用 GoogleGenerativeAIEmbeddings。
+    """
+    try:
+        # 初始化用于索引的相同嵌入函数
+        # GOOGLE_API_KEY 应已通过 load_dotenv() 从 .env 文件加载
+        if model_client.USE_RESILIENT_CLIENT:
+            embeddings = model_client.build_resilient_embeddings(embedding_model_name)
+        else:
+            embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model_name)
+        if embedding_cache_path is not None:
+            # 重复的问题直接命中缓存，无需再次调用嵌入 API
+            embeddings = CachedEmbeddings(embeddings, embedding_model_name, cache_path=embedding_cache_path)
+    except Exception as e:
+        logger.info("初始化 Google Embeddings 时出错。请确保 GOOGLE_API_KEY 在 .env 文件中设置正确。错误: %s", e)
+        raise # 重新引发异常以停止初始化
+    return embeddings
+
 
 class PermissionRetriever:
     """
     一个根据文档元数据中存储的用户权限过滤文档的检索器。
     """
-    def __init__(self, vectorstore_path: str = VECTORSTORE_PATH, embedding_model_name: str = GOOGLE_EMBEDDING_MODEL):
+    def __init__(self, vectorstore_path: str = VECTORSTORE_PATH, embedding_model_name: str = GOOGLE_EMBEDDING_MODEL,
+                 embeddings: Embeddings | None = None, use_id_selector: bool = True,
+                 embedding_cache_path: str | None = EMBEDDING_CACHE_PATH,
+                 nprobe: int | None = None, ef_search: int | None = None, use_mmap: bool = True,
+                 hybrid: bool = True):
         """
         通过加载向量存储来初始化检索器。
 
+        如果目录中存在 partitions.json，则加载按权限集合划分的子索引，
+        检索时只搜索该角色可读的分区；否则加载单个索引。单索引优先以内存映射
+        方式打开 serving/ 中的只读服务格式 (启动时间与语料规模无关，多个进程
+        共享页缓存)，没有时才反序列化 FAISS 存储。单索引如果附带角色位掩码
+        (role_bitmask.npy，见 PermissionIndex)，则在搜索时就排除无权访问的向量；如果附带 BM25 索引
+        (bm25/)，则把词法检索结果与向量检索结果按倒数排名融合。
+
         Args:
             vectorstore_path: 保存的 FAISS 索引目录的路径。
             embedding_model_name: 索引时使用的嵌入模型的名称。
+            embeddings: 可选的嵌入对象；为 None 时创建 GoogleGenerativeAIEmbeddings。
+            use_id_selector: 位掩码模式下是否把位掩码作为 FAISS ID 选择器传入；
+                为 False 或索引不支持选择器时，改为分轮扩大取回数量。
+            embedding_cache_path: 查询嵌入缓存 (SQLite) 的路径；为 None 时不缓存。
+                只对内部创建的 GoogleGenerativeAIEmbeddings 生效。
+            nprobe: IVF 索引每次查询探查的列表数；为 None 时使用 index_spec.json 中的默认值。
+            ef_search: HNSW 索引的搜索队列长度；为 None 时使用 index_spec.json 中的默认值。
+            use_mmap: 是否优先使用内存映射的服务格式；为 False 时总是通过 FAISS.load_local 加载。
+            hybrid: 是否在有 BM25 索引时启用词法 + 向量的混合检索。
         """
-        # 调整路径，使其相对于当前文件位置的父目录中的 vectorstore
-        # 如果 vectorstore_path 是相对路径，则基于当前文件的目录进行解析
-        if not os.path.isabs(vectorstore_path):
-             # 获取当前脚本文件所在的目录
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            # 构建相对于当前脚本的绝对路径
-            vectorstore_path = os.path.join(current_dir, vectorstore_path)
-            vectorstore_path = os.path.normpath(vectorstore_path) # 规范化路径 (处理 ../)
-
-        logger.info(f"Attempting to load vector store from: {vectorstore_path}") # 调试信息
+        vectorstore_path = resolve_vectorstore_path(vectorstore_path)
+        logger.info("Attempting to load vector store from: %s", vectorstore_path) # 调试信息
 
         if not os.path.exists(vectorstore_path) or not os.path.isdir(vectorstore_path):
             raise FileNotFoundError(f"在 {vectorstore_path} 找不到向量存储目录。请确保路径正确并且已运行 indexing.py。")
 
-        try:
-            # 初始化用于索引的相同嵌入函数
-            # GOOGLE_API_KEY 应已通过 load_dotenv() 从 .env 文件加载
-            embeddings = GoogleGenerativeAIEmbeddings(model=embedding_model_name)
-        except Exception as e:
-            logger.info(f"初始化 Google Embeddings 时出错。请确保 GOOGLE_API_KEY 在 .env 文件中设置正确。错误: {e}")
-            raise # 重新引发异常以停止初始化
+        if embeddings is None:
+            embeddings = build_embeddings(embedding_model_name, embedding_cache_path)
+        self.embeddings = embeddings
+
+        self.use_id_selector = use_id_selector
+        self.vectorstore_path = vectorstore_path
+        # 重新打开同一目录 (热重载) 时沿用的参数
+        self._options = {"use_id_selector": use_id_selector, "nprobe": nprobe, "ef_search": ef_search,
+                         "use_mmap": use_mmap, "hybrid": hybrid}
+        # 向量存储目录的版本标识；目录被重建 (整体替换) 后会变化，供答案缓存和热重载判断是否失效
+        self.index_version = read_index_version(vectorstore_path)
+        self.vectorstore = None
+        # 内存映射的只读服务格式 (与 self.vectorstore 二选一)
+        self.serving: ServingStore | None = None
+        # 分区模式下: [(允许的角色集合, 该分区的 FAISS 存储)]
+        self.partitions: list[tuple[frozenset[str], frozenset[str], FAISS]] = [] # (允许, 拒绝, 索引)
+        # 位掩码模式下: 与 FAISS id 对齐的编译好的 ACL (允许/拒绝位集)
+        self.permissions: PermissionIndex | None = None
+        # 与 FAISS id 对齐的 BM25 索引 (混合检索)；分区模式下不使用
+        self.bm25: BM25Index | None = None
+        # chunk_id -> (FAISS 存储, 行号): 按需建立的 docstore 反查表 (分区中的块没有记录行号)
+        self._docstore_rows: dict[str, tuple[FAISS, int]] | None = None
+        # 单索引的类型 (Flat / IVF / PQ / HNSW) 及搜索参数
+        self.index_spec: IndexSpec | None = None
+        self.nprobe = nprobe
+        self.ef_search = ef_search
 
         try:
-            # 加载 FAISS 向量存储
-            self.vectorstore = FAISS.load_local(
-                vectorstore_path,
-                embeddings,
-                allow_dangerous_deserialization=True # 为兼容性添加
-            )
-            logger.info(f"成功从 {vectorstore_path} 加载向量存储")
+            manifest_path = os.path.join(vectorstore_path, PARTITIONS_MANIFEST)
+            if os.path.exists(manifest_path):
+                self.partitions = self._load_partitions(vectorstore_path, manifest_path)
+                logger.info("成功从 %s 加载 %d 个权限分区", vectorstore_path, len(self.partitions))
+            elif use_mmap and os.path.exists(os.path.join(vectorstore_path, SERVING_DIR, SERVING_MANIFEST)):
+                self.serving = ServingStore(os.path.join(vectorstore_path, SERVING_DIR))
+                logger.info("成功以内存映射方式打开 %s 中的 %d 个向量", vectorstore_path, self.serving.ntotal)
+                self._load_index_spec(vectorstore_path, nprobe, ef_search)
+                self._load_bitmask(vectorstore_path, mmap_mode='r')
+            else:
+                # 加载 FAISS 向量存储
+                self.vectorstore = FAISS.load_local(
+                    vectorstore_path,
+                    embeddings,
+                    allow_dangerous_deserialization=True # 为兼容性添加
+                )
+                logger.info("成功从 %s 加载向量存储", vectorstore_path)
+                self._load_index_spec(vectorstore_path, nprobe, ef_search)
+                self._load_bitmask(vectorstore_path)
+            if hybrid and not self.partitions:
+                self._load_bm25(vectorstore_path)
         except Exception as e:
-            logger.info(f"从 {vectorstore_path} 加载向量存储时出错: {e}")
+            logger.info("从 %s 加载向量存储时出错: %s", vectorstore_path, e)
             raise # 重新引发
 
-    def get_relevant_documents(self, query: str, user_role: str, k: int = 4) -> list[Document]:
+    def disk_version(self) -> str:
+        """磁盘上当前的索引版本；与 index_version 不同说明目录已被重建。"""
+        return read_index_version(self.vectorstore_path)
+
+    def reopen(self) -> "PermissionRetriever":
+        """以相同的参数和嵌入对象 (包括其缓存) 重新加载同一目录，返回新的检索器。"""
+        return PermissionRetriever(self.vectorstore_path, embeddings=self.embeddings, **self._options)
+
+    def set_search_params(self, nprobe: int | None = None, ef_search: int | None = None):
+        """
+        调整近似索引的搜索参数，以召回率换取延迟 (对 Flat 索引无效)。
+
+        nprobe 越大 IVF 搜索越精确也越慢；ef_search 对 HNSW 同理。
+        为 None 的参数保持不变。
+        """
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        if self.vectorstore is not None:
+            apply_search_params(self.vectorstore.index, self.nprobe, self.ef_search)
+        elif self.serving is not None and self.serving.index is not None:
+            apply_search_params(self.serving.index, self.nprobe, self.ef_search)
+
+    def _load_index_spec(self, vectorstore_path: str, nprobe: int | None, ef_search: int | None):
+        """读取 index_spec.json 并应用搜索参数；显式传入的参数优先。"""
+        self.index_spec = load_index_spec(vectorstore_path) or IndexSpec(factory="Flat")
+        self.set_search_params(nprobe or self.index_spec.nprobe, ef_search or self.index_spec.ef_search)
+
+    def _load_bitmask(self, vectorstore_path: str, mmap_mode: str | None = None):
+        """加载角色位集；缺失或与索引不对齐时退回到检索后过滤。"""
+        permissions = PermissionIndex.load(vectorstore_path, mmap_mode=mmap_mode)
+        if permissions is None:
+            return
+        ntotal = self.serving.ntotal if self.serving is not None else self.vectorstore.index.ntotal
+        if len(permissions) != ntotal:
+            logger.info("警告: 位掩码长度 %d 与索引大小 %d 不一致，忽略位掩码。", len(permissions), ntotal)
+            return
+        self.permissions = permissions
+        logger.info("已加载 %d 个角色/组的位掩码 (%s)，检索前过滤已启用。", len(permissions.role_bits),
+                    "含拒绝规则" if permissions.deny is not None else "无拒绝规则")
+
+    def _load_bm25(self, vectorstore_path: str):
+        """加载 BM25 索引；缺失或与索引不对齐时只使用向量检索。"""
+        bm25 = BM25Index.load(os.path.join(vectorstore_path, BM25_DIR))
+        if bm25 is None:
+            return
+        ntotal = self.serving.ntotal if self.serving is not None else self.vectorstore.index.ntotal
+        if bm25.n_docs != ntotal:
+            logger.info("警告: BM25 索引大小 %d 与索引大小 %d 不一致，忽略 BM25 索引。", bm25.n_docs, ntotal)
+            return
+        self.bm25 = bm25
+        logger.info("已加载包含 %d 个词的 BM25 索引，混合检索已启用。", len(bm25.vocabulary))
+
+    def _load_partitions(self, vectorstore_path: str,
+                         manifest_path: str) -> list[tuple[frozenset[str], frozenset[str], FAISS]]:
+        """
+        根据 partitions.json 加载每个权限分区的 FAISS 索引。
+
+        分区按 (允许, 拒绝) 角色集合划分；旧版本的清单没有 deny 字段，其分区中
+        可能混有被拒绝的块，此时结果可能少于 k 个，需要重建索引。
+        """
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        if any("deny" not in entry for entry in manifest["partitions"]):
+            logger.info("警告: %s 中的分区没有按拒绝规则划分，有拒绝规则时检索结果可能少于 k 个，请重建索引。",
+                        manifest_path)
+        partitions = []
+        for entry in manifest["partitions"]:
+            partition_store = FAISS.load_local(
+                os.path.join(vectorstore_path, PARTITIONS_DIR, entry["name"]),
+                self.embeddings,
+                allow_dangerous_deserialization=True
+            )
+            partitions.append((frozenset(entry["permission"]), frozenset(entry.get("deny", ())), partition_store))
+        return partitions
+
+    def _readable_partitions(self, principals: frozenset[str]) -> list[FAISS]:
+        """用户可读的分区: 持有分区允许的某个角色/组，且不持有任何被拒绝的角色/组 (见 permits)。"""
+        return [store for allow, deny, store in self.partitions
+                if not principals.isdisjoint(allow) and principals.isdisjoint(deny)]
+
+    def get_relevant_documents(self, query: str, user_role: str | Iterable[str], k: int = 4,
+                               query_embedding: list[float] | None = None) -> list[Document]:
         """
         检索与查询相关的文档，并根据用户角色对其进行过滤。
 
         Args:
             query: 用户的问题。
-            user_role: 发出查询的用户的角色 (例如 'HR', 'Engineer', 'PM')。
+            user_role: 发出查询的用户的角色 (例如 'HR', 'Engineer', 'PM')，或其持有的
+                角色/组集合 (例如 ['Engineer', 'team-payments'])；持有任一允许的角色/组
+                即可读取，持有任一被拒绝的角色/组则不可读取。
             k: 在过滤前最初检索的文档数。
+            query_embedding: 可选的、已计算好的查询向量；为 None 时在此嵌入查询。
 
         Returns:
             一个与用户相关且用户可访问的 LangChain Document 对象列表。
         """
-        if not self.vectorstore:
+        if self.vectorstore is None and self.serving is None and not self.partitions:
             logger.info("错误: 向量存储未加载。")
             return []
 
-        logger.info(f"\n--- 正在为角色检索: {user_role} ---")
-        logger.info(f"查询: {query}")
+        principals = as_principals(user_role)
+        logger.info("\n--- 正在为角色检索: %s ---", ", ".join(sorted(principals)))
+        logger.info("查询: %s", query)
+
+        # 混合检索时两路各多取一些候选，融合后再截取前 k 个
+        fetch = k * HYBRID_CANDIDATE_FACTOR if self.bm25 is not None else k
 
         # 1. 执行相似性搜索
         try:
-            potential_matches = self.vectorstore.similarity_search(query, k=k)
-            logger.info(f"找到 {len(potential_matches)} 个潜在匹配项 (过滤前)。")
+            if query_embedding is None:
+                with span("embed_query"):
+                    query_embedding = self.embeddings.embed_query(query)
+            with span("vector_search"):
+                if self.partitions:
+                    potential_matches = self._search_partitions(query_embedding, principals, fetch)
+                elif self.serving is not None:
+                    potential_matches = self._search_serving(query_embedding, principals, fetch)
+                elif self.permissions is not None:
+                    potential_matches = self._search_with_bitmask(query_embedding, principals, fetch)
+                else:
+                    potential_matches = self.vectorstore.similarity_search_by_vector(query_embedding, k=fetch)
+            logger.info("找到 %d 个潜在匹配项 (过滤前)。", len(potential_matches))
         except Exception as e:
-            logger.info(f"相似性搜索期间出错: {e}")
+            logger.info("相似性搜索期间出错: %s", e)
             return []
 
-        # 2. 根据 user_role 和文档元数据过滤结果
-        filtered_docs = []
-        for doc in potential_matches:
-            if 'permission' in doc.metadata:
-                allowed_roles = doc.metadata['permission']
-                if user_role in allowed_roles:
-                    filtered_docs.append(doc)
-            else:
-                logger.info(f"警告: 文档 '{doc.metadata.get('title', 'N/A')}' 缺少 'permission' 元数据。拒绝访问。")
-                pass
+        return self._filter_and_fuse(query, principals, potential_matches, k, fetch)
+
+    def _filter_and_fuse(self, query: str, principals: frozenset[str], potential_matches: list[Document],
+                         k: int, fetch: int) -> list[Document]:
+        """按权限过滤向量检索结果，并在启用混合检索时与 BM25 结果融合。"""
+        # 2. 根据用户的角色/组和文档元数据过滤结果
+        # (分区和位掩码模式下这一步只是纵深防御，结果本应全部通过)
+        count("documents_fetched", len(potential_matches))
+        with span("permission_filter"):
+            filtered_docs = self._filter_by_permission(potential_matches, principals)
+
+        # 3. 与同样经过权限过滤的 BM25 结果融合
+        if self.bm25 is not None:
+            try:
+                with span("bm25_search"):
+                    lexical_matches = self._search_lexical(query, principals, fetch)
+                    lexical_docs = self._filter_by_permission(lexical_matches, principals)
+                count("documents_fetched", len(lexical_matches))
+                logger.info("BM25 找到 %d 个已授权的匹配项。", len(lexical_docs))
+                with span("rank_fusion"):
+                    filtered_docs = self._fuse([filtered_docs, lexical_docs], k)
+            except Exception as e:
+                logger.info("BM25 检索期间出错，只使用向量检索结果: %s", e)
+                filtered_docs = filtered_docs[:k]
+
+        count("documents_kept", len(filtered_docs))
+        logger.info("权限过滤后返回 %d 个文档。", len(filtered_docs))
+        return filtered_docs
+
+    def get_relevant_documents_batch(self, queries: list[str], user_roles: list[str | Iterable[str]], k: int = 4,
+                                     query_embeddings: list[list[float]] | None = None) -> list[list[Document]]:
+        """
+        get_relevant_documents 的批量版本，用于离线评估等批处理任务。
+
+        所有查询一次批量嵌入；查询按角色集合分组，每组只做一次矩阵搜索 (同一角色集合
+        共用同一个位掩码或可读分区)，之后每个查询照常经过权限过滤和 BM25 融合。
+        与 get_relevant_documents 不同，嵌入或搜索出错时会引发异常，而不是返回
+        空列表，以免批处理把检索失败当成 "没有相关文档" 记录下来。
+
+        Args:
+            queries: 问题列表。
+            user_roles: 与 queries 一一对应的角色 (或角色/组集合)。
+            k: 每个查询返回的文档数。
+            query_embeddings: 可选的、已计算好的查询向量。
+
+        Returns:
+            与 queries 顺序一致的文档列表。
+        """
+        if len(queries) != len(user_roles):
+            raise ValueError("queries 与 user_roles 的长度必须相同。")
+        if self.vectorstore is None and self.serving is None and not self.partitions:
+            logger.info("错误: 向量存储未加载。")
+            return [[] for _ in queries]
+        if not queries:
+            return []
+
+        fetch = k * HYBRID_CANDIDATE_FACTOR if self.bm25 is not None else k
+        if query_embeddings is None:
+            with span("embed_query"):
+                query_embeddings = embed_queries(self.embeddings, queries)
+        vectors = np.asarray(query_embeddings, dtype=np.float32)
+
+        rows_by_role: dict[frozenset[str], list[int]] = {}
+        for i, user_role in enumerate(user_roles):
+            rows_by_role.setdefault(as_principals(user_role), []).append(i)
+
+        results: list[list[Document]] = [[] for _ in queries]
+        for principals, rows in rows_by_role.items():
+            logger.info("批量检索: 角色 %s 的 %d 个查询", ", ".join(sorted(principals)), len(rows))
+            with span("vector_search"):
+                matches = self._search_batch(vectors[rows], principals, fetch)
+            for i, potential_matches in zip(rows, matches):
+                results[i] = self._filter_and_fuse(queries[i], principals, potential_matches, k, fetch)
+        return results
+
+    def _search_batch(self, vectors: np.ndarray, principals: frozenset[str], k: int) -> list[list[Document]]:
+        """对同一角色集合的一组查询向量 (查询数 x 维度) 做一次矩阵搜索。"""
+        if self.partitions:
+            return self._search_partitions_batch(vectors, principals, k)
+        if self.serving is not None:
+            allowed = None
+            if self.permissions is not None:
+                allowed = self.permissions.allowed(principals)
+                if not allowed.any():
+                    return [[] for _ in vectors]
+            found = self.serving.search_batch(vectors, k, allowed, self.nprobe, self.ef_search)
+            return [[self._document(int(i)) for i in ids] for ids in found]
+
+        index = self.vectorstore.index
+        query_vectors = vectors.copy()
+        if self.vectorstore._normalize_L2:
+            faiss.normalize_L2(query_vectors)
+        if self.permissions is None:
+            _, found = index.search(query_vectors, k)
+            return [[self._document(int(i)) for i in ids if i >= 0] for ids in found]
+
+        allowed = self.permissions.allowed(principals)
+        n_allowed = int(allowed.sum())
+        if n_allowed == 0:
+            return [[] for _ in vectors]
+        if self.use_id_selector:
+            selector = faiss.IDSelectorBitmap(np.packbits(allowed, bitorder='little'))
+            try:
+                params = search_parameters(index, selector, self.nprobe, self.ef_search)
+                _, found = index.search(query_vectors, min(k, n_allowed), params=params)
+                return [[self._document(int(i)) for i in ids if i >= 0] for ids in found]
+            except RuntimeError as e:
+                logger.info("索引不支持 ID 选择器，改为逐个查询分轮取回: %s", e)
+        return [self._search_with_bitmask(vector.tolist(), principals, k) for vector in vectors]
+
+    def _search_partitions_batch(self, vectors: np.ndarray, principals: frozenset[str],
+                                 k: int) -> list[list[Document]]:
+        """_search_partitions 的批量版本: 每个可读分区做一次矩阵搜索，再按距离合并。"""
+        scored: list[list[tuple[float, Document]]] = [[] for _ in vectors]
+        for store in self._readable_partitions(principals):
+            query_vectors = vectors.copy()
+            if store._normalize_L2:
+                faiss.normalize_L2(query_vectors)
+            distances, found = store.index.search(query_vectors, k)
+            for row, (row_distances, ids) in enumerate(zip(distances, found)):
+                scored[row].extend(
+                    (float(distance), store.docstore.search(store.index_to_docstore_id[int(i)]))
+                    for distance, i in zip(row_distances, ids) if i >= 0
+                )
+        return [[doc for _, doc in sorted(pairs, key=lambda pair: pair[0])[:k]] for pairs in scored]
+
+    def _filter_by_permission(self, docs: list[Document], principals: frozenset[str]) -> list[Document]:
+        """
+        只保留用户可读的文档；缺少 'permission' 元数据的文档一律拒绝。
+
+        有位集且每个候选都记有行号 (见 _document) 时，一次 PermissionIndex.allowed
+        调用评估整批候选；否则 (没有位集、分区模式) 逐个按元数据判断 (见 permits)。
+        """
+        rows = [_row_of(doc) for doc in docs]
+        if self.permissions is not None and docs and None not in rows:
+            readable = self.permissions.allowed(principals, rows=np.array(rows)).tolist()
+        else:
+            readable = [permits(doc.metadata, principals) for doc in docs]
 
-        logger.info(f"权限过滤后返回 {len(filtered_docs)} 个文档。")
+        filtered_docs = []
+        for doc, is_readable in zip(docs, readable):
+            if 'permission' not in doc.metadata:
+                logger.info("警告: 文档 '%s' 缺少 'permission' 元数据。拒绝访问。", doc.metadata.get('title', 'N/A'))
+            elif is_readable:
+                filtered_docs.append(doc)
         return filtered_docs
+
+    def _search_lexical(self, query: str, principals: frozenset[str], k: int) -> list[Document]:
+        """BM25 检索；有位掩码时只对用户可读的块计分。"""
+        allowed = None
+        if self.permissions is not None:
+            allowed = self.permissions.allowed(principals)
+        return [self._document(row) for row, _ in self.bm25.search(query, k, allowed)]
+
+    def _document(self, i: int) -> Document:
+        """按 FAISS id 取出块，并把行号记在块上 (见 _row_of)。"""
+        if self.serving is not None:
+            doc = self.serving.document(i)
+        else:
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i])
+        # docstore 中的块被多个请求共享，但它在本索引中的行号固定不变
+        setattr(doc, ROW_ATTRIBUTE, i)
+        return doc
+
+    def document_vectors(self, docs: list[Document]) -> np.ndarray | None:
+        """
+        返回 docs 在索引中已存储的向量 (第 i 行对应 docs[i])，供重排序使用，无需重新嵌入。
+
+        行号取自块本身 (见 _document)，不依赖任何可被淘汰的缓存。某个块找不到
+        (例如不是本检索器取出的块，或旧索引中没有 chunk_id)，或索引无法还原向量
+        (例如没有直接映射的 IVF 索引) 时返回 None。
+        """
+        if not docs:
+            return None
+        try:
+            if self.serving is not None:
+                rows = [_row_of(doc) for doc in docs]
+                if None in rows:
+                    return None
+                if self.serving.vectors is not None:
+                    return np.asarray(self.serving.vectors[rows], dtype=np.float32)
+                return np.stack([self.serving.index.reconstruct(row) for row in rows])
+
+            located = [self._locate(doc) for doc in docs]
+            if None in located:
+                return None
+            return np.stack([store.index.reconstruct(row) for store, row in located])
+        except RuntimeError as e:
+            logger.info("索引无法还原已存储的向量，重排序不使用向量: %s", e)
+            return None
+
+    def _locate(self, doc: Document) -> tuple[FAISS, int] | None:
+        """块所在的 FAISS 存储及行号；分区中的块按 chunk_id (即 docstore id) 反查。"""
+        row = _row_of(doc)
+        if self.vectorstore is not None and row is not None:
+            return self.vectorstore, row
+        chunk_id = doc.metadata.get("chunk_id")
+        if chunk_id is None:
+            return None
+        if self._docstore_rows is None:
+            stores = [store for _, _, store in self.partitions] if self.partitions else [self.vectorstore]
+            self._docstore_rows = {docstore_id: (store, row) for store in stores
+                                   for row, docstore_id in store.index_to_docstore_id.items()}
+        return self._docstore_rows.get(chunk_id)
+
+    @staticmethod
+    def _fuse(rankings: list[list[Document]], k: int) -> list[Document]:
+        """按倒数排名融合多路结果；同一个块 (chunk_id 相同) 只保留一次。"""
+        by_key: dict[str, Document] = {}
+        keys = []
+        for ranking in rankings:
+            ranking_keys = []
+            for doc in ranking:
+                key = doc.metadata.get("chunk_id") or doc.page_content
+                by_key.setdefault(key, doc)
+                ranking_keys.append(key)
+            keys.append(ranking_keys)
+        return [by_key[key] for key in reciprocal_rank_fusion(keys, k, RRF_K)]
+
+    async def aget_relevant_documents(self, query: str, user_role: str | Iterable[str], k: int = 4) -> list[Document]:
+        """
+        get_relevant_documents 的异步版本。
+
+        查询通过嵌入对象的异步接口嵌入，阻塞的 FAISS 搜索和权限过滤则放到
+        线程池中执行，因此不会占用事件循环。
+        """
+        if self.vectorstore is None and self.serving is None and not self.partitions:
+            logger.info("错误: 向量存储未加载。")
+            return []
+
+        try:
+            with span("embed_query"):
+                query_embedding = await self.embeddings.aembed_query(query)
+        except Exception as e:
+            logger.info("嵌入查询期间出错: %s", e)
+            return []
+        return await asyncio.to_thread(self.get_relevant_documents, query, user_role, k, query_embedding)
+
+    def _search_partitions(self, query_embedding: list[float], principals: frozenset[str],
+                           k: int) -> list[Document]:
+        """
+        只在用户可读的分区中搜索，并按距离合并各分区的结果。
+
+        分区按允许和拒绝的角色集合一起划分，可读分区中的块都已授权；每个分区
+        都返回自己的 top-k，因此只要可读分区中共有至少 k 个块，合并后就能保证
+        得到 k 个已授权的结果。
+        """
+        readable = self._readable_partitions(principals)
+        if not readable:
+            return []
+
+        # 查询只嵌入一次，然后在每个可读分区中按向量搜索
+        scored: list[tuple[Document, float]] = []
+        for store in readable:
+            scored.extend(store.similarity_search_with_score_by_vector(query_embedding, k=k))
+
+        # FAISS 默认返回 L2 距离，越小越相似
+        scored.sort(key=lambda pair: pair[1])
+        return [doc for doc, _ in scored[:k]]
+
+    def _search_serving(self, query_embedding: list[float], principals: frozenset[str], k: int) -> list[Document]:
+        """
+        在内存映射的服务格式中搜索。
+
+        有位掩码时只考虑用户可读的行，一轮即可得到 k 个已授权结果；
+        没有位掩码时取回前 k 个，由调用方在检索后过滤。
+        """
+        allowed = None
+        if self.permissions is not None:
+            allowed = self.permissions.allowed(principals)
+            if not allowed.any():
+                return []
+        count("search_rounds")
+        ids = self.serving.search(query_embedding, k, allowed, self.nprobe, self.ef_search)
+        return [self._document(int(i)) for i in ids]
+
+    def _search_with_bitmask(self, query_embedding: list[float], principals: frozenset[str],
+                             k: int) -> list[Document]:
+        """
+        在单个索引中只返回用户可读的前 k 个向量。
+
+        优先把位掩码作为 FAISS ID 选择器传入，一轮即可得到结果；否则从
+        k * OVERFETCH_FACTOR 个候选开始，每轮翻倍，直到凑满 k 个已授权结果
+        或已扫描整个索引。只有通过位掩码的 id 才会被转换成 Document。
+        所用轮数计入当前追踪的 search_rounds 计数。
+        """
+        allowed = self.permissions.allowed(principals)
+        n_allowed = int(allowed.sum())
+        if n_allowed == 0:
+            return []
+
+        query_vector = np.array([query_embedding], dtype=np.float32)
+        if self.vectorstore._normalize_L2:
+            faiss.normalize_L2(query_vector)
+        ids, rounds = self._bitmask_ids(query_vector, allowed, min(k, n_allowed), k)
+        count("search_rounds", rounds)
+        return [self._document(int(i)) for i in ids[:k]]
+
+    def _bitmask_ids(self, query_vector: np.ndarray, allowed: np.ndarray, target: int,
+                     k: int) -> tuple[np.ndarray, int]:
+        """返回 (已授权的候选 id, 所用搜索轮数)；见 _search_with_bitmask。"""
+        index = self.vectorstore.index
+        rounds = 0
+
+        ids = None
+        if self.use_id_selector:
+            selector = faiss.IDSelectorBitmap(np.packbits(allowed, bitorder='little'))
+            try:
+                params = search_parameters(index, selector, self.nprobe, self.ef_search)
+                _, found = index.search(query_vector, target, params=params)
+                ids = found[0][found[0] >= 0]
+                rounds = 1
+            except RuntimeError as e:
+                # 某些索引类型 (例如 PQ) 不支持 ID 选择器
+                logger.info("索引不支持 ID 选择器，改为分轮取回: %s", e)
+
+        if ids is None:
+            fetch = k * OVERFETCH_FACTOR
+            while True:
+                rounds += 1
+                fetch = min(fetch, index.ntotal)
+                _, found = index.search(query_vector, fetch)
+                candidates = found[0][found[0] >= 0]
+                ids = candidates[allowed[candidates]]
+                if len(ids) >= target or fetch >= index.ntotal:
+                    break
+                fetch *= 2
+
+        return ids, rounds
@@ -0,0 +1,364 @@
+# secure-rag/app/server.py
+
+import argparse
+import asyncio
+import json
+import weakref
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import TYPE_CHECKING, Any
+
+from langchain_core.documents import Document
+
+from .instrumentation import METRICS, count
+from .permissions import as_principals
+from .rag_chain import MAX_CONCURRENT_LLM_CALLS, RagService, get_default_service
+
+import logging
+
+if TYPE_CHECKING:
+    from .retriever import PermissionRetriever
+
+# 配置日志记录
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+BATCH_WINDOW_MS = 3.0 # 第一个调用到达后等待多久 (毫秒) 再把收集到的调用作为一批执行
+MAX_BATCH_SIZE = 64 # 每批最多的调用数；攒满后立即执行，不再等待窗口结束
+MAX_BODY_BYTES = 64 * 1024 # 请求体上限
+MAX_QUERY_CHARS = 4000 # 查询长度上限
+
+
+class MicroBatcher:
+    """
+    把短时间窗口内并发到达的调用合并为一次批量调用。
+
+    第一个调用到达时开始计时，窗口结束 (或攒满 max_batch_size 个) 时把收集到
+    的输入交给 batch_fn，在线程池中执行 (batch_fn 是阻塞的，例如嵌入请求和
+    FAISS 搜索)，再把结果按顺序分发给各个调用者。上一批执行期间到达的调用
+    组成下一批，因此负载越高批次越大，空闲时单个调用最多多等一个窗口。
+
+    实例属于创建它的事件循环。
+    """
+
+    def __init__(self, name: str, batch_fn: Callable[[list], list], window_ms: float = BATCH_WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.items = 0
+        self._pending: list[tuple[Any, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, item):
+        """加入当前批次并等待它的结果；batch_fn 引发的异常会传给这一批的每个调用者。"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size or self.window <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        count(f"{self.name}_batches")
+        count(f"{self.name}_batched_calls", len(batch))
+        try:
+            results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+            if len(results) != len(batch):
+                # 否则没有对应结果的调用者会永远等待
+                raise RuntimeError(f"{self.name} 批处理函数对 {len(batch)} 个调用返回了 {len(results)} 个结果")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done(): # 调用者可能已经取消
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "calls": self.items,
+                "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0}
+
+
+class RequestCoalescer:
+    """
+    合并相同的在途请求: 同一个 key 同时只执行一次，其余调用者等待同一个结果。
+
+    结果不会在完成后保留 (那是答案缓存的职责)。某个调用者断开连接时，共享的
+    任务继续为其他调用者运行。
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable]):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            count("requests_coalesced")
+        return await asyncio.shield(task)
+
+
+class _LoopState:
+    """一个事件循环内的批处理器、合并器和 LLM 并发限制器。"""
+
+    def __init__(self, service: RagService, window_ms: float, max_batch_size: int):
+        self.embedder = MicroBatcher("embed", service.embed_query_batch, window_ms, max_batch_size)
+        self.searcher = MicroBatcher("search", lambda items: _search_batch(service, items), window_ms, max_batch_size)
+        self.coalescer = RequestCoalescer()
+        self.llm_slots = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+
+def _search_batch(service: RagService, items: list[tuple]) -> list[tuple["PermissionRetriever", list[Document]]]:
+    """
+    整批搜索只取一个索引快照，每个结果都带上它: (快照, 文档)。
+
+    生成答案时传回同一个快照，因此即使期间发生了热重载，答案缓存和
+    index_version 也与检索所用的版本一致。
+    """
+    with service.lease() as retriever:
+        results = service.retrieve_batch([query for query, _, _ in items], [roles for _, roles, _ in items],
+                                         [embedding for _, _, embedding in items], retriever=retriever)
+    return [(retriever, docs) for docs in results]
+
+
+class BadRequest(ValueError):
+    """请求不合法；status 为返回的 HTTP 状态码。"""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def serialize_document(doc: Document) -> dict:
+    return {"page_content": doc.page_content, "metadata": doc.metadata}
+
+
+class RagServer:
+    """
+    在 RagService 之上提供 HTTP 接口的 ASGI 应用，不依赖 Web 框架。
+
+    路由:
+        POST /retrieve  {"query": ..., "user_role": "HR" | [...]} -> {"documents": [...]}
+        POST /answer    同上 -> {"answer": ..., "documents": [...]}
+        GET  /health    服务状态和批处理统计
+        GET  /metrics   Prometheus 格式的指标 (需要 enable_metrics())
+
+    并发请求的查询嵌入和 FAISS 搜索分别经过 MicroBatcher 合并成批 (一次嵌入
+    请求、每个角色一次矩阵搜索)；查询和角色集合都相同的在途请求由
+    RequestCoalescer 合并，只检索 (和生成) 一次。角色直接取自请求体，因此
+    服务应部署在负责认证并填写角色的网关之后。
+
+    用任意 ASGI 服务器运行，例如 uvicorn app.server:app，或 python -m app.server。
+    """
+
+    def __init__(self, service: RagService | None = None, batch_window_ms: float = BATCH_WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        """
+        Args:
+            service: 提供检索和生成的 RagService；为 None 时使用默认服务。
+            batch_window_ms: 微批处理的收集窗口 (毫秒)；0 表示不批处理。
+            max_batch_size: 每批最多的调用数。
+        """
+        self._service = service
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self._states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+    @property
+    def service(self) -> RagService:
+        if self._service is None:
+            self._service = get_default_service()
+        return self._service
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState(self.service, self.batch_window_ms, self.max_batch_size)
+        return state
+
+    # --- 检索和生成 ---
+    async def retrieve(self, query: str, user_role: str | Iterable[str]) -> list[Document]:
+        """返回用户有权读取的文档；并发的相同请求只检索一次。"""
+        _, _, docs = await self._retrieve(query, as_principals(user_role))
+        return docs
+
+    async def answer(self, query: str, user_role: str | Iterable[str]) -> tuple[str, list[Document]]:
+        """返回 (答案, 依据的文档)；并发的相同请求只生成一次。"""
+        principals = as_principals(user_role)
+        return await self._state().coalescer.run(("answer", query, principals),
+                                                  lambda: self._answer(query, principals))
+
+    async def _retrieve(self, query: str, principals: frozenset[str]) -> tuple["PermissionRetriever", list[float], list[Document]]:
+        """返回 (检索所用的索引快照, 查询向量, 文档)。"""
+        state = self._state()
+
+        async def run():
+            embedding = await state.embedder.submit(query)
+            retriever, docs = await state.searcher.submit((query, principals, embedding))
+            return retriever, embedding, docs
+
+        return await state.coalescer.run(("retrieve", query, principals), run)
+
+    async def _answer(self, query: str, principals: frozenset[str]) -> tuple[str, list[Document]]:
+        retriever, embedding, docs = await self._retrieve(query, principals)
+        async with self._state().llm_slots:
+            answer = await asyncio.to_thread(self.service.answer_from_documents, query, principals, embedding, docs,
+                                             retriever)
+        return answer, docs
+
+    def stats(self) -> dict:
+        state = self._states.get(asyncio.get_running_loop())
+        if state is None:
+            return {}
+        return {"embed": state.embedder.stats(), "search": state.searcher.stats(),
+                "coalesced_requests": state.coalescer.coalesced}
+
+    # --- ASGI ---
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path, method = scope["path"], scope["method"]
+        routes = {"/retrieve": "POST", "/answer": "POST", "/health": "GET", "/metrics": "GET"}
+        if path not in routes:
+            await self._send_json(send, 404, {"error": f"未知的路径: {path}"})
+            return
+        if method != routes[path]:
+            await self._send_json(send, 405, {"error": f"{path} 只接受 {routes[path]}"})
+            return
+
+        try:
+            if path == "/health":
+                await self._send_json(send, 200, {**self.service.health(), "batching": self.stats()})
+                return
+            if path == "/metrics":
+                await self._send(send, 200, METRICS.render_prometheus().encode('utf-8'), b"text/plain; version=0.0.4")
+                return
+
+            query, user_role = self._parse_request(await self._read_body(receive))
+            if path == "/retrieve":
+                docs = await self.retrieve(query, user_role)
+                await self._send_json(send, 200, {"documents": [serialize_document(doc) for doc in docs]})
+            else:
+                answer, docs = await self.answer(query, user_role)
+                await self._send_json(send, 200, {"answer": answer,
+                                                  "documents": [serialize_document(doc) for doc in docs]})
+        except BadRequest as e:
+            await self._send_json(send, e.status, {"error": str(e)})
+        except Exception:
+            logger.exception("处理 %s 时出错", path)
+            # 组件无法构建 (例如缺少 API 密钥或索引) 时返回 503，其余错误返回 500。
+            # 异常信息可能包含上游错误、文件路径或模型名称，只写入日志，不返回给客户端
+            if not self.service.health()["ready"]:
+                await self._send_json(send, 503, {"error": "服务暂不可用，详见 /health"})
+            else:
+                await self._send_json(send, 500, {"error": "服务器内部错误"})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # 启动时加载索引和模型，第一个请求不必等待；失败时仍然启动，错误见 /health
+                await asyncio.to_thread(self.service.warmup)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.service.stop_watching()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise BadRequest("客户端已断开连接")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise BadRequest(f"请求体过大 (上限 {MAX_BODY_BYTES} 字节)", status=413)
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _parse_request(body: bytes) -> tuple[str, str | list[str]]:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise BadRequest("请求体不是合法的 JSON")
+        if not isinstance(payload, dict):
+            raise BadRequest("请求体必须是 JSON 对象")
+        query, user_role = payload.get("query"), payload.get("user_role")
+        if not isinstance(query, str) or not query.strip():
+            raise BadRequest("缺少 query")
+        if len(query) > MAX_QUERY_CHARS:
+            raise BadRequest(f"query 过长 (上限 {MAX_QUERY_CHARS} 个字符)")
+        if isinstance(user_role, list) and all(isinstance(role, str) for role in user_role):
+            if not user_role:
+                raise BadRequest("user_role 不能为空")
+        elif not isinstance(user_role, str) or not user_role:
+            raise BadRequest("缺少 user_role (字符串或字符串列表)")
+        return query, user_role
+
+    @staticmethod
+    async def _send_json(send, status: int, payload: dict):
+        await RagServer._send(send, status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                              b"application/json; charset=utf-8")
+
+    @staticmethod
+    async def _send(send, status: int, body: bytes, content_type: bytes):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# 供 ASGI 服务器加载的默认应用 (uvicorn app.server:app)；服务在第一次请求或启动时构建
+app = RagServer()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="以 HTTP 服务运行 SecureRAG (需要 uvicorn)。")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS)
+    args = parser.parse_args(argv)
+
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error("需要安装 uvicorn: pip install uvicorn")
+    # 单进程运行: 所有请求共享一份已加载的索引，批处理才有意义
+    uvicorn.run(RagServer(batch_window_ms=args.batch_window_ms), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
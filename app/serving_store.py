@@ -0,0 +1,340 @@
+# secure-rag/app/serving_store.py
+
+import json
+import mmap
+import os
+import zlib
+from functools import lru_cache
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from .ann_index import TRAIN_SAMPLE_SIZE, search_parameters
+
+import logging
+
+try:
+    import zstandard
+except ImportError: # 没有 zstandard 时改用 zlib 压缩文本块
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+# 只读服务格式，保存在向量存储目录的 serving/ 子目录中 (必须与 indexing.py 保持一致)
+SERVING_DIR = "serving"
+SERVING_MANIFEST = "serving.json"
+VECTORS_FILE = "vectors.f32" # Flat 索引: N x d 的原始 float32 矩阵
+NORMS_FILE = "norms.f32" # Flat 索引: 每个向量的 L2 范数平方，用于计算 L2 距离
+SCAN_INDEX_FILE = "scan.faiss" # vector_dtype 为 float16 / int8 时扫描用的 FAISS 标量量化索引
+INDEX_FILE = "index.faiss" # 近似索引: 以 IO_FLAG_MMAP 方式读取
+TEXTS_FILE = "texts.bin" # 所有块文本的 UTF-8 拼接
+TEXT_OFFSETS_FILE = "text_offsets.npy" # int64[N + 1]，第 i 块文本为 texts[off[i]:off[i + 1]]
+METADATA_FILE = "metadata.bin" # 每块一个 JSON 对象的 UTF-8 拼接
+METADATA_OFFSETS_FILE = "metadata_offsets.npy"
+BLOCK_OFFSETS_SUFFIX = ".blocks.npy" # 压缩列: 每个压缩块在数据文件中的起始字节 (int64[块数 + 1])
+FORMAT_VERSION = 1
+VECTOR_DTYPES = ("float32", "float16", "int8")
+# 紧凑向量类型对应的 FAISS 标量量化器 (int8 为每一维按取值范围均匀量化的 8 位码)
+SCALAR_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+SCAN_BLOCK_ROWS = 65536 # Flat 扫描时每次计算距离的行数，限制临时内存
+WRITE_BLOCK_ROWS = 65536 # 导出向量时每次从索引中取出的行数
+RESCORE_FACTOR = 4 # 紧凑向量扫描时先取 k 的这么多倍候选，再用 float32 向量精确重新计分
+TEXT_CODEC = "zstd" # 文本和元数据列的压缩方式: "zstd"、"zlib" 或 None (不压缩)
+TEXT_BLOCK_ROWS = 32 # 每个压缩块包含的行数；读取一行只需解压它所在的块
+TEXT_BLOCK_CACHE = 256 # 每个列缓存的已解压块数
+
+
+def write_serving_store(vectorstore: FAISS, path: str, vector_dtype: str = "float32",
+                        text_codec: str | None = TEXT_CODEC):
+    """
+    把 FAISS 向量存储导出为可内存映射的只读格式。
+
+    行号与 FAISS id 一致，因此同目录下的角色位掩码可以直接使用。Flat 索引的
+    向量写成原始 float32 文件；其他索引类型写出 FAISS 索引文件本身。
+
+    vector_dtype 为 "float16" 或 "int8" 时，Flat 索引另外写出一个 FAISS 标量
+    量化索引 (向量分别为 1/2 和 1/4 大小)。搜索只扫描它，float32 文件只为少量
+    候选精确重新计分时被读到，因此常驻内存的主要是紧凑的量化码。近似索引
+    自行决定向量的存储方式 (例如 ivf_pq)，忽略 vector_dtype。
+
+    text_codec 不为 None 时，文本和元数据按 TEXT_BLOCK_ROWS 行一块压缩
+    (没有安装 zstandard 时 "zstd" 退回 "zlib")，只有被返回的块才会解压。
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"不支持的向量类型: {vector_dtype} (可选: {', '.join(VECTOR_DTYPES)})")
+    if text_codec == "zstd" and zstandard is None:
+        text_codec = "zlib"
+    os.makedirs(path, exist_ok=True)
+    index = vectorstore.index
+    is_flat = isinstance(index, faiss.IndexFlat)
+
+    if is_flat:
+        with open(os.path.join(path, VECTORS_FILE), 'wb') as vectors_file, \
+                open(os.path.join(path, NORMS_FILE), 'wb') as norms_file:
+            for start in range(0, index.ntotal, WRITE_BLOCK_ROWS):
+                count = min(WRITE_BLOCK_ROWS, index.ntotal - start)
+                block = np.ascontiguousarray(index.reconstruct_n(start, count), dtype=np.float32)
+                vectors_file.write(block.tobytes())
+                norms_file.write(np.einsum('ij,ij->i', block, block).astype(np.float32).tobytes())
+        if vector_dtype != "float32":
+            _write_scan_index(path, index, vector_dtype)
+    else:
+        faiss.write_index(index, os.path.join(path, INDEX_FILE))
+        vector_dtype = "float32"
+
+    _write_column(path, TEXTS_FILE, TEXT_OFFSETS_FILE, (
+        vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content.encode('utf-8')
+        for i in range(index.ntotal)
+    ), text_codec)
+    _write_column(path, METADATA_FILE, METADATA_OFFSETS_FILE, (
+        json.dumps(vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).metadata,
+                   ensure_ascii=False).encode('utf-8')
+        for i in range(index.ntotal)
+    ), text_codec)
+
+    with open(os.path.join(path, SERVING_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({
+            "format_version": FORMAT_VERSION,
+            "ntotal": index.ntotal,
+            "dim": index.d,
+            "metric": "inner_product" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+            "normalize_L2": bool(vectorstore._normalize_L2),
+            "layout": "flat" if is_flat else "faiss",
+            "vector_dtype": vector_dtype,
+            "text_codec": text_codec,
+            "text_block_rows": TEXT_BLOCK_ROWS,
+        }, f, ensure_ascii=False, indent=2)
+
+
+def stored_vector_dtype(path: str) -> str | None:
+    """返回已保存的服务格式使用的向量类型；目录中没有服务格式时返回 None。"""
+    try:
+        with open(os.path.join(path, SERVING_MANIFEST), 'r', encoding='utf-8') as f:
+            return json.load(f).get("vector_dtype", "float32")
+    except (OSError, ValueError):
+        return None
+
+
+def _write_scan_index(path: str, index: faiss.IndexFlat, vector_dtype: str):
+    """从刚写出的 float32 文件构建扫描用的标量量化索引 (int8 的取值范围在样本上训练)。"""
+    vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode='r', shape=(index.ntotal, index.d))
+    scan_index = faiss.IndexScalarQuantizer(index.d, SCALAR_QUANTIZERS[vector_dtype], index.metric_type)
+    if index.ntotal:
+        rng = np.random.default_rng(0)
+        sample_size = min(TRAIN_SAMPLE_SIZE, index.ntotal)
+        scan_index.train(np.asarray(vectors[np.sort(rng.choice(index.ntotal, sample_size, replace=False))]))
+        for start in range(0, index.ntotal, WRITE_BLOCK_ROWS):
+            scan_index.add(np.asarray(vectors[start:start + WRITE_BLOCK_ROWS]))
+    faiss.write_index(scan_index, os.path.join(path, SCAN_INDEX_FILE))
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("服务格式的文本以 zstd 压缩，需要安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def _write_column(path: str, data_file: str, offsets_file: str, values, codec: str | None = None):
+    """
+    把一列变长字节串写成数据文件 + 偏移数组。
+
+    偏移总是相对于未压缩的拼接；codec 不为 None 时每 TEXT_BLOCK_ROWS 行压缩
+    成一块，各块的起始字节另存在 <数据文件>.blocks.npy 中。
+    """
+    offsets = [0]
+    block_offsets = [0]
+    pending: list[bytes] = []
+    with open(os.path.join(path, data_file), 'wb') as f:
+        def flush():
+            block_offsets.append(block_offsets[-1] + f.write(_compress(b"".join(pending), codec)))
+            pending.clear()
+
+        for value in values:
+            if codec is None:
+                f.write(value)
+            else:
+                pending.append(value)
+                if len(pending) == TEXT_BLOCK_ROWS:
+                    flush()
+            offsets.append(offsets[-1] + len(value))
+        if pending:
+            flush()
+    np.save(os.path.join(path, offsets_file), np.asarray(offsets, dtype=np.int64))
+    if codec is not None:
+        np.save(os.path.join(path, data_file + BLOCK_OFFSETS_SUFFIX), np.asarray(block_offsets, dtype=np.int64))
+
+
+class _Column:
+    """只读的变长字节串列；压缩列按块解压，并缓存最近用到的块。"""
+
+    def __init__(self, path: str, data_file: str, offsets_file: str, codec: str | None, block_rows: int):
+        self._data = _map_file(os.path.join(path, data_file))
+        self._offsets = np.load(os.path.join(path, offsets_file), mmap_mode='r')
+        self._codec = codec
+        self._block_rows = block_rows
+        if codec is not None:
+            self._block_offsets = np.load(os.path.join(path, data_file + BLOCK_OFFSETS_SUFFIX), mmap_mode='r')
+            self._block = lru_cache(maxsize=TEXT_BLOCK_CACHE)(self._decompress_block)
+
+    def _decompress_block(self, b: int) -> bytes:
+        return _decompress(bytes(self._data[self._block_offsets[b]:self._block_offsets[b + 1]]), self._codec)
+
+    def __getitem__(self, i: int) -> bytes:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        if self._codec is None:
+            return bytes(self._data[start:end])
+        b = i // self._block_rows
+        base = int(self._offsets[b * self._block_rows])
+        return self._block(b)[start - base:end - base]
+
+
+def _map_file(file_path: str):
+    """只读映射整个文件；空文件无法 mmap，返回空字节串。"""
+    if os.path.getsize(file_path) == 0:
+        return b""
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ServingStore:
+    """
+    以内存映射方式打开的只读向量存储。
+
+    打开时只读取很小的 JSON 清单并建立映射，因此启动时间与语料规模无关；
+    向量、文本和元数据只在被访问时由操作系统按页读入。多个工作进程打开
+    同一目录时共享同一份页缓存，而不是各自持有反序列化后的副本。
+    """
+
+    def __init__(self, path: str):
+        """
+        Raises:
+            FileNotFoundError: 目录中没有 serving.json。
+            ValueError: 格式版本不受支持。
+        """
+        with open(os.path.join(path, SERVING_MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"不支持的服务格式版本: {manifest.get('format_version')}")
+
+        self.path = path
+        self.ntotal = manifest["ntotal"]
+        self.dim = manifest["dim"]
+        self.inner_product = manifest["metric"] == "inner_product"
+        self.normalize_L2 = manifest["normalize_L2"]
+        # 早期的清单没有以下字段，即 float32 向量和未压缩的文本
+        self.vector_dtype = manifest.get("vector_dtype", "float32")
+        self.vectors: np.ndarray | None = None
+        self.norms: np.ndarray | None = None
+        self.index: faiss.Index | None = None
+        # 紧凑布局: 搜索量化索引 scan_index，再用 float32 的 vectors 精确重新计分
+        self.scan_index: faiss.Index | None = None
+        if manifest["layout"] == "flat":
+            self.vectors = np.memmap(os.path.join(path, VECTORS_FILE), dtype=np.float32, mode='r',
+                                     shape=(self.ntotal, self.dim))
+            self.norms = np.memmap(os.path.join(path, NORMS_FILE), dtype=np.float32, mode='r', shape=(self.ntotal,))
+            if self.vector_dtype != "float32":
+                self.scan_index = faiss.read_index(os.path.join(path, SCAN_INDEX_FILE),
+                                                   faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        else:
+            self.index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+        self.text_codec = manifest.get("text_codec")
+        block_rows = manifest.get("text_block_rows", TEXT_BLOCK_ROWS)
+        self._texts = _Column(path, TEXTS_FILE, TEXT_OFFSETS_FILE, self.text_codec, block_rows)
+        self._metadata = _Column(path, METADATA_FILE, METADATA_OFFSETS_FILE, self.text_codec, block_rows)
+
+    def document(self, i: int) -> Document:
+        """按行号 (即 FAISS id) 读取一个块；压缩的文本只解压它所在的块。"""
+        return Document(page_content=self._texts[i].decode('utf-8'), metadata=json.loads(self._metadata[i]))
+
+    def search(self, query_embedding: list[float], k: int, allowed: np.ndarray | None = None,
+               nprobe: int | None = None, ef_search: int | None = None) -> list[int]:
+        """
+        返回与查询最相近的至多 k 个行号，按相似度从高到低排列。
+
+        allowed 为布尔数组时只考虑其中为 True 的行 (Flat 布局在扫描时屏蔽，
+        近似索引通过 ID 选择器屏蔽)，因此一轮即可得到 k 个已授权结果。
+        """
+        return self.search_batch([query_embedding], k, allowed, nprobe, ef_search)[0]
+
+    def search_batch(self, query_embeddings, k: int, allowed: np.ndarray | None = None,
+                     nprobe: int | None = None, ef_search: int | None = None) -> list[list[int]]:
+        """
+        search 的批量版本: 一次矩阵搜索处理所有查询，每个查询返回一个行号列表。
+
+        所有查询共用同一个 allowed (即同一角色)。
+        """
+        queries = np.array(query_embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self.normalize_L2:
+            faiss.normalize_L2(queries)
+        if self.vectors is None:
+            return self._search_index(self.index, queries, k, allowed, nprobe, ef_search)
+        if self.scan_index is None:
+            return self._scan(queries, k, allowed)
+        candidates = self._search_index(self.scan_index, queries, k * RESCORE_FACTOR, allowed)
+        return [self._rescore(query, ids, k) for query, ids in zip(queries, candidates)]
+
+    @staticmethod
+    def _search_index(index: faiss.Index, queries: np.ndarray, k: int, allowed: np.ndarray | None,
+                      nprobe: int | None = None, ef_search: int | None = None) -> list[list[int]]:
+        """在 FAISS 索引中搜索，allowed 通过 ID 选择器屏蔽未授权的行。"""
+        selector = None
+        if allowed is not None:
+            selector = faiss.IDSelectorBitmap(np.packbits(allowed, bitorder='little'))
+        params = search_parameters(index, selector, nprobe, ef_search)
+        _, found = index.search(queries, k, params=params)
+        return [[int(i) for i in row if i >= 0] for row in found]
+
+    def _rescore(self, query: np.ndarray, ids: list[int], k: int) -> list[int]:
+        """用 float32 向量精确计算候选的分数并取前 k 个 (按行号顺序读取映射文件)。"""
+        if not ids:
+            return []
+        rows = np.sort(np.asarray(ids, dtype=np.int64))
+        dots = np.asarray(self.vectors[rows]) @ query
+        scores = -dots if self.inner_product else self.norms[rows] - 2 * dots
+        order = np.argsort(scores, kind='stable')[:k]
+        return [int(i) for i in rows[order]]
+
+    def _scan(self, queries: np.ndarray, k: int, allowed: np.ndarray | None) -> list[list[int]]:
+        """
+        分块精确扫描映射的向量矩阵，每块只保留每个查询的前 k 个候选。
+
+        L2 距离按 |x|^2 - 2 x.q 计算 (省略对排序无影响的 |q|^2)。查询越多，
+        每块的行数越少，使临时的 行数 x 查询数 距离矩阵大小基本不变。
+        """
+        n_queries = len(queries)
+        block_rows = max(1024, SCAN_BLOCK_ROWS // n_queries)
+        best_ids: list[np.ndarray] = []
+        best_scores: list[np.ndarray] = []
+        for start in range(0, self.ntotal, block_rows):
+            block = self.vectors[start:start + block_rows]
+            dots = np.asarray(block @ queries.T) # 行数 x 查询数
+            if self.inner_product:
+                scores = -dots # 统一为越小越相似
+            else:
+                scores = self.norms[start:start + len(block), None] - 2 * dots
+            if allowed is not None:
+                scores = np.where(allowed[start:start + len(block), None], scores, np.inf)
+            top = np.argpartition(scores, min(k, len(scores)) - 1, axis=0)[:k]
+            best_ids.append(top + start)
+            best_scores.append(np.take_along_axis(scores, top, axis=0))
+
+        if not best_ids:
+            return [[] for _ in range(n_queries)]
+        ids = np.concatenate(best_ids)
+        scores = np.concatenate(best_scores)
+        order = np.argsort(scores, axis=0, kind='stable')[:k]
+        ids = np.take_along_axis(ids, order, axis=0)
+        scores = np.take_along_axis(scores, order, axis=0)
+        return [[int(i) for i in ids[np.isfinite(scores[:, j]), j]] for j in range(n_queries)]
@@ -0,0 +1,236 @@
+# secure-rag/app/tenants.py
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from typing import TYPE_CHECKING
+
+from .answer_cache import SemanticAnswerCache
+from .rag_chain import GOOGLE_CHAT_MODEL, GOOGLE_EMBEDDING_MODEL, RagService, build_chat_model
+from .rerank import Reranker
+
+import logging
+
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
+
+# 配置日志记录
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# --- 配置 ---
+TENANTS_ROOT = "../tenants" # 每个租户一个向量存储子目录 (相对于 app/)
+TENANT_MEMORY_BUDGET = 8 * 1024 ** 3 # 常驻索引的总大小上限 (字节)
+# 租户名直接用作子目录名，因此不允许路径分隔符和以 . 开头的名字
+TENANT_NAME_RE = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+
+def index_size_bytes(vectorstore_path: str) -> int:
+    """
+    向量存储目录中所有文件的总大小，用作该索引常驻内存的估计。
+
+    反序列化的 FAISS 存储大致占用这么多内存；内存映射的服务格式最多占用
+    这么多页缓存，因此这个估计是保守的。
+    """
+    total = 0
+    for directory, _, files in os.walk(vectorstore_path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass # 目录正在被替换 (重建索引)
+    return total
+
+
+class TenantRegistry:
+    """
+    在一个进程中为多个租户 (例如各业务部门) 提供各自的向量存储。
+
+    每个租户有自己的 RagService，在该租户第一次请求时创建，索引随之延迟加载；
+    所有租户共用同一个嵌入客户端 (及其查询嵌入缓存) 和聊天模型。常驻索引的
+    总大小 (按目录大小估计) 超过 memory_budget 时，按最近最少使用的顺序淘汰
+    其他租户，被淘汰的租户下次请求时重新加载。已经开始的请求继续使用它们
+    持有的服务直到结束。答案缓存按租户隔离，不会跨租户命中。
+    """
+
+    def __init__(self, root: str = TENANTS_ROOT, tenants: dict[str, str] | None = None,
+                 memory_budget: int = TENANT_MEMORY_BUDGET, embeddings: "Embeddings | None" = None, llm=None,
+                 embedding_model_name: str = GOOGLE_EMBEDDING_MODEL, chat_model_name: str = GOOGLE_CHAT_MODEL,
+                 answer_cache: bool = False, watch_interval: float | None = None, reranker: Reranker | None = None):
+        """
+        Args:
+            root: 租户目录的根目录，租户 t 的向量存储位于 root/t (相对路径相对于 app/)。
+            tenants: 可选的 {租户: 向量存储路径}；设置后只服务这些租户，忽略 root。
+            memory_budget: 常驻索引的总大小上限 (字节)。单个索引超过上限时仍会加载，
+                但其他租户都会被淘汰。
+            embeddings: 可选的共用嵌入对象；为 None 时在第一次请求时创建。
+            llm: 可选的共用聊天模型；为 None 时在第一次请求时创建。
+            embedding_model_name: 索引时使用的嵌入模型的名称。
+            chat_model_name: 用于生成答案的 Gemini 模型名称。
+            answer_cache: 是否为每个租户启用语义答案缓存。
+            watch_interval: 设置后，每个常驻租户都在后台检查其向量存储是否被重建
+                (见 RagService.reload_index)。
+            reranker: 可选的重排序器，所有租户共用 (MMRReranker 不持有状态)。
+        """
+        from .retriever import resolve_vectorstore_path
+
+        self.root = resolve_vectorstore_path(root)
+        self.tenants = None if tenants is None else {
+            tenant: resolve_vectorstore_path(path) for tenant, path in tenants.items()
+        }
+        self.memory_budget = memory_budget
+        self.embedding_model_name = embedding_model_name
+        self.chat_model_name = chat_model_name
+        self.answer_cache = answer_cache
+        self.watch_interval = watch_interval
+        self.reranker = reranker
+        self._embeddings = embeddings
+        self._llm = llm
+        # 租户 -> (服务, 估计的常驻字节数)，按最近使用排序 (最近的在末尾)
+        self._services: OrderedDict[str, tuple[RagService, int]] = OrderedDict()
+        self._loads = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+        self._clients_lock = threading.Lock() # 只保护共用客户端的首次创建
+
+    def vectorstore_path(self, tenant: str) -> str:
+        """
+        返回租户的向量存储目录。
+
+        Raises:
+            ValueError: 租户名不合法。
+            KeyError: 指定了 tenants 映射，但其中没有该租户。
+            FileNotFoundError: 租户的向量存储目录不存在。
+        """
+        if self.tenants is not None:
+            if tenant not in self.tenants:
+                raise KeyError(f"未知的租户: {tenant}")
+            path = self.tenants[tenant]
+        else:
+            if not isinstance(tenant, str) or not TENANT_NAME_RE.fullmatch(tenant):
+                raise ValueError(f"不合法的租户名: {tenant!r}")
+            path = os.path.join(self.root, tenant)
+        if not os.path.isdir(path):
+            raise FileNotFoundError(f"在 {path} 找不到租户 {tenant} 的向量存储目录。")
+        return path
+
+    def service(self, tenant: str) -> RagService:
+        """
+        返回租户的 RagService，必要时创建并淘汰最近最少使用的其他租户。
+
+        检查目录、统计索引大小和首次创建共用客户端都在注册表锁之外进行；
+        创建服务本身很快，索引在该服务第一次处理请求时加载，且只持有该服务
+        自己的锁，因此加载一个租户不会阻塞其他租户的请求。
+        """
+        with self._lock:
+            entry = self._services.get(tenant)
+            if entry is not None:
+                self._services.move_to_end(tenant)
+                return entry[0]
+
+        path = self.vectorstore_path(tenant)
+        size = index_size_bytes(path)
+        llm, embeddings = self._shared_llm(), self._shared_embeddings()
+
+        with self._lock:
+            entry = self._services.get(tenant)
+            if entry is not None: # 另一个线程已经创建了该租户的服务
+                self._services.move_to_end(tenant)
+                return entry[0]
+
+            service = RagService(
+                vectorstore_path=path,
+                embedding_model_name=self.embedding_model_name,
+                chat_model_name=self.chat_model_name,
+                llm=llm,
+                answer_cache=SemanticAnswerCache() if self.answer_cache else None,
+                watch_interval=self.watch_interval,
+                embeddings=embeddings,
+                reranker=self.reranker,
+            )
+            self._services[tenant] = (service, size)
+            self._loads += 1
+            logger.info("加载租户 %s (约 %.1f MB)", tenant, size / 1024 ** 2)
+            evicted = self._evict_over_budget()
+        # 停止后台线程可能要等它完成一次重载，不能持有注册表锁
+        for victim in evicted:
+            victim.stop_watching()
+        return service
+
+    def _shared_embeddings(self) -> "Embeddings":
+        with self._clients_lock:
+            if self._embeddings is None:
+                from .retriever import build_embeddings
+                from dotenv import load_dotenv
+
+                load_dotenv()
+                self._embeddings = build_embeddings(self.embedding_model_name)
+            return self._embeddings
+
+    def _shared_llm(self):
+        with self._clients_lock:
+            if self._llm is None:
+                self._llm = build_chat_model(self.chat_model_name)
+            return self._llm
+
+    def _evict_over_budget(self) -> list[RagService]:
+        """
+        调用方须持有 self._lock。最近使用的租户 (末尾) 永远不会被淘汰。
+
+        返回被淘汰的服务；调用方须在释放锁之后停止它们的后台重载线程。
+        """
+        evicted = []
+        while len(self._services) > 1 and self.resident_bytes() > self.memory_budget:
+            tenant, (service, size) = self._services.popitem(last=False)
+            evicted.append(service)
+            self._evictions += 1
+            logger.info("内存预算不足，淘汰租户 %s (约 %.1f MB)", tenant, size / 1024 ** 2)
+        return evicted
+
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._services.values())
+
+    def evict(self, tenant: str) -> bool:
+        """立即卸载租户 (例如其数据已被删除)，返回它之前是否常驻。"""
+        with self._lock:
+            entry = self._services.pop(tenant, None)
+        if entry is None:
+            return False
+        entry[0].stop_watching()
+        return True
+
+    def close(self):
+        """卸载所有租户并停止它们的后台重载线程。"""
+        with self._lock:
+            entries = list(self._services.values())
+            self._services.clear()
+        for service, _ in entries:
+            service.stop_watching()
+
+    def health(self) -> dict:
+        """报告常驻租户、估计的内存占用以及加载和淘汰次数。不会触发加载。"""
+        with self._lock:
+            tenants = {tenant: {"bytes": size, "ready": service.health()["ready"]}
+                       for tenant, (service, size) in self._services.items()}
+            return {
+                "memory_budget_bytes": self.memory_budget,
+                "resident_bytes": self.resident_bytes(),
+                "loads": self._loads,
+                "evictions": self._evictions,
+                "tenants": tenants,
+            }
+
+    # --- 获取响应 ---
+    def get_rag_response(self, tenant: str, query: str, user_role: str | Iterable[str]) -> str:
+        """在租户的向量存储上获取响应，参见 RagService.get_rag_response。"""
+        return self.service(tenant).get_rag_response(query, user_role)
+
+    def stream_rag_response(self, tenant: str, query: str, user_role: str | Iterable[str]) -> Iterator[dict]:
+        """在租户的向量存储上流式获取响应，参见 RagService.stream_rag_response。"""
+        return self.service(tenant).stream_rag_response(query, user_role)
+
+    async def aget_rag_response(self, tenant: str, query: str, user_role: str | Iterable[str]) -> str:
+        """在租户的向量存储上异步获取响应，参见 RagService.aget_rag_response。"""
+        return await self.service(tenant).aget_rag_response(query, user_role)
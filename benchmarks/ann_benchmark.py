@@ -0,0 +1,122 @@
+# secure-rag/benchmarks/ann_benchmark.py
+
+"""
+Recall / latency trade-off of the ANN index backends.
+
+Generates clustered synthetic vectors, builds every backend through
+app/ann_index.py, and for each search-time setting (nprobe for IVF,
+efSearch for HNSW) reports recall@k against the exact flat index together
+with per-query latency percentiles, build time and index size as JSON.
+
+Usage:
+    python benchmarks/ann_benchmark.py --n 200000 --dim 768 --output ann.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+# Add project root directory to Python path to allow importing 'app'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.ann_index import IndexSpec, build_index, search_parameters
+
+DEFAULT_SPECS = ["flat", "ivf_flat", "ivf_pq", "hnsw"]
+NPROBE_SWEEP = [1, 4, 16, 64]
+EF_SEARCH_SWEEP = [16, 32, 64, 128]
+
+
+def synthetic_vectors(n: int, dim: int, n_clusters: int, seed: int) -> np.ndarray:
+    """Unit vectors drawn around random cluster centres, which is closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def measure(index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int, params) -> dict:
+    """Searches one query at a time (as the retriever does) and compares the ids with the exact top-k."""
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k, params=params)
+        latencies.append(time.perf_counter() - start)
+        found[i] = ids[0]
+    recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+    return {
+        "recall_at_k": round(float(recall), 4),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)) * 1000, 4),
+            "p99": round(float(np.percentile(latencies, 99)) * 1000, 4),
+        },
+        "qps": round(len(latencies) / sum(latencies), 1),
+    }
+
+
+def run(n: int, dim: int, n_queries: int, k: int, specs: list[str], seed: int = 0) -> dict:
+    vectors = synthetic_vectors(n + n_queries, dim, n_clusters=max(8, n // 1000), seed=seed)
+    corpus, queries = vectors[:n], vectors[n:]
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(corpus)
+    _, truth = exact.search(queries, k)
+
+    results = []
+    for text in specs:
+        start = time.perf_counter()
+        index, spec = build_index(corpus, IndexSpec.parse(text), seed=seed)
+        build_seconds = time.perf_counter() - start
+
+        if spec.kind in ("ivf_flat", "ivf_pq"):
+            sweep = [("nprobe", value) for value in NPROBE_SWEEP if value <= spec.nlist]
+        elif spec.kind == "hnsw":
+            sweep = [("ef_search", value) for value in EF_SEARCH_SWEEP]
+        else:
+            sweep = [(None, None)]
+
+        for knob, value in sweep:
+            params = search_parameters(index, **({knob: value} if knob else {}))
+            results.append({
+                "spec": text,
+                "factory": spec.factory,
+                "knob": knob,
+                "value": value,
+                "build_seconds": round(build_seconds, 3),
+                "index_bytes": int(faiss.serialize_index(index).nbytes),
+                **measure(index, queries, truth, k, params),
+            })
+    return {"n": n, "dim": dim, "queries": n_queries, "k": k, "results": results}
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="Recall/latency benchmark of the FAISS index backends.")
+    parser.add_argument("--n", type=int, default=50000, help="Number of indexed vectors.")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--specs", nargs="+", default=DEFAULT_SPECS,
+                        help="Index specs as accepted by indexing.py --index, e.g. 'ivf_pq:pq_m=32'.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    report = run(args.n, args.dim, args.queries, args.k, args.specs, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# secure-rag/benchmarks/load_test.py
+
+"""
+Local load test of the HTTP serving layer (app/server.py).
+
+Indexes a synthetic corpus with the hashing embedder, wraps it in a
+RagService with the stub chat model, and drives RagServer in-process through
+httpx's ASGI transport with a fixed number of concurrent clients, so no API
+key, network or ASGI server is needed. The stub embedder and chat model can
+be given a per-call latency to mimic the remote models. A share of the
+requests repeats a small set of hot queries to exercise request coalescing.
+Reports throughput, latency percentiles and the batching/coalescing counters
+as JSON, once per batch window (0 ms disables the collection window).
+
+Pass --url to load-test a running server instead (e.g. python -m app.server).
+
+Usage:
+    python benchmarks/load_test.py --chunks 20000 --requests 2000 --concurrency 64 --windows 0 3
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+import httpx
+import numpy as np
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.indexing import create_and_save_vectorstore
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+from app.server import RagServer
+from benchmarks.stubs import ROLES, HashingEmbeddings, StubChatModel, make_corpus, make_queries
+
+
+class SlowHashingEmbeddings(HashingEmbeddings):
+    """Hashing embedder that waits `latency` seconds per call, like one request to a remote embedding API."""
+
+    def __init__(self, size: int = 768, latency: float = 0.0):
+        super().__init__(size)
+        self.latency = latency
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """One call for the whole batch (see app.embedding_cache.embed_queries)."""
+        return self.embed_documents(texts)
+
+
+def make_requests(n: int, hot_share: float, endpoint_mix: float, seed: int) -> list[tuple[str, dict]]:
+    """(path, body) pairs; hot_share of them reuse 5 hot query/role pairs, endpoint_mix of them call /answer."""
+    rng = random.Random(seed)
+    hot = [(query, rng.choice(ROLES)) for query in make_queries(5, seed=seed + 1)]
+    cold = make_queries(n, seed=seed + 2)
+    requests = []
+    for i in range(n):
+        query, role = rng.choice(hot) if rng.random() < hot_share else (cold[i], rng.choice(ROLES))
+        path = "/answer" if rng.random() < endpoint_mix else "/retrieve"
+        requests.append((path, {"query": query, "user_role": role}))
+    return requests
+
+
+async def drive(client: httpx.AsyncClient, requests: list[tuple[str, dict]], concurrency: int) -> dict:
+    """Sends the requests from `concurrency` clients, each waiting for its response before the next request."""
+    latencies: list[float] = []
+    errors = 0
+    queue = iter(requests)
+
+    async def worker():
+        nonlocal errors
+        for path, body in queue:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)) * 1000, 2),
+            "p99": round(float(np.percentile(latencies, 99)) * 1000, 2),
+        },
+    }
+
+
+async def run_in_process(service: RagService, requests: list[tuple[str, dict]], concurrency: int,
+                         window_ms: float) -> dict:
+    server = RagServer(service, batch_window_ms=window_ms)
+    transport = httpx.ASGITransport(app=server)
+    async with httpx.AsyncClient(transport=transport, base_url="http://secure-rag") as client:
+        result = await drive(client, requests, concurrency)
+        result["batching"] = server.stats()
+    return {"batch_window_ms": window_ms, **result}
+
+
+def run(n_chunks: int, n_requests: int, concurrency: int, windows: list[float], dim: int = 256,
+        embed_latency: float = 0.02, llm_latency: float = 0.05, hot_share: float = 0.2, answer_share: float = 0.3,
+        seed: int = 0, workdir: str | None = None) -> dict:
+    requests = make_requests(n_requests, hot_share, answer_share, seed)
+    embeddings = SlowHashingEmbeddings(dim, latency=embed_latency)
+    with tempfile.TemporaryDirectory(dir=workdir) as path:
+        create_and_save_vectorstore(make_corpus(n_chunks, seed=seed), path, HashingEmbeddings(dim))
+        retriever = PermissionRetriever(vectorstore_path=path, embeddings=embeddings)
+        results = []
+        for window_ms in windows:
+            # A fresh service per run, so no answer is served from an earlier run's cache
+            service = RagService(retriever=retriever, llm=StubChatModel(latency=llm_latency))
+            results.append(asyncio.run(run_in_process(service, requests, concurrency, window_ms)))
+    return {"n_chunks": n_chunks, "concurrency": concurrency, "embed_latency_s": embed_latency,
+            "llm_latency_s": llm_latency, "hot_share": hot_share, "answer_share": answer_share, "results": results}
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="Load test of the SecureRAG HTTP service with stub models.")
+    parser.add_argument("--chunks", type=int, default=5000, help="Synthetic chunks to index.")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0.0, 3.0],
+                        help="Batch windows (ms) to compare; 0 disables the collection window.")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="Seconds per stub embedding call.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Seconds per stub LLM call.")
+    parser.add_argument("--hot-share", type=float, default=0.2, help="Share of requests repeating 5 hot queries.")
+    parser.add_argument("--answer-share", type=float, default=0.3, help="Share of requests sent to /answer.")
+    parser.add_argument("--url", help="Load-test a running server at this URL instead of an in-process one.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        async def remote() -> dict:
+            async with httpx.AsyncClient(base_url=args.url, timeout=None) as client:
+                requests = make_requests(args.requests, args.hot_share, args.answer_share, args.seed)
+                return {"url": args.url, **await drive(client, requests, args.concurrency)}
+        report = asyncio.run(remote())
+    else:
+        report = run(args.chunks, args.requests, args.concurrency, args.windows, args.dim, args.embed_latency,
+                     args.llm_latency, args.hot_share, args.answer_share, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# secure-rag/benchmarks/quantization_benchmark.py
+
+"""
+Size / recall / latency of the compact serving layouts.
+
+Builds one flat FAISS store from clustered synthetic vectors (768 dimensions
+by default, the size of models/embedding-001) and synthetic chunk text, then
+writes its serving copy once per vector type (float32, float16, int8) with
+compressed and uncompressed text. For each layout it reports the bytes a
+search has to keep resident (the scanned vector matrix), the text and total
+on-disk bytes, recall@k against the exact float32 search, and per-query
+latency of the search and of reading the k returned chunks, as JSON.
+
+Usage:
+    python benchmarks/quantization_benchmark.py --n 100000 --output quantization.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.serving_store import (METADATA_FILE, SCAN_INDEX_FILE, TEXTS_FILE, VECTOR_DTYPES, VECTORS_FILE, ServingStore,
+                               write_serving_store)
+from benchmarks.ann_benchmark import synthetic_vectors
+from benchmarks.stubs import HashingEmbeddings, make_corpus
+
+EMBEDDING_001_DIM = 768
+SCAN_FILES = {"float32": VECTORS_FILE, "float16": SCAN_INDEX_FILE, "int8": SCAN_INDEX_FILE}
+
+
+def directory_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def measure(store: ServingStore, queries: np.ndarray, truth: list[list[int]], k: int) -> dict:
+    """Searches one query at a time (as the retriever does), then reads the returned chunks."""
+    search_latencies, fetch_latencies = [], []
+    recalls = []
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = store.search(query, k)
+        search_latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for i in found:
+            store.document(i)
+        fetch_latencies.append(time.perf_counter() - start)
+        recalls.append(len(set(found) & set(expected)) / k)
+
+    def percentiles(latencies: list[float]) -> dict:
+        return {
+            "p50": round(float(np.percentile(latencies, 50)) * 1000, 4),
+            "p99": round(float(np.percentile(latencies, 99)) * 1000, 4),
+        }
+
+    return {
+        "recall_at_k": round(float(np.mean(recalls)), 4),
+        "search_ms": percentiles(search_latencies),
+        "fetch_ms": percentiles(fetch_latencies),
+    }
+
+
+def run(n: int, dim: int, n_queries: int, k: int, seed: int = 0) -> dict:
+    vectors = synthetic_vectors(n + n_queries, dim, n_clusters=max(8, n // 1000), seed=seed)
+    corpus, queries = vectors[:n], vectors[n:]
+    docs = make_corpus(n, seed=seed)
+    vectorstore = FAISS.from_embeddings(
+        [(doc.page_content, vector.tolist()) for doc, vector in zip(docs, corpus)],
+        HashingEmbeddings(dim), metadatas=[doc.metadata for doc in docs],
+    )
+
+    results = []
+    truth = None
+    with tempfile.TemporaryDirectory() as workdir:
+        for text_codec in (None, "zstd"):
+            for vector_dtype in VECTOR_DTYPES:
+                path = os.path.join(workdir, f"{vector_dtype}-{text_codec}")
+                start = time.perf_counter()
+                write_serving_store(vectorstore, path, vector_dtype, text_codec)
+                write_seconds = time.perf_counter() - start
+
+                store = ServingStore(path)
+                if truth is None: # The first layout is the exact float32 scan
+                    truth = [store.search(query, k) for query in queries]
+                results.append({
+                    "vector_dtype": vector_dtype,
+                    "text_codec": store.text_codec,
+                    "write_seconds": round(write_seconds, 3),
+                    "scan_vector_bytes": os.path.getsize(os.path.join(path, SCAN_FILES[vector_dtype])),
+                    "text_bytes": os.path.getsize(os.path.join(path, TEXTS_FILE)),
+                    "metadata_bytes": os.path.getsize(os.path.join(path, METADATA_FILE)),
+                    "disk_bytes": directory_bytes(path),
+                    **measure(store, queries, truth, k),
+                })
+    return {"n": n, "dim": dim, "queries": n_queries, "k": k, "results": results}
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="Size/recall/latency benchmark of the compact serving layouts.")
+    parser.add_argument("--n", type=int, default=50000, help="Number of indexed chunks.")
+    parser.add_argument("--dim", type=int, default=EMBEDDING_001_DIM)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    report = run(args.n, args.dim, args.queries, args.k, args.seed)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# secure-rag/benchmarks/retrieval_benchmark.py
+
+"""
+Offline retrieval benchmark.
+
+Builds synthetic corpora with random permission sets using a deterministic
+local embedder, loads them through the real indexing and PermissionRetriever
+code paths, and reports latency percentiles, QPS, memory and per-role
+recall@k against an exact, permission-aware brute-force search as JSON.
+No API key or network access is needed, so results are comparable across commits.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py --sizes 1000 10000 --mode bitmask --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from app.ann_index import IndexSpec
+from app.indexing import create_and_save_partitioned_vectorstore, create_and_save_vectorstore, iter_chunks
+from app.permissions import ROLE_BITMASK_FILE, ROLE_BITS_FILE
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+from benchmarks.stubs import ROLES, HashingEmbeddings, StubChatModel, make_corpus, make_queries
+
+MODES = ("bitmask", "post_filter", "partitioned")
+DEFAULT_SIZES = [1000, 10000]
+TIE_TOLERANCE = 1e-5 # Distances this close to the exact k-th neighbour count as ties
+
+
+def rss_mb() -> float:
+    """Current resident set size in MiB (0.0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return 0.0
+
+
+def directory_bytes(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def percentile_ms(latencies: list[float], q: float) -> float:
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_store(docs, save_path: str, mode: str, embeddings, index_spec: IndexSpec | None = None) -> float:
+    """Indexes docs with the same functions as app/indexing.py and returns the build time in seconds."""
+    start = time.perf_counter()
+    if mode == "partitioned":
+        create_and_save_partitioned_vectorstore(docs, save_path, embeddings)
+    else:
+        create_and_save_vectorstore(docs, save_path, embeddings, index_spec)
+        if mode == "post_filter":
+            # Without a bitmask the retriever falls back to filtering after the search
+            for name in (ROLE_BITMASK_FILE, ROLE_BITS_FILE):
+                os.remove(os.path.join(save_path, name))
+    return time.perf_counter() - start
+
+
+def recall_hits(matrix: np.ndarray, allowed: np.ndarray, query: np.ndarray, k: int,
+                returned_rows: list[int]) -> tuple[int, int]:
+    """
+    Compares returned rows with an exact search over the authorized vectors.
+
+    Returns (hits, expected). A returned row counts as a hit if it is authorized
+    and no farther than the exact k-th neighbour, so ties at the cut-off are
+    not counted as misses.
+    """
+    candidates = np.flatnonzero(allowed)
+    if len(candidates) == 0:
+        return 0, 0
+    distances = ((matrix[candidates] - query) ** 2).sum(axis=1)
+    expected = min(k, len(candidates))
+    cutoff = np.partition(distances, expected - 1)[expected - 1] + TIE_TOLERANCE
+    returned = [row for row in returned_rows if allowed[row]]
+    hits = int((((matrix[returned] - query) ** 2).sum(axis=1) <= cutoff).sum()) if returned else 0
+    return min(hits, expected), expected
+
+
+def run_benchmark(n_chunks: int, n_queries: int = 100, k: int = 4, mode: str = "bitmask", seed: int = 0,
+                  dim: int = 256, with_llm: bool = False, workdir: str | None = None,
+                  index_spec: IndexSpec | None = None, use_mmap: bool = True, hybrid: bool = False) -> dict:
+    """
+    Runs one benchmark configuration and returns its results.
+
+    Every query is issued once per role; recall@k compares the chunks the
+    retriever returned with the exact top-k among the chunks that role may read.
+    BM25 fusion is off by default, since it deliberately departs from the pure
+    vector ranking that recall is measured against.
+    """
+    embeddings = HashingEmbeddings(size=dim)
+    docs = make_corpus(n_chunks, seed=seed)
+    queries = make_queries(n_queries, seed=seed + 1)
+
+    # Exact ground truth over the same chunks the index is built from
+    chunks = list(iter_chunks(docs))
+    row_of = {chunk.metadata["chunk_id"]: row for row, chunk in enumerate(chunks)}
+    matrix = np.asarray(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+    allowed_by_role = {
+        role: np.array([role in chunk.metadata["permission"] for chunk in chunks]) for role in ROLES
+    }
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        save_path = os.path.join(tmp, "vectorstore")
+        build_seconds = build_store(docs, save_path, mode, embeddings, index_spec)
+        index_bytes = directory_bytes(save_path)
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        retriever = PermissionRetriever(save_path, embeddings=embeddings, use_mmap=use_mmap, hybrid=hybrid)
+        load_seconds = time.perf_counter() - start
+        rss_after = rss_mb()
+
+        latencies = []
+        recall = {}
+        for role in ROLES:
+            hits = expected = 0
+            for query in queries:
+                start = time.perf_counter()
+                results = retriever.get_relevant_documents(query, role, k=k)
+                latencies.append(time.perf_counter() - start)
+
+                query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+                returned_rows = [row_of[doc.metadata["chunk_id"]] for doc in results]
+                query_hits, query_expected = recall_hits(matrix, allowed_by_role[role], query_vector, k, returned_rows)
+                hits += query_hits
+                expected += query_expected
+            recall[role] = hits / expected if expected else 1.0
+
+        result = {
+            "n_chunks": len(chunks),
+            "mode": mode,
+            "index": retriever.index_spec.factory if retriever.index_spec else "Flat",
+            "mmap": retriever.serving is not None,
+            "hybrid": retriever.bm25 is not None,
+            "k": k,
+            "dim": dim,
+            "queries": len(latencies),
+            "build_seconds": round(build_seconds, 3),
+            "load_seconds": round(load_seconds, 3),
+            "index_bytes": index_bytes,
+            "rss_mb_before_load": round(rss_before, 1),
+            "rss_mb_after_load": round(rss_after, 1),
+            "latency_ms": {
+                "p50": round(percentile_ms(latencies, 50), 3),
+                "p99": round(percentile_ms(latencies, 99), 3),
+                "mean": round(float(np.mean(latencies)) * 1000, 3) if latencies else 0.0,
+            },
+            "qps": round(len(latencies) / sum(latencies), 1) if latencies else 0.0,
+            "recall_at_k": {role: round(value, 4) for role, value in recall.items()},
+            "mean_recall_at_k": round(float(np.mean(list(recall.values()))), 4),
+        }
+
+        if with_llm:
+            # End-to-end latency through RagService, with the LLM replaced by an instant stub
+            service = RagService(retriever=retriever, llm=StubChatModel())
+            rag_latencies = []
+            for i, query in enumerate(queries):
+                start = time.perf_counter()
+                service.get_rag_response(query, ROLES[i % len(ROLES)])
+                rag_latencies.append(time.perf_counter() - start)
+            result["rag_latency_ms"] = {
+                "p50": round(percentile_ms(rag_latencies, 50), 3),
+                "p99": round(percentile_ms(rag_latencies, 99), 3),
+            }
+        return result
+
+
+def main(argv: list[str] | None = None) -> dict:
+    parser = argparse.ArgumentParser(description="Offline SecureRAG retrieval benchmark.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Corpus sizes in chunks (e.g. 1000 100000 1000000).")
+    parser.add_argument("--mode", choices=MODES, nargs="+", default=["bitmask"], help="Retrieval layouts to benchmark.")
+    parser.add_argument("--queries", type=int, default=100, help="Queries per role.")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--dim", type=int, default=256, help="Dimension of the hashing embeddings.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--index", type=IndexSpec.parse, default=None, metavar="SPEC",
+                        help="FAISS index spec for the single-index modes, as accepted by indexing.py --index.")
+    parser.add_argument("--no-mmap", action="store_true", help="Load indexes with FAISS.load_local instead of the memory-mapped serving format.")
+    parser.add_argument("--hybrid", action="store_true", help="Fuse BM25 results into the vector results (recall is still measured against exact vector search).")
+    parser.add_argument("--with-llm", action="store_true", help="Also time RagService end to end with a stub LLM.")
+    parser.add_argument("--workdir", help="Directory for temporary indexes (defaults to the system temp dir).")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+    args = parser.parse_args(argv)
+
+    # Per-query INFO logging would dominate the measured latency
+    logging.disable(logging.INFO)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {"queries_per_role": args.queries, "k": args.k, "dim": args.dim, "seed": args.seed, "roles": ROLES},
+        "runs": [
+            run_benchmark(size, args.queries, args.k, mode, args.seed, args.dim, args.with_llm, args.workdir, args.index,
+                          not args.no_mmap, args.hybrid)
+            for size in args.sizes for mode in args.mode
+        ],
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# secure-rag/benchmarks/stubs.py
+
+"""Offline stand-ins for the Google models and a synthetic corpus generator."""
+
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import SimpleChatModel
+
+ROLES = ["Engineer", "HR", "PM", "Finance", "Legal", "Sales", "Support", "Executive"]
+TOPICS = {
+    "deployment": "docker kubernetes helm rollout canary cluster pipeline release staging",
+    "compensation": "salary bonus band equity review promotion payroll allowance",
+    "leave": "vacation leave holiday sick parental remote schedule absence",
+    "security": "password rotation access token audit incident vulnerability encryption",
+    "roadmap": "feature milestone quarter launch localization integration priority",
+    "api": "endpoint versioning rate limit pagination schema naming deprecation",
+    "contracts": "agreement clause liability renewal vendor compliance signature",
+    "support": "ticket escalation sla customer refund outage status",
+}
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local embedder based on signed feature hashing.
+
+    Tokens are hashed with CRC32 (stable across processes, unlike hash()) into
+    `size` buckets, and each vector is L2-normalized. Texts that share words
+    get similar vectors, which is enough to benchmark retrieval offline.
+    """
+
+    def __init__(self, size: int = 768):
+        self.size = size
+
+    def _embed(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in _TOKEN_RE.findall(text.lower()):
+            h = zlib.crc32(token.encode('utf-8'))
+            vector[h % self.size] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+class StubChatModel(SimpleChatModel):
+    """Chat model that answers instantly (or after `latency` seconds) with a fixed-format reply."""
+
+    latency: float = 0.0
+    reply: str = "Stub answer based on the provided context."
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat"
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeGeminiServer:
+    """
+    Local HTTP stand-in for the Gemini REST API (app/model_client.py).
+
+    Serves generateContent, streamGenerateContent (SSE) and batchEmbedContents
+    for any model name, answering with `reply` and HashingEmbeddings vectors.
+    fault() makes a model slow or failing for its next requests, which is how
+    the timeout, hedging, circuit-breaker and fallback paths are exercised
+    offline. Every request is logged as (model, method), and every accepted
+    TCP connection is counted, so tests can check connection reuse.
+
+    Usage:
+        with FakeGeminiServer() as server:
+            transport = GeminiTransport(api_key="test", base_url=server.url)
+    """
+
+    def __init__(self, reply: str = "Fake answer based on the provided context.", dim: int = 64):
+        self.reply = reply
+        self.embeddings = HashingEmbeddings(dim)
+        self.requests: list[tuple[str, str]] = []
+        self.connections = 0
+        self._faults: dict[str, list[dict]] = {}
+        self._lock = threading.Lock()
+        self._server = _QuietHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+    def fault(self, model: str, latency: float = 0.0, status: int | None = None, times: int | None = None):
+        """Delays the model's next `times` requests (all of them if None) by `latency` s and/or fails them with `status`."""
+        with self._lock:
+            self._faults.setdefault(model, []).append({"latency": latency, "status": status, "times": times})
+
+    def clear_faults(self):
+        with self._lock:
+            self._faults.clear()
+
+    def _next_fault(self, model: str) -> dict | None:
+        with self._lock:
+            faults = self._faults.get(model)
+            if not faults:
+                return None
+            fault = faults[0]
+            if fault["times"] is not None:
+                fault["times"] -= 1
+                if fault["times"] <= 0:
+                    faults.pop(0)
+            return fault
+
+    def _respond(self, model: str, method: str, body: dict) -> tuple[int, str, bytes]:
+        with self._lock:
+            self.requests.append((model, method))
+        fault = self._next_fault(model)
+        if fault and fault["latency"]:
+            time.sleep(fault["latency"])
+        if fault and fault["status"]:
+            error = {"error": {"code": fault["status"], "message": f"injected failure for {model}"}}
+            return fault["status"], "application/json", json.dumps(error).encode()
+        if method == "batchEmbedContents":
+            texts = [request["content"]["parts"][0]["text"] for request in body["requests"]]
+            vectors = self.embeddings.embed_documents(texts)
+            return 200, "application/json", json.dumps({"embeddings": [{"values": v} for v in vectors]}).encode()
+        if method == "streamGenerateContent":
+            words = self.reply.split(" ")
+            events = [
+                {"candidates": [{"content": {"role": "model", "parts": [{"text": word + (" " if i < len(words) - 1 else "")}]}}]}
+                for i, word in enumerate(words)
+            ]
+            return 200, "text/event-stream", "".join(f"data: {json.dumps(e)}\r\n\r\n" for e in events).encode()
+        if method == "generateContent":
+            response = {"candidates": [{"content": {"role": "model", "parts": [{"text": self.reply}]}}]}
+            return 200, "application/json", json.dumps(response).encode()
+        return 404, "application/json", json.dumps({"error": {"code": 404, "message": "unknown method"}}).encode()
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # keep-alive, like the real API
+
+            def setup(self):
+                super().setup()
+                with fake._lock:
+                    fake.connections += 1
+
+            def do_POST(self):
+                # Path: /v1beta/models/<model>:<method>[?alt=sse]
+                resource = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                model, _, method = resource.partition(":")
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status, content_type, payload = fake._respond(model, method, body)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # The client gave up (timeout or a hedge won)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeGeminiServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def make_corpus(n_chunks: int, seed: int = 0, roles: list[str] = ROLES, words_per_chunk: int = 30) -> list[Document]:
+    """
+    Generates short single-chunk documents with random permission sets.
+
+    Each document mixes words from one main topic with some noise, and is
+    readable by a random non-empty subset of roles (most documents by 1-2 roles).
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    vocabulary = " ".join(TOPICS.values()).split()
+    docs = []
+    for i in range(n_chunks):
+        topic = topics[rng.randrange(len(topics))]
+        topic_words = TOPICS[topic].split()
+        words = [
+            rng.choice(topic_words) if rng.random() < 0.7 else rng.choice(vocabulary)
+            for _ in range(words_per_chunk)
+        ]
+        n_roles = min(len(roles), 1 + int(rng.expovariate(1.2)))
+        docs.append(Document(
+            page_content=f"{topic} note {i}: " + " ".join(words),
+            metadata={"title": f"{topic}-{i}", "category": topic, "permission": rng.sample(roles, n_roles)},
+        ))
+    return docs
+
+
+def make_queries(n_queries: int, seed: int = 1) -> list[str]:
+    """Generates short keyword queries over the same topics as make_corpus."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        topic_words = TOPICS[rng.choice(list(TOPICS))].split()
+        queries.append(" ".join(rng.sample(topic_words, 3)))
+    return queries
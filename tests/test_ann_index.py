@@ -0,0 +1,69 @@
+# secure-rag/tests/test_ann_index.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import faiss
+import numpy as np
+import pytest
+
+from app.ann_index import IndexSpec, build_index, load_index_spec, resolve_spec
+from app.indexing import create_and_save_vectorstore, update_vectorstore
+from app.retriever import PermissionRetriever
+from benchmarks.stubs import HashingEmbeddings, make_corpus
+
+
+def test_parse_spec_and_reject_unknown_values():
+    spec = IndexSpec.parse("ivf_pq:nlist=64,pq_m=8,nprobe=4")
+    assert (spec.kind, spec.nlist, spec.pq_m, spec.nprobe) == ("ivf_pq", 64, 8, 4)
+    with pytest.raises(ValueError):
+        IndexSpec.parse("annoy")
+    with pytest.raises(ValueError):
+        IndexSpec.parse("hnsw:depth=3")
+
+
+def test_small_corpus_falls_back_to_flat():
+    assert resolve_spec(IndexSpec(kind="ivf_pq"), n_vectors=100, dim=64).factory == "Flat"
+    assert resolve_spec(IndexSpec(kind="ivf_flat"), n_vectors=100000, dim=64).factory == "IVF1264,Flat"
+
+
+def test_ivf_with_all_lists_probed_is_exact():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    index, spec = build_index(vectors, IndexSpec(kind="ivf_flat", nlist=16, nprobe=16))
+    exact = faiss.IndexFlatL2(16)
+    exact.add(vectors)
+    assert spec.factory == "IVF16,Flat"
+    assert np.array_equal(index.search(vectors[:20], 5)[1], exact.search(vectors[:20], 5)[1])
+
+
+def test_retriever_reads_spec_and_filters_on_hnsw(tmp_path):
+    save_path = str(tmp_path / "vectorstore")
+    embeddings = HashingEmbeddings(size=64)
+    create_and_save_vectorstore(make_corpus(400), save_path, embeddings, IndexSpec(kind="hnsw", hnsw_m=16))
+
+    retriever = PermissionRetriever(save_path, embeddings=embeddings, ef_search=128)
+    assert load_index_spec(save_path).factory == "HNSW16"
+    assert isinstance(retriever.serving.index, faiss.IndexHNSW)
+    assert retriever.serving.index.hnsw.efSearch == 128
+
+    docs = retriever.get_relevant_documents("salary bonus review", "Finance", k=4)
+    assert len(docs) == 4
+    assert all("Finance" in doc.metadata["permission"] for doc in docs)
+
+
+def test_update_of_ann_index_rebuilds(tmp_path):
+    save_path = str(tmp_path / "vectorstore")
+    embeddings = HashingEmbeddings(size=64)
+    docs = make_corpus(400)
+    create_and_save_vectorstore(docs, save_path, embeddings, IndexSpec(kind="hnsw", hnsw_m=16))
+
+    # HNSW cannot delete vectors, so dropping documents must go through a rebuild
+    update_vectorstore(docs[:300], save_path, embeddings)
+    retriever = PermissionRetriever(save_path, embeddings=embeddings)
+    assert retriever.serving.ntotal == 300
+    assert retriever.index_spec.kind == "hnsw"
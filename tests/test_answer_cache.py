@@ -0,0 +1,86 @@
+# secure-rag/tests/test_answer_cache.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.answer_cache import SemanticAnswerCache
+from app.rag_chain import RagService
+
+DOCS = frozenset({"chunk-a", "chunk-b"})
+
+
+def test_hit_requires_same_scope_similarity_and_documents():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("HR", [1.0, 0.0], DOCS, "20 days of leave")
+
+    assert cache.lookup("HR", [0.99, 0.05], DOCS) == "20 days of leave"
+    assert cache.lookup("Engineer", [1.0, 0.0], DOCS) is None
+    assert cache.lookup("HR", [0.0, 1.0], DOCS) is None
+    assert cache.lookup("HR", [1.0, 0.0], frozenset({"chunk-a"})) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 3
+
+
+def test_ttl_and_lru_eviction():
+    now = [0.0]
+    cache = SemanticAnswerCache(ttl_seconds=10, max_entries=2, clock=lambda: now[0])
+    cache.store("HR", [1.0, 0.0], DOCS, "first")
+    cache.store("HR", [0.0, 1.0], DOCS, "second")
+    cache.store("PM", [1.0, 1.0], DOCS, "third")
+    assert cache.stats()["evictions"] == 1
+    assert cache.lookup("HR", [1.0, 0.0], DOCS) is None
+
+    now[0] = 11.0
+    assert cache.lookup("HR", [0.0, 1.0], DOCS) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_index_version_change_invalidates():
+    cache = SemanticAnswerCache()
+    cache.store("HR", [1.0, 0.0], DOCS, "old answer", index_version="v1")
+    assert cache.lookup("HR", [1.0, 0.0], DOCS, index_version="v1") == "old answer"
+    assert cache.lookup("HR", [1.0, 0.0], DOCS, index_version="v2") is None
+    assert cache.stats()["invalidations"] == 1
+
+    # A request still draining on the old index neither reads, writes nor rolls the cache back
+    cache.store("HR", [1.0, 0.0], DOCS, "new answer", index_version="v2")
+    cache.store("HR", [1.0, 0.0], DOCS, "stale answer", index_version="v1")
+    assert cache.lookup("HR", [1.0, 0.0], DOCS, index_version="v1") is None
+    assert cache.lookup("HR", [1.0, 0.0], DOCS, index_version="v2") == "new answer"
+    assert cache.stats()["invalidations"] == 1 and cache.stats()["size"] == 1
+
+
+class KeywordEmbeddings:
+    """Embeds a query as keyword counts so near-duplicate phrasings get near-identical vectors."""
+
+    def embed_query(self, text: str) -> list[float]:
+        text = text.lower()
+        return [float(text.count("leave")), float(text.count("policy")), float(text.count("deploy")), 0.1]
+
+
+class KeywordRetriever:
+    index_version = "v1"
+    embeddings = KeywordEmbeddings()
+
+    def get_relevant_documents(self, query, user_role, k=4, query_embedding=None):
+        permission = ["HR"] if "leave" in query.lower() else ["Engineer"]
+        if user_role not in permission:
+            return []
+        return [Document(page_content=query, metadata={"chunk_id": permission[0], "permission": permission})]
+
+
+def test_service_reuses_answers_per_role():
+    llm = FakeListChatModel(responses=["HR answer", "second call"])
+    service = RagService(retriever=KeywordRetriever(), llm=llm, answer_cache=SemanticAnswerCache(threshold=0.95))
+
+    assert service.get_rag_response("What's the leave policy?", "HR") == "HR answer"
+    assert service.get_rag_response("leave policy?", "HR") == "HR answer"
+    assert service.get_rag_response("leave policy?", "Engineer") == "second call"
+    assert service.health()["answer_cache"]["hits"] == 1
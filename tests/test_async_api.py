@@ -0,0 +1,59 @@
+# secure-rag/tests/test_async_api.py
+
+import asyncio
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain.schema.runnable import RunnableLambda
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import app.rag_chain as rag_chain_module
+from app.indexing import create_and_save_vectorstore
+from app.retriever import PermissionRetriever
+
+
+def test_aget_relevant_documents_matches_sync(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = [
+        Document(page_content=f"note {i}", metadata={"title": f"Doc {i}", "permission": ["HR"] if i % 2 else ["Engineer"]})
+        for i in range(20)
+    ]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+
+    async def run():
+        return await asyncio.gather(*(retriever.aget_relevant_documents("note 3", "HR") for _ in range(10)))
+
+    results = asyncio.run(run())
+    expected = retriever.get_relevant_documents("note 3", "HR")
+    assert all([d.metadata["chunk_id"] for d in result] == [d.metadata["chunk_id"] for d in expected] for result in results)
+
+
+def test_aget_rag_response_is_concurrency_limited(monkeypatch):
+    state = {"active": 0, "peak": 0}
+
+    async def slow_llm(prompt_value):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        return prompt_value.to_messages()[0].content.split("Question:")[1].split("Answer:")[0].strip()
+
+    class StaticRetriever:
+        async def aget_relevant_documents(self, query, user_role, k=4):
+            return []
+
+    monkeypatch.setattr(rag_chain_module, "MAX_CONCURRENT_LLM_CALLS", 3)
+    service = rag_chain_module.RagService(retriever=StaticRetriever(), llm=RunnableLambda(lambda x: None, afunc=slow_llm))
+
+    async def run():
+        return await asyncio.gather(*(service.aget_rag_response(f"q{i}", "HR") for i in range(12)))
+
+    answers = asyncio.run(run())
+    assert answers == [f"q{i}" for i in range(12)]
+    assert state["peak"] == 3
@@ -0,0 +1,114 @@
+# secure-rag/tests/test_batch_qa.py
+
+import json
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import pytest
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.runnables import RunnableLambda
+
+from app.batch_qa import run
+from app.indexing import create_and_save_partitioned_vectorstore, create_and_save_vectorstore
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+
+ROLES = ["HR", "Engineer", "PM"]
+
+
+def make_docs() -> list[Document]:
+    return [
+        Document(page_content=f"note {i} about topic {i % 7}",
+                 metadata={"title": f"Doc {i}", "permission": [ROLES[i % 3]] + (["PM"] if i % 5 == 0 else [])})
+        for i in range(60)
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_vectorstore(make_docs(), str(tmp_path / "store"), embeddings=embeddings)
+    return str(tmp_path / "store"), embeddings
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+@pytest.mark.parametrize("hybrid", [True, False])
+def test_batch_retrieval_matches_single_queries(store, use_mmap, hybrid):
+    path, embeddings = store
+    retriever = PermissionRetriever(vectorstore_path=path, embeddings=embeddings, use_mmap=use_mmap, hybrid=hybrid)
+    queries = [f"topic {i}" for i in range(9)]
+    roles = [ROLES[i % 3] for i in range(9)]
+    queries.append("nobody can read this")
+    roles.append("Intern")
+
+    batch = retriever.get_relevant_documents_batch(queries, roles, k=3)
+    single = [retriever.get_relevant_documents(query, role, k=3) for query, role in zip(queries, roles)]
+    assert [[doc.metadata["title"] for doc in docs] for docs in batch] == \
+           [[doc.metadata["title"] for doc in docs] for docs in single]
+    assert batch[-1] == []
+
+
+def test_batch_retrieval_over_partitions(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_partitioned_vectorstore(make_docs(), str(tmp_path), embeddings)
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    queries = [f"topic {i}" for i in range(6)]
+    roles = [ROLES[i % 3] for i in range(6)]
+
+    batch = retriever.get_relevant_documents_batch(queries, roles, k=4)
+    single = [retriever.get_relevant_documents(query, role, k=4) for query, role in zip(queries, roles)]
+    assert batch == single
+    assert all(role in doc.metadata["permission"] for docs, role in zip(batch, roles) for doc in docs)
+
+
+def echo_llm(calls: list, fail_on: str | None = None):
+    def answer(prompt_value):
+        question = prompt_value.to_string().rsplit("Question:", 1)[1].split("Answer:")[0].strip()
+        calls.append(question)
+        if question == fail_on:
+            raise RuntimeError("quota exceeded")
+        return f"answer to {question}"
+    return RunnableLambda(answer)
+
+
+def test_batch_responses_keep_order_and_resume_from_checkpoint(store, tmp_path):
+    path, embeddings = store
+    retriever = PermissionRetriever(vectorstore_path=path, embeddings=embeddings)
+    pairs = [(f"question {i}", ROLES[i % 3]) for i in range(10)]
+    checkpoint = str(tmp_path / "run.checkpoint")
+
+    calls = []
+    service = RagService(retriever=retriever, llm=echo_llm(calls, fail_on="question 4"))
+    answers = service.get_rag_responses(pairs, max_workers=3, checkpoint_path=checkpoint)
+    assert answers[4].startswith("RAG 链调用期间发生错误")
+    assert [answer for i, answer in enumerate(answers) if i != 4] == \
+           [f"answer to question {i}" for i in range(10) if i != 4]
+    assert len(calls) == 10
+
+    # The rerun only answers the question that failed
+    calls = []
+    service = RagService(retriever=retriever, llm=echo_llm(calls))
+    answers = service.get_rag_responses(pairs, max_workers=3, checkpoint_path=checkpoint)
+    assert answers == [f"answer to question {i}" for i in range(10)]
+    assert calls == ["question 4"]
+
+
+def test_cli_run_writes_answers_in_input_order(store, tmp_path):
+    path, embeddings = store
+    service = RagService(retriever=PermissionRetriever(vectorstore_path=path, embeddings=embeddings), llm=echo_llm([]))
+    input_path = tmp_path / "questions.jsonl"
+    input_path.write_text("\n".join(
+        json.dumps({"id": i, "query": f"question {i}", "user_role": ROLES[i % 3]}) for i in range(5)
+    ) + "\n", encoding="utf-8")
+    output_path = tmp_path / "answers.jsonl"
+
+    assert run(str(input_path), str(output_path), service=service) == 0
+    records = [json.loads(line) for line in output_path.read_text(encoding="utf-8").splitlines()]
+    assert [record["id"] for record in records] == list(range(5))
+    assert records[2]["answer"] == "answer to question 2"
+    assert not os.path.exists(str(output_path) + ".checkpoint")
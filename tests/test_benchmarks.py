@@ -0,0 +1,45 @@
+# secure-rag/tests/test_benchmarks.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import numpy as np
+
+from benchmarks.quantization_benchmark import run as run_quantization_benchmark
+from benchmarks.retrieval_benchmark import run_benchmark
+from benchmarks.stubs import HashingEmbeddings, make_corpus
+
+
+def test_hashing_embeddings_are_deterministic_and_normalized():
+    first = HashingEmbeddings(size=64).embed_query("docker rollout canary")
+    second = HashingEmbeddings(size=64).embed_documents(["docker rollout canary"])[0]
+    assert first == second
+    assert np.isclose(np.linalg.norm(first), 1.0)
+
+
+def test_corpus_is_reproducible_and_every_chunk_has_a_role():
+    docs = make_corpus(50, seed=3)
+    assert [d.page_content for d in docs] == [d.page_content for d in make_corpus(50, seed=3)]
+    assert all(d.metadata["permission"] for d in docs)
+
+
+def test_bitmask_retrieval_matches_exact_permissioned_search(tmp_path):
+    result = run_benchmark(300, n_queries=5, k=4, mode="bitmask", dim=64, workdir=str(tmp_path))
+    assert result["n_chunks"] == 300
+    assert result["queries"] == 5 * len(result["recall_at_k"])
+    assert result["mean_recall_at_k"] == 1.0
+    assert result["latency_ms"]["p99"] >= result["latency_ms"]["p50"] > 0
+
+
+def test_quantization_report_covers_every_layout():
+    report = run_quantization_benchmark(500, dim=32, n_queries=10, k=5)
+    sizes = {(r["vector_dtype"], r["text_codec"]): r for r in report["results"]}
+    assert len(sizes) == 6
+    assert sizes[("int8", None)]["scan_vector_bytes"] < sizes[("float16", None)]["scan_vector_bytes"] \
+        < sizes[("float32", None)]["scan_vector_bytes"]
+    assert all(r["text_bytes"] < sizes[("float32", None)]["text_bytes"] for r in report["results"] if r["text_codec"])
+    assert all(r["recall_at_k"] >= 0.9 for r in report["results"])
@@ -0,0 +1,72 @@
+# secure-rag/tests/test_bm25_index.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+from app.indexing import create_and_save_vectorstore
+from app.retriever import PermissionRetriever
+
+TEXTS = [
+    "Deploy services with helm charts.",
+    "Policy POL-7731 covers remote work stipends.",
+    "Call get_user_v2 instead of the deprecated endpoint.",
+    "Remote work requires manager approval.",
+    "年终奖在三月发放。",
+]
+
+
+def test_tokenize_keeps_codes_and_identifiers():
+    assert tokenize("See POL-7731, then call get_user_v2 (v2.1).") == ["see", "pol-7731", "then", "call", "get_user_v2", "v2.1"]
+    assert tokenize("年终奖") == ["年", "终", "奖"]
+
+
+def test_search_ranks_exact_terms_and_respects_allowed_rows(tmp_path):
+    index = BM25Index.build(TEXTS)
+    assert [row for row, _ in index.search("POL-7731 remote", 2)] == [1, 3]
+    assert index.search("get_user_v2", 3)[0][0] == 2
+    assert index.search("奖金", 1)[0][0] == 4
+
+    allowed = np.array([True, False, True, True, True])
+    assert [row for row, _ in index.search("POL-7731 remote", 2, allowed)] == [3]
+    assert index.search("kubernetes", 3) == []
+
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path))
+    assert loaded.search("POL-7731 remote", 2) == index.search("POL-7731 remote", 2)
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=3) == ["c", "a", "b"]
+
+
+def test_hybrid_retrieval_finds_exact_terms_only_for_permitted_roles(tmp_path):
+    docs = [
+        Document(page_content=f"general note number {i}", metadata={"title": f"Note {i}", "permission": ["HR", "Engineer"]})
+        for i in range(40)
+    ]
+    docs.append(Document(page_content="POL-7731: remote stipend is 50 EUR.", metadata={"title": "Stipend", "permission": ["HR"]}))
+    # Random embeddings carry no meaning, so only the lexical path can find the policy code
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+
+    retriever = PermissionRetriever(str(tmp_path), embeddings=embeddings)
+    assert retriever.bm25 is not None
+    hr_docs = retriever.get_relevant_documents("What does POL-7731 say?", "HR", k=3)
+    assert "Stipend" in [d.metadata["title"] for d in hr_docs]
+    assert len(hr_docs) == 3
+
+    engineer_docs = retriever.get_relevant_documents("What does POL-7731 say?", "Engineer", k=3)
+    assert "Stipend" not in [d.metadata["title"] for d in engineer_docs]
+
+    pickled = PermissionRetriever(str(tmp_path), embeddings=embeddings, use_mmap=False)
+    assert [d.metadata["title"] for d in pickled.get_relevant_documents("What does POL-7731 say?", "HR", k=3)] == \
+        [d.metadata["title"] for d in hr_docs]
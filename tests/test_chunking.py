@@ -0,0 +1,54 @@
+# secure-rag/tests/test_chunking.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+
+import app.indexing
+from app.indexing import CHUNK_SIZE, iter_chunks, load_tokenizer
+
+
+def make_docs(n: int) -> list[Document]:
+    paragraph = "Employees accrue leave monthly and must file requests in the portal before travelling. "
+    return [
+        Document(page_content="\n\n".join(f"Section {s} of policy {i}. " + paragraph * 8 for s in range(4)),
+                 metadata={"title": f"Policy {i}", "permission": ["HR"]})
+        for i in range(n)
+    ]
+
+
+def test_chunks_are_token_sized_with_offsets_and_stable_ids(monkeypatch):
+    monkeypatch.setattr(app.indexing, "CHUNK_BATCH_DOCS", 2)
+    docs = make_docs(7)
+    serial = list(iter_chunks(docs, workers=1))
+    parallel = list(iter_chunks(docs, workers=3))
+
+    assert [c.metadata["chunk_id"] for c in parallel] == [c.metadata["chunk_id"] for c in serial]
+    assert len({c.metadata["chunk_id"] for c in serial}) == len(serial) > len(docs)
+    _, token_length = load_tokenizer()
+    by_title = {doc.metadata["title"]: doc.page_content for doc in docs}
+    for chunk in serial:
+        assert token_length(chunk.page_content) <= CHUNK_SIZE
+        start, end = chunk.metadata["start_index"], chunk.metadata["end_index"]
+        assert by_title[chunk.metadata["doc_id"]][start:end] == chunk.page_content
+
+    # Changing a document's permissions gives its chunks new ids, so incremental updates replace them
+    docs[0].metadata["permission"] = ["HR", "PM"]
+    changed = list(iter_chunks(docs[:1], workers=1))
+    assert changed[0].metadata["chunk_id"] != serial[0].metadata["chunk_id"]
+
+
+def test_exact_duplicates_are_dropped_only_for_the_same_readers():
+    disclaimer = "This document is confidential."
+    docs = [
+        Document(page_content=disclaimer, metadata={"title": "A", "permission": ["HR"]}),
+        Document(page_content=disclaimer, metadata={"title": "B", "permission": ["HR"]}),
+        Document(page_content=disclaimer, metadata={"title": "C", "permission": ["Engineer"]}),
+        Document(page_content=disclaimer, metadata={"title": "D", "permission": ["HR"], "deny": ["contractors"]}),
+    ]
+    assert [chunk.metadata["title"] for chunk in iter_chunks(docs, workers=1)] == ["A", "C", "D"]
@@ -0,0 +1,70 @@
+# secure-rag/tests/test_context_packing.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.runnables import RunnableLambda
+
+from app.context_packing import estimate_tokens, pack_context
+from app.rag_chain import RagService
+
+POLICY = " ".join(f"Rule {i}: leave requests need approval from the team lead." for i in range(60))
+
+
+def split(text: str, title: str) -> list[Document]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+    return splitter.split_documents([Document(page_content=text, metadata={"title": title, "permission": ["HR"]})])
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("年终奖") == 3
+
+
+def test_overlapping_chunks_are_merged_back_into_one_span():
+    chunks = split(POLICY, "Leave")
+    assert len(chunks) >= 3
+    # Retrieval order is not document order, and one chunk is retrieved twice
+    packed = pack_context([chunks[2], chunks[0], chunks[1], chunks[0]], token_budget=10000)
+
+    assert len(packed.segments) == 1
+    assert POLICY.startswith(packed.text)
+    assert len(packed.documents) == 4
+    assert packed.tokens_saved > 0
+
+
+def test_segments_keep_score_order_and_fit_the_budget():
+    leave = split(POLICY, "Leave")
+    bonus = Document(page_content="Bonuses are paid in March.", metadata={"title": "Bonus"})
+    packed = pack_context([bonus, leave[0], leave[1]], token_budget=10000)
+    assert [segment.source for segment in packed.segments] == ["Bonus", "Leave"]
+
+    small = pack_context([bonus, leave[0], leave[1]], token_budget=120)
+    assert small.tokens <= 120
+    assert small.text.startswith("Bonuses are paid in March.")
+    assert small.text.endswith(" ...")
+
+
+def test_service_sends_packed_context_and_reports_savings():
+    chunks = split(POLICY, "Leave")
+
+    class Retriever:
+        def get_relevant_documents(self, query, user_role, k=4, query_embedding=None):
+            return [chunks[1], chunks[0]]
+
+    prompts = []
+    llm = RunnableLambda(lambda prompt_value: prompts.append(prompt_value.to_string()) or "Ask your lead.")
+    service = RagService(retriever=Retriever(), llm=llm, context_token_budget=10000)
+
+    assert service.get_rag_response("Who approves leave?", "HR") == "Ask your lead."
+    overlap = chunks[0].page_content[-100:]
+    assert prompts[0].count(overlap) == 1
+    stats = service.health()["context"]
+    assert stats["requests"] == 1
+    assert stats["tokens_saved"] > 0
@@ -0,0 +1,77 @@
+# secure-rag/tests/test_embedding_cache.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings that count upstream calls."""
+
+    calls: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        return super().embed_query(text)
+
+
+def test_repeated_queries_hit_memory_cache(tmp_path):
+    inner = CountingEmbeddings(size=8)
+    cache = CachedEmbeddings(inner, "test-model", cache_path=str(tmp_path / "cache.sqlite"))
+
+    first = cache.embed_query("what is the leave policy?")
+    second = cache.embed_query("what is the leave policy?")
+    assert first == second
+    assert inner.calls == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_persists_across_instances(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    inner = CountingEmbeddings(size=8)
+    CachedEmbeddings(inner, "test-model", cache_path=cache_path).embed_documents(["a", "b", "a"])
+    assert inner.calls == 2
+
+    reopened = CachedEmbeddings(inner, "test-model", cache_path=cache_path)
+    vectors = reopened.embed_documents(["b", "a", "c"])
+    assert len(vectors) == 3
+    assert inner.calls == 3
+    assert reopened.stats()["hits"] == 2
+
+
+def test_cache_is_keyed_by_model_and_call_kind(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite")
+    inner = CountingEmbeddings(size=8)
+    CachedEmbeddings(inner, "model-a", cache_path=cache_path).embed_documents(["text"])
+    CachedEmbeddings(inner, "model-b", cache_path=cache_path).embed_documents(["text"])
+    CachedEmbeddings(inner, "model-a", cache_path=cache_path).embed_query("text")
+    assert inner.calls == 3
+
+
+def test_memory_lru_is_bounded(tmp_path):
+    cache = CachedEmbeddings(CountingEmbeddings(size=8), "test-model", cache_path=":memory:", max_memory_items=2)
+    cache.embed_documents(["a", "b", "c"])
+    assert cache.stats()["memory_items"] == 2
+
+
+def test_batched_queries_share_the_query_cache(tmp_path):
+    inner = CountingEmbeddings(size=8)
+    cache = CachedEmbeddings(inner, "test-model", cache_path=str(tmp_path / "cache.sqlite"))
+
+    single = cache.embed_query("q1")
+    vectors = cache.embed_queries(["q1", "q2", "q2", "q3"])
+    assert vectors[0] == single
+    assert vectors[1] == vectors[2] == inner.embed_query("q2")
+    assert inner.calls == 4 # q1, q2 and q3 once each, plus the direct comparison call above
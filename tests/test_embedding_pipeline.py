@@ -0,0 +1,72 @@
+# secure-rag/tests/test_embedding_pipeline.py
+
+import os
+import sys
+from functools import partial
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.embedding_pipeline import add_chunks, is_rate_limit_error
+from app.indexing import create_and_save_vectorstore, iter_chunks, load_manifest, update_vectorstore
+
+
+class FlakyEmbeddings(DeterministicFakeEmbedding):
+    """Fails the first `transient_failures` calls with a 429 and always fails texts containing 'poison'."""
+
+    transient_failures: int = 0
+    calls: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        if self.transient_failures > 0:
+            self.transient_failures -= 1
+            raise RuntimeError("429 Resource has been exhausted (e.g. check quota).")
+        if any("poison" in text for text in texts):
+            raise RuntimeError("500 Internal error")
+        return super().embed_documents(texts)
+
+
+def make_chunks(n: int, poison_at: int | None = None) -> list[Document]:
+    return list(iter_chunks([
+        Document(page_content="poison" if i == poison_at else f"chunk {i}", metadata={"title": f"Doc {i}", "permission": ["HR"]})
+        for i in range(n)
+    ]))
+
+
+def test_rate_limit_errors_are_retried():
+    assert is_rate_limit_error(RuntimeError("429 Resource has been exhausted"))
+    assert not is_rate_limit_error(ValueError("bad input"))
+
+    embeddings = FlakyEmbeddings(size=8, transient_failures=2)
+    result = add_chunks(None, make_chunks(10), embeddings, batch_size=3, max_workers=2, sleep=lambda _: None)
+    assert result.failed == []
+    assert result.vectorstore.index.ntotal == 10
+
+
+def test_failed_batches_do_not_abort_the_run():
+    embeddings = FlakyEmbeddings(size=8)
+    result = add_chunks(None, make_chunks(10, poison_at=4), embeddings, batch_size=3, max_retries=1, sleep=lambda _: None)
+    assert len(result.failed) == 3
+    assert result.vectorstore.index.ntotal == 7
+    assert result.embedded == 7
+
+
+def test_incremental_run_resumes_after_partial_failure(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.indexing.add_chunks", partial(add_chunks, batch_size=2, max_retries=0))
+    save_path = str(tmp_path / "vectorstore")
+    docs = [Document(page_content=f"content {i}", metadata={"title": f"Doc {i}", "permission": ["HR"]}) for i in range(6)]
+    docs[3].page_content = "poison"
+
+    create_and_save_vectorstore(docs, save_path, embeddings=FlakyEmbeddings(size=8))
+    assert len(load_manifest(save_path)["documents"]) == 4
+
+    docs[3].page_content = "content 3"
+    healthy = FlakyEmbeddings(size=8)
+    update_vectorstore(docs, save_path, embeddings=healthy)
+    assert healthy.calls == 1
+    assert len(load_manifest(save_path)["documents"]) == 6
@@ -0,0 +1,87 @@
+# secure-rag/tests/test_hot_reload.py
+
+import os
+import sys
+import time
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.indexing import VERSION_FILE, create_and_save_vectorstore
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def build(path: str, topic: str):
+    docs = [Document(page_content=f"{topic} policy {i}", metadata={"title": f"{topic} {i}", "permission": ["HR"]})
+            for i in range(5)]
+    create_and_save_vectorstore(docs, path, embeddings=EMBEDDINGS)
+
+
+def make_service(path: str, **kwargs) -> RagService:
+    return RagService(retriever=PermissionRetriever(vectorstore_path=path, embeddings=EMBEDDINGS),
+                      llm=FakeListChatModel(responses=["ok"]), **kwargs)
+
+
+def titles(service: RagService) -> set[str]:
+    return {doc.metadata["title"].split()[0] for doc in service.retriever.get_relevant_documents("policy", "HR")}
+
+
+def test_reload_swaps_to_the_rebuilt_index(tmp_path):
+    path = str(tmp_path / "store")
+    build(path, "Leave")
+    assert os.path.exists(os.path.join(path, VERSION_FILE))
+    service = make_service(path)
+    service.get_rag_response("policy?", "HR")
+    first = service.health()["index"]["version"]
+
+    assert service.reload_index() is False
+    build(path, "Bonus")
+    assert service.reload_index() is True
+    assert titles(service) == {"Bonus"}
+    assert service.health()["index"]["version"] != first
+    assert service.health()["index"]["reloads"] == 1
+
+    _, trace = service.get_rag_response_with_trace("policy?", "HR")
+    assert trace["index_version"] == service.health()["index"]["version"]
+
+
+def test_in_flight_stream_finishes_on_the_old_version(tmp_path):
+    path = str(tmp_path / "store")
+    build(path, "Leave")
+    service = make_service(path)
+
+    events = service.stream_rag_response("policy?", "HR")
+    first = next(events)
+    assert {doc.metadata["title"].split()[0] for doc in first["documents"]} == {"Leave"}
+
+    build(path, "Bonus")
+    assert service.reload_index() is True
+    assert service.health()["index"]["draining_requests"] == 1
+    assert first["index_version"] != service.health()["index"]["version"]
+
+    assert "".join(event["answer"] for event in events) == "ok"
+    assert service.health()["index"]["draining_requests"] == 0
+    assert titles(service) == {"Bonus"}
+
+
+def test_watcher_reloads_in_the_background(tmp_path):
+    path = str(tmp_path / "store")
+    build(path, "Leave")
+    service = make_service(path, watch_interval=0.05)
+    try:
+        first = service.health()["index"]["version"]
+        build(path, "Bonus")
+        deadline = time.monotonic() + 10
+        while service.health()["index"]["version"] == first and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert titles(service) == {"Bonus"}
+    finally:
+        service.stop_watching()
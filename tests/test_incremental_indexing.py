@@ -0,0 +1,64 @@
+# secure-rag/tests/test_incremental_indexing.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import MANIFEST_FILE, create_and_save_vectorstore, load_manifest, update_vectorstore
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings that remember which texts were embedded."""
+
+    embedded: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+def make_doc(title: str, content: str, permission: list[str]) -> Document:
+    return Document(page_content=content, metadata={"title": title, "permission": permission})
+
+
+def test_update_embeds_only_changed_chunks(tmp_path):
+    save_path = str(tmp_path / "vectorstore")
+    docs = [
+        make_doc("Handbook", "leave policy", ["HR"]),
+        make_doc("Deploy", "deploy with docker", ["Engineer"]),
+        make_doc("Roadmap", "q3 roadmap", ["PM"]),
+    ]
+    create_and_save_vectorstore(docs, save_path, embeddings=DeterministicFakeEmbedding(size=8))
+    assert os.path.exists(os.path.join(save_path, MANIFEST_FILE))
+
+    embeddings = CountingEmbeddings(size=8, embedded=[])
+    updated = [
+        make_doc("Handbook", "leave policy", ["HR"]),
+        make_doc("Deploy", "deploy with helm", ["Engineer"]),
+        make_doc("Security", "rotate keys yearly", ["Engineer", "PM"]),
+    ]
+    update_vectorstore(updated, save_path, embeddings=embeddings)
+
+    assert sorted(embeddings.embedded) == ["deploy with helm", "rotate keys yearly"]
+    store = FAISS.load_local(save_path, embeddings, allow_dangerous_deserialization=True)
+    assert store.index.ntotal == 3
+    contents = sorted(store.docstore.search(i).page_content for i in store.index_to_docstore_id.values())
+    assert contents == ["deploy with helm", "leave policy", "rotate keys yearly"]
+    assert sorted(load_manifest(save_path)["documents"]) == ["Deploy", "Handbook", "Security"]
+
+
+def test_update_without_changes_embeds_nothing(tmp_path):
+    save_path = str(tmp_path / "vectorstore")
+    docs = [make_doc("Handbook", "leave policy", ["HR"])]
+    create_and_save_vectorstore(docs, save_path, embeddings=DeterministicFakeEmbedding(size=8))
+
+    embeddings = CountingEmbeddings(size=8, embedded=[])
+    update_vectorstore(docs, save_path, embeddings=embeddings)
+    assert embeddings.embedded == []
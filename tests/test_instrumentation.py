@@ -0,0 +1,91 @@
+# secure-rag/tests/test_instrumentation.py
+
+import os
+import sys
+from contextlib import contextmanager
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import pytest
+from langchain.docstore.document import Document
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import create_and_save_vectorstore
+from app.instrumentation import METRICS, enable_metrics, enable_opentelemetry, span
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+
+
+@pytest.fixture
+def service(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = [
+        Document(page_content=f"policy POL-{i} applies to team {i % 4}",
+                 metadata={"title": f"Policy {i}", "permission": ["HR"] if i % 2 else ["Engineer"]})
+        for i in range(40)
+    ]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    return RagService(retriever=retriever, llm=FakeListChatModel(responses=["See POL-3."]))
+
+
+def test_span_is_a_shared_no_op_when_nothing_observes():
+    assert span("vector_search") is span("llm")
+
+
+def test_trace_covers_every_stage(service):
+    answer, trace = service.get_rag_response_with_trace("what does POL-3 say?", "HR")
+    assert answer == "See POL-3."
+    for stage in ("request", "retrieve", "embed_query", "vector_search", "permission_filter", "bm25_search",
+                  "rank_fusion", "pack_context", "format_prompt", "llm"):
+        assert stage in trace["stages"], stage
+    counters = trace["counters"]
+    assert counters["documents_fetched"] >= counters["documents_kept"] > 0
+    assert counters["llm_input_tokens"] > counters["context_tokens"] > 0
+    assert counters["llm_output_tokens"] > 0
+    assert trace["total_ms"] >= trace["stages"]["request"]
+
+
+def test_stream_ends_with_trace_event(service):
+    events = list(service.stream_rag_response("what does POL-3 say?", "HR", include_trace=True))
+    assert "documents" in events[0]
+    assert "".join(event["answer"] for event in events[1:-1]) == "See POL-3."
+    assert {"llm", "llm_first_token"} <= set(events[-1]["trace"]["stages"])
+
+    # Without include_trace the event sequence is unchanged
+    assert all("trace" not in event for event in service.stream_rag_response("POL-3", "HR"))
+
+
+def test_prometheus_export(service):
+    METRICS.reset()
+    enable_metrics()
+    try:
+        service.get_rag_response("what does POL-3 say?", "HR")
+        service.get_rag_response("what does POL-5 say?", "HR")
+    finally:
+        enable_metrics(False)
+    text = METRICS.render_prometheus()
+    METRICS.reset()
+    assert 'secure_rag_stage_duration_seconds_count{stage="vector_search"} 2' in text
+    assert 'secure_rag_stage_duration_seconds_bucket{stage="llm",le="+Inf"} 2' in text
+    assert "# TYPE secure_rag_documents_kept_total counter" in text
+
+
+def test_opentelemetry_receives_spans(service):
+    started = []
+
+    class Tracer:
+        @contextmanager
+        def start_as_current_span(self, name):
+            started.append(name)
+            yield
+
+    enable_opentelemetry(Tracer())
+    try:
+        service.get_rag_response("what does POL-3 say?", "HR")
+    finally:
+        enable_opentelemetry(False)
+    assert {"request", "vector_search", "pack_context"} <= set(started)
@@ -0,0 +1,178 @@
+# secure-rag/tests/test_model_client.py
+
+import os
+import sys
+import time
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import httpx
+import pytest
+from langchain.docstore.document import Document
+
+from app import model_client
+from app.indexing import create_and_save_vectorstore, init_embeddings
+from app.model_client import (AllModelsFailedError, GeminiTransport, ModelCallError, ResilientClient,
+                              build_resilient_chat_model, build_resilient_embeddings)
+from app.rag_chain import RagService, build_chat_model
+from app.retriever import PermissionRetriever
+from benchmarks.stubs import FakeGeminiServer, HashingEmbeddings
+
+
+@pytest.fixture
+def gemini():
+    with FakeGeminiServer(reply="See POL-3.") as server:
+        transport = GeminiTransport(api_key="test-key", base_url=server.url)
+        yield server, transport
+        transport.close()
+
+
+def test_falls_back_to_the_next_model_on_errors_and_timeouts(gemini):
+    server, transport = gemini
+    server.fault("gemini-a", status=503, times=1)
+    chat = build_resilient_chat_model(["gemini-a", "gemini-b"], transport=transport, hedge_delay=None)
+    message = chat.invoke("hello")
+    assert message.content == "See POL-3."
+    assert message.response_metadata["model_name"] == "gemini-b"
+
+    # A model that does not answer within its per-attempt timeout is abandoned too
+    server.fault("gemini-a", latency=1.0, times=1)
+    client = ResilientClient(["gemini-a", "gemini-b"], transport, timeout=0.2, deadline=5.0, hedge_delay=None)
+    chat = model_client.ResilientChatModel(client=client)
+    start = time.perf_counter()
+    assert chat.invoke("hello").response_metadata["model_name"] == "gemini-b"
+    assert time.perf_counter() - start < 0.9
+    stats = chat.model_stats()
+    assert stats["gemini-a"]["timeouts"] == 1 and stats["gemini-b"]["fallbacks"] == 1
+
+    # Errors caused by the request itself are not retried on other models
+    server.fault("gemini-a", status=400, times=1)
+    with pytest.raises(ModelCallError):
+        chat.invoke("hello")
+
+
+def test_slow_request_is_hedged(gemini):
+    server, transport = gemini
+    server.fault("gemini-a", latency=1.0, times=1)
+    chat = build_resilient_chat_model(["gemini-a"], transport=transport, hedge_delay=0.05)
+    start = time.perf_counter()
+    assert chat.invoke("hello").content == "See POL-3."
+    assert time.perf_counter() - start < 0.9
+    stats = chat.model_stats()["gemini-a"]
+    assert (stats["hedges"], stats["hedge_wins"], stats["failures"]) == (1, 1, 0)
+    assert server.requests.count(("gemini-a", "generateContent")) == 2
+
+
+def test_circuit_breaker_skips_a_failing_model_until_the_cooldown(gemini):
+    server, transport = gemini
+    server.fault("gemini-a", status=500)
+    client = ResilientClient(["gemini-a", "gemini-b"], transport, hedge_delay=None, breaker_failures=2,
+                             breaker_cooldown=0.2)
+    chat = model_client.ResilientChatModel(client=client)
+    for _ in range(4):
+        assert chat.invoke("hello").response_metadata["model_name"] == "gemini-b"
+    # Two failures opened the breaker; the other calls went straight to the fallback
+    assert server.requests.count(("gemini-a", "generateContent")) == 2
+    assert chat.model_stats()["gemini-a"]["circuit"] == "open"
+
+    server.clear_faults()
+    time.sleep(0.25)
+    assert chat.invoke("hello").response_metadata["model_name"] == "gemini-a"
+    assert chat.model_stats()["gemini-a"]["circuit"] == "closed"
+
+    server.fault("gemini-a", status=500)
+    server.fault("gemini-b", status=503)
+    with pytest.raises(AllModelsFailedError):
+        chat.invoke("hello")
+
+
+def test_half_open_probe_is_released_on_every_exit_path(gemini):
+    server, transport = gemini
+    client = ResilientClient(["gemini-a"], transport, hedge_delay=None, breaker_failures=1, breaker_cooldown=0.05)
+    chat = model_client.ResilientChatModel(client=client)
+
+    def open_breaker():
+        server.fault("gemini-a", status=500, times=1)
+        with pytest.raises(AllModelsFailedError):
+            chat.invoke("hello")
+        time.sleep(0.1)
+        assert client.stats()["gemini-a"]["circuit"] == "half_open"
+
+    # The probe request is rejected by the model itself (400)
+    open_breaker()
+    server.fault("gemini-a", status=400, times=1)
+    with pytest.raises(ModelCallError):
+        chat.invoke("hello")
+    assert chat.invoke("hello").content == "See POL-3."
+
+    # The caller stops reading the probe stream after the first chunk
+    open_breaker()
+    stream = chat.stream("hello")
+    next(stream)
+    stream.close()
+    assert chat.invoke("hello").content == "See POL-3."
+
+    # The probe stream breaks after its first event: the breaker opens again
+    open_breaker()
+
+    def broken_stream(model: str, timeout: float):
+        yield {"candidates": [{"content": {"parts": [{"text": "See"}]}}]}
+        raise httpx.ReadError("connection lost")
+
+    events = client.stream(broken_stream)
+    next(events)
+    with pytest.raises(httpx.ReadError):
+        next(events)
+    assert client.stats()["gemini-a"]["circuit"] == "open"
+    time.sleep(0.1)
+    assert chat.invoke("hello").content == "See POL-3."
+    assert client.stats()["gemini-a"]["circuit"] == "closed"
+
+
+def test_stream_falls_back_before_the_first_chunk(gemini):
+    server, transport = gemini
+    server.fault("gemini-a", status=429, times=1)
+    chat = build_resilient_chat_model(["gemini-a", "gemini-b"], transport=transport)
+    chunks = list(chat.stream("hello"))
+    assert "".join(chunk.content for chunk in chunks) == "See POL-3."
+    assert chunks[0].response_metadata["model_name"] == "gemini-b"
+
+
+def test_embeddings_are_batched_over_one_pooled_connection(gemini):
+    server, transport = gemini
+    embeddings = build_resilient_embeddings("models/embedding-001", transport=transport, batch_size=10)
+    texts = [f"policy POL-{i}" for i in range(25)]
+    vectors = embeddings.embed_documents(texts)
+    assert vectors == HashingEmbeddings(64).embed_documents(texts)
+    assert embeddings.embed_query("policy POL-3") == vectors[3]
+    assert server.requests == [("embedding-001", "batchEmbedContents")] * 4
+    assert server.connections == 1
+    with pytest.raises(ValueError):
+        model_client.ResilientEmbeddings(ResilientClient(["a", "b"], transport))
+
+
+def test_rag_service_answers_through_the_fallback_model(gemini, tmp_path, monkeypatch):
+    server, transport = gemini
+    monkeypatch.setattr(model_client, "_shared_transport", transport)
+    docs = [Document(page_content="POL-3 covers leave.", metadata={"title": "Policy 3", "permission": ["HR"]})]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=HashingEmbeddings(64))
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path),
+                                    embeddings=build_resilient_embeddings("models/embedding-001"))
+    server.fault("gemini-primary", status=503)
+    service = RagService(retriever=retriever, llm=build_chat_model("gemini-primary", ["gemini-backup"]))
+
+    assert service.get_rag_response("what does POL-3 say?", "HR") == "See POL-3."
+    models = service.health()["models"]
+    assert models["gemini-primary"]["failures"] == 1
+    assert models["gemini-backup"]["successes"] == 1
+
+
+def test_indexing_embeddings_go_through_the_resilient_client(gemini, monkeypatch):
+    server, transport = gemini
+    monkeypatch.setattr(model_client, "_shared_transport", transport)
+    embeddings = init_embeddings(cache_path=None)
+    assert isinstance(embeddings, model_client.ResilientEmbeddings)
+    assert embeddings.embed_documents(["policy POL-3"]) == HashingEmbeddings(64).embed_documents(["policy POL-3"])
+    assert server.requests == [("embedding-001", "batchEmbedContents")]
@@ -0,0 +1,78 @@
+# secure-rag/tests/test_partitions.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import (
+    PARTITIONS_MANIFEST,
+    create_and_save_partitioned_vectorstore,
+    create_and_save_vectorstore,
+)
+from app.retriever import PermissionRetriever
+
+
+def make_docs() -> list[Document]:
+    """A corpus where HR can read only a small fraction of the chunks."""
+    docs = []
+    for i in range(40):
+        docs.append(Document(page_content=f"engineering note number {i}", metadata={"title": f"Eng {i}", "permission": ["Engineer"]}))
+    for i in range(5):
+        docs.append(Document(page_content=f"hr policy number {i}", metadata={"title": f"HR {i}", "permission": ["HR"]}))
+    docs.append(Document(page_content="remote work policy", metadata={"title": "Remote", "permission": ["PM", "HR", "Engineer"]}))
+    return docs
+
+
+def test_partitioned_store_returns_k_authorized_hits(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_partitioned_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+    assert (tmp_path / PARTITIONS_MANIFEST).exists()
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    assert len(retriever.partitions) == 3
+
+    docs = retriever.get_relevant_documents("engineering note", "HR", k=4)
+    assert len(docs) == 4
+    assert all("HR" in doc.metadata["permission"] for doc in docs)
+
+
+def test_partitioned_store_applies_deny_rules_before_top_k(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = [Document(page_content=f"engineering note number {i}",
+                     metadata={"title": f"Internal {i}", "permission": ["Engineer"], "deny": ["contractors"]})
+            for i in range(20)]
+    docs += [Document(page_content=f"public runbook {i}", metadata={"title": f"Runbook {i}", "permission": ["Engineer"]})
+             for i in range(6)]
+    create_and_save_partitioned_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    assert len(retriever.partitions) == 2
+    found = retriever.get_relevant_documents("engineering note", ["Engineer", "contractors"], k=4)
+    assert len(found) == 4
+    assert all(doc.metadata["title"].startswith("Runbook") for doc in found)
+    assert len(retriever.get_relevant_documents("engineering note", "Engineer", k=4)) == 4
+
+
+def test_partitioned_store_ignores_unknown_role(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_partitioned_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    assert retriever.get_relevant_documents("anything", "Contractor") == []
+
+
+def test_flat_rebuild_replaces_partition_manifest(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_partitioned_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+    create_and_save_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+    assert not (tmp_path / PARTITIONS_MANIFEST).exists()
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    assert retriever.serving is not None
+    assert retriever.partitions == []
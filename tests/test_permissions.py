@@ -0,0 +1,133 @@
+# secure-rag/tests/test_permissions.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import create_and_save_vectorstore
+from app.instrumentation import start_trace
+from app.permissions import DENY_BITMASK_FILE, ROLE_BITMASK_FILE, PermissionIndex, build_role_bits
+from app import retriever as retriever_module
+from app.retriever import PermissionRetriever
+
+
+def make_docs() -> list[Document]:
+    """HR can read 3 of 200 chunks, so a plain top-k search rarely finds them."""
+    docs = [
+        Document(page_content=f"engineering note {i}", metadata={"title": f"Eng {i}", "permission": ["Engineer"]})
+        for i in range(197)
+    ]
+    docs += [
+        Document(page_content=f"hr policy {i}", metadata={"title": f"HR {i}", "permission": ["HR"]})
+        for i in range(3)
+    ]
+    return docs
+
+
+def test_allowed_matches_role_bits():
+    role_bits = build_role_bits([["HR"], ["Engineer", "PM"]])
+    bitmask = np.array([1 << role_bits["HR"], (1 << role_bits["Engineer"]) | (1 << role_bits["PM"]), 0], dtype=np.uint64)
+    index = PermissionIndex(bitmask, role_bits)
+    assert index.allowed("PM").tolist() == [False, True, False]
+    assert index.allowed("Intern").tolist() == [False, False, False]
+
+
+def test_bitmask_retrieval_with_id_selector(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+    assert (tmp_path / ROLE_BITMASK_FILE).exists()
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings, use_mmap=False)
+    with start_trace() as trace:
+        docs = retriever.get_relevant_documents("engineering note", "HR", k=4)
+    assert sorted(doc.metadata["title"] for doc in docs) == ["HR 0", "HR 1", "HR 2"]
+    assert trace.counters["search_rounds"] == 1
+
+
+def test_bitmask_retrieval_with_overfetch_rounds(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings, use_id_selector=False,
+                                    use_mmap=False)
+    with start_trace() as trace:
+        docs = retriever.get_relevant_documents("engineering note", "HR", k=2)
+    assert len(docs) == 2
+    assert all(doc.metadata["permission"] == ["HR"] for doc in docs)
+    assert trace.counters["search_rounds"] >= 1
+
+    with start_trace() as trace:
+        engineer_docs = retriever.get_relevant_documents("engineering note", "Engineer", k=4)
+    assert len(engineer_docs) == 4
+    assert trace.counters["search_rounds"] == 1
+
+
+def test_permission_index_multi_role_users_and_deny_rules():
+    permissions = PermissionIndex.build([
+        {"permission": ["Engineer"]},
+        {"permission": ["Engineer"], "deny": ["contractors"]},
+        {"permission": ["HR", "team-payments"]},
+        {"title": "no permission metadata"},
+    ])
+    assert permissions.allowed("Engineer").tolist() == [True, True, False, False]
+    assert permissions.allowed(["Engineer", "contractors"]).tolist() == [True, False, False, False]
+    assert permissions.allowed({"PM", "team-payments"}).tolist() == [False, False, True, False]
+    assert permissions.allowed(["Intern"]).tolist() == [False, False, False, False]
+    # Evaluating only a candidate batch gives the same answer for those rows
+    assert permissions.allowed(["Engineer", "contractors"], rows=np.array([3, 1, 0])).tolist() == [False, False, True]
+
+
+def test_permission_index_supports_more_than_64_roles(tmp_path):
+    metadatas = [{"permission": [f"group-{i:03d}"]} for i in range(150)]
+    permissions = PermissionIndex.build(metadatas)
+    assert permissions.words == 3
+
+    permissions.save(str(tmp_path))
+    assert not (tmp_path / DENY_BITMASK_FILE).exists()
+    loaded = PermissionIndex.load(str(tmp_path), mmap_mode='r')
+    allowed = loaded.allowed(["group-000", "group-149", "unknown"])
+    assert np.flatnonzero(allowed).tolist() == [0, 149]
+
+
+def test_deny_rules_apply_to_retrieval(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = make_docs()
+    docs[-1].metadata["deny"] = ["contractors"]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+    assert (tmp_path / DENY_BITMASK_FILE).exists()
+
+    for use_mmap in (True, False):
+        retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings, use_mmap=use_mmap)
+        docs = retriever.get_relevant_documents("hr policy", ["HR", "contractors"], k=4)
+        assert sorted(doc.metadata["title"] for doc in docs) == ["HR 0", "HR 1"]
+        # A user holding several roles sees the union of what each role may read, minus denied chunks
+        docs = retriever.get_relevant_documents("hr policy", ["HR", "Engineer"], k=300)
+        assert len(docs) == 200
+
+
+def test_post_filter_evaluates_candidate_rows_with_one_bitset_call(tmp_path, monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    create_and_save_vectorstore(make_docs(), str(tmp_path), embeddings=embeddings)
+
+    def no_metadata_checks(metadata, principals):
+        raise AssertionError("the bitset path should not parse metadata per document")
+
+    monkeypatch.setattr(retriever_module, "permits", no_metadata_checks)
+    for use_mmap in (True, False):
+        retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings, use_mmap=use_mmap,
+                                        hybrid=False)
+        calls = []
+        allowed = retriever.permissions.allowed
+        monkeypatch.setattr(retriever.permissions, "allowed",
+                            lambda user_role, rows=None: calls.append(rows) or allowed(user_role, rows))
+        docs = retriever.get_relevant_documents("engineering note", "Engineer", k=4)
+        assert len(docs) == 4
+        candidate_rows = [rows for rows in calls if rows is not None]
+        assert len(candidate_rows) == 1 and len(candidate_rows[0]) == 4
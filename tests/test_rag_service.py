@@ -0,0 +1,44 @@
+# secure-rag/tests/test_rag_service.py
+
+import os
+import subprocess
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.rag_chain import RagService
+
+
+class StaticRetriever:
+    """Returns the same documents for every query."""
+
+    def get_relevant_documents(self, query: str, user_role: str, k: int = 4) -> list[Document]:
+        return [Document(page_content="Bonuses are paid in March.", metadata={"title": "Bonus"})]
+
+
+def test_import_does_not_load_index_or_model():
+    code = "import sys; import app.rag_chain; print('faiss' in sys.modules, 'langchain_google_genai' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=project_root, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "False False"
+
+
+def test_components_are_built_lazily_and_cached():
+    service = RagService(retriever=StaticRetriever(), llm=FakeListChatModel(responses=["In March."]))
+    assert service.health() == {"ready": False, "retriever": "ready", "llm": "ready", "chain": "not_loaded"}
+
+    assert service.get_rag_response("When are bonuses paid?", "HR") == "In March."
+    assert service.health()["ready"] is True
+    assert service.chain is service.chain
+
+
+def test_construction_errors_are_reported_not_swallowed(tmp_path):
+    service = RagService(vectorstore_path=str(tmp_path / "missing"), llm=FakeListChatModel(responses=["x"]))
+    health = service.warmup()
+    assert health["ready"] is False
+    assert health["retriever"].startswith("error:")
+    assert service.get_rag_response("q", "HR").startswith("错误: RAG 链不可用")
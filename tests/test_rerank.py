@@ -0,0 +1,89 @@
+# secure-rag/tests/test_rerank.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import create_and_save_vectorstore
+from app.rag_chain import RagService
+from app.rerank import MMRReranker, Reranker
+from app.retriever import PermissionRetriever
+
+
+def doc(text: str) -> Document:
+    return Document(page_content=text, metadata={"title": text[:12], "permission": ["HR"]})
+
+
+def test_incomplete_reranker_fails_at_construction():
+    class NoRerank(Reranker):
+        pass
+
+    with pytest.raises(TypeError):
+        NoRerank()
+
+
+def test_mmr_skips_near_duplicate_chunks():
+    docs = [doc("leave policy A"), doc("leave policy A copy"), doc("leave policy B")]
+    query = np.array([1.0, 0.0, 0.0])
+    # The first two chunks are near duplicates; the third is slightly less relevant but different
+    vectors = np.array([[0.95, 0.31, 0.0], [0.94, 0.34, 0.0], [0.9, 0.0, 0.43]])
+    reranker = MMRReranker(top_k=2, lexical_weight=0.0, score_ratio=0.0)
+    assert [d.page_content for d in reranker.rerank("leave", query, docs, vectors)] == [
+        "leave policy A", "leave policy B"]
+
+
+def test_low_scoring_candidates_are_cut_from_the_context():
+    docs = [doc("visa sponsorship rules"), doc("parking garage hours"), doc("cafeteria menu")]
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[1.0, 0.0], [0.2, 1.0], [0.1, 1.0]])
+    reranker = MMRReranker(top_k=3, lexical_weight=0.0)
+    assert [d.page_content for d in reranker.rerank("visa", query, docs, vectors)] == ["visa sponsorship rules"]
+
+
+def test_without_vectors_relevance_falls_back_to_query_term_overlap():
+    docs = [doc("office snacks"), doc("remote work stipend policy"), doc("remote work stipend policy")]
+    reranked = MMRReranker(top_k=2, score_ratio=0.5).rerank("remote work stipend", None, docs)
+    assert [d.page_content for d in reranked][0] == "remote work stipend policy"
+    assert all(d.page_content != "office snacks" for d in reranked)
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_stored_vectors_are_reused_for_retrieved_chunks(tmp_path, use_mmap):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = [doc(f"policy POL-{i} applies to team {i % 4}") for i in range(20)]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings, use_mmap=use_mmap)
+
+    found = retriever.get_relevant_documents("POL-3", "HR", k=6)
+    # Chunks fetched by other requests in between must not affect these rows
+    retriever.get_relevant_documents("team 2", "HR", k=20)
+    vectors = retriever.document_vectors(found)
+    expected = np.array(embeddings.embed_documents([d.page_content for d in found]), dtype=np.float32)
+    assert vectors.shape == expected.shape
+    # Stored vectors may be normalized, so compare directions
+    expected /= np.linalg.norm(expected, axis=1, keepdims=True)
+    actual = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    assert np.allclose(actual, expected, atol=1e-5)
+
+
+def test_service_records_the_rerank_stage(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=16)
+    docs = [doc(f"policy POL-{i} applies to team {i % 4}") for i in range(20)]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings=embeddings)
+    retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+    service = RagService(retriever=retriever, llm=FakeListChatModel(responses=["See POL-3."]),
+                         reranker=MMRReranker(top_k=2, candidates=10))
+
+    answer, trace = service.get_rag_response_with_trace("what does POL-3 say?", "HR")
+    assert answer == "See POL-3."
+    assert "rerank" in trace["stages"]
+    assert trace["counters"]["documents_reranked_out"] >= 8
@@ -0,0 +1,147 @@
+# secure-rag/tests/test_server.py
+
+import asyncio
+import os
+import sys
+import threading
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import httpx
+import pytest
+from langchain.docstore.document import Document
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from app.answer_cache import SemanticAnswerCache
+from app.indexing import create_and_save_vectorstore
+from app.rag_chain import RagService
+from app.retriever import PermissionRetriever
+from app.server import MicroBatcher, RagServer
+from benchmarks.load_test import SlowHashingEmbeddings, run as run_load_test
+
+
+class CountingEmbeddings(SlowHashingEmbeddings):
+    """Records the size of every upstream embedding call."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(size=64, latency=latency)
+        self.calls: list[int] = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.calls.append(len(texts))
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def make_server(tmp_path):
+    def make(window_ms: float = 20.0, latency: float = 0.0) -> tuple[RagServer, CountingEmbeddings]:
+        docs = [
+            Document(page_content=f"policy POL-{i} applies to team {i % 4}",
+                     metadata={"title": f"Policy {i}", "permission": ["HR"] if i % 2 else ["Engineer"]})
+            for i in range(40)
+        ]
+        create_and_save_vectorstore(docs, str(tmp_path), embeddings=CountingEmbeddings())
+        embeddings = CountingEmbeddings(latency)
+        retriever = PermissionRetriever(vectorstore_path=str(tmp_path), embeddings=embeddings)
+        service = RagService(retriever=retriever, llm=FakeListChatModel(responses=["See POL-3."]))
+        return RagServer(service, batch_window_ms=window_ms), embeddings
+    return make
+
+
+def post_all(server: RagServer, requests: list[tuple[str, dict]]) -> list[httpx.Response]:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server), base_url="http://test") as client:
+            return await asyncio.gather(*(client.post(path, json=body) for path, body in requests))
+    return asyncio.run(run())
+
+
+def test_endpoints_use_the_role_from_the_request(make_server):
+    server, _ = make_server(window_ms=0)
+    retrieved, answered, bad, missing, unknown = post_all(server, [
+        ("/retrieve", {"query": "POL-3", "user_role": "HR"}),
+        ("/answer", {"query": "what does POL-3 say?", "user_role": ["Engineer", "HR"]}),
+        ("/retrieve", {"query": "POL-3"}),
+        ("/retrieve", {"query": "", "user_role": "HR"}),
+        ("/search", {"query": "POL-3", "user_role": "HR"}),
+    ])
+    assert retrieved.status_code == 200
+    assert retrieved.json()["documents"]
+    assert all(doc["metadata"]["permission"] == ["HR"] for doc in retrieved.json()["documents"])
+    assert answered.json()["answer"] == "See POL-3."
+    assert (bad.status_code, missing.status_code, unknown.status_code) == (400, 400, 404)
+
+
+def test_internal_errors_are_not_sent_to_the_client(make_server):
+    server, _ = make_server(window_ms=0)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("cannot open /srv/secret/vectorstore for gemini-internal")
+
+    server.service.retrieve_batch = fail
+    server.service.warmup()
+    response, = post_all(server, [("/retrieve", {"query": "POL-3", "user_role": "HR"})])
+    assert response.status_code == 500
+    assert "secret" not in response.text and "gemini" not in response.text
+
+
+def test_answer_uses_the_index_version_it_retrieved_from(make_server, tmp_path):
+    server, _ = make_server(window_ms=0)
+    service = server.service
+    service.answer_cache = SemanticAnswerCache()
+    retrieved_version = service.retriever.index_version
+    stored_versions = []
+    store = service.answer_cache.store
+    service.answer_cache.store = lambda *args, index_version: (stored_versions.append(index_version)
+                                                               or store(*args, index_version=index_version))
+    answer_from_documents = service.answer_from_documents
+
+    def reload_then_answer(*args):
+        # The index is rebuilt and swapped between the search and answer stages
+        docs = [Document(page_content="bonus policy", metadata={"title": "Bonus", "permission": ["HR"]})]
+        create_and_save_vectorstore(docs, str(tmp_path), embeddings=CountingEmbeddings())
+        assert service.reload_index() is True
+        return answer_from_documents(*args)
+
+    service.answer_from_documents = reload_then_answer
+    response, = post_all(server, [("/answer", {"query": "what does POL-3 say?", "user_role": "HR"})])
+    assert response.status_code == 200
+    assert stored_versions == [retrieved_version]
+    assert service.retriever.index_version != retrieved_version
+
+
+def test_micro_batcher_fails_calls_left_without_a_result():
+    async def run():
+        batcher = MicroBatcher("short", lambda items: items[:1], window_ms=20.0)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(3)),
+                                                     return_exceptions=True), timeout=5)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_concurrent_requests_are_batched_and_duplicates_coalesced(make_server):
+    server, embeddings = make_server(window_ms=20.0, latency=0.01)
+    distinct = [("/retrieve", {"query": f"policy POL-{i}", "user_role": "HR"}) for i in range(8)]
+    duplicates = [("/retrieve", {"query": "policy POL-1", "user_role": ["HR"]})] * 8
+    responses = post_all(server, distinct + duplicates)
+
+    assert all(response.status_code == 200 for response in responses)
+    # 8 distinct queries in far fewer upstream calls, and the duplicates add none
+    assert sum(embeddings.calls) == 8
+    assert len(embeddings.calls) < 8
+    titles = {tuple(d["metadata"]["title"] for d in r.json()["documents"]) for r in responses[8:]}
+    assert len(titles) == 1
+    assert titles == {tuple(d["metadata"]["title"] for d in responses[1].json()["documents"])}
+
+
+def test_load_test_reports_batching():
+    report = run_load_test(300, n_requests=60, concurrency=16, windows=[5.0], dim=32,
+                           embed_latency=0.005, llm_latency=0.0)
+    result = report["results"][0]
+    assert result["requests"] == 60 and result["errors"] == 0
+    assert result["batching"]["embed"]["mean_batch_size"] > 1
+    assert result["batching"]["coalesced_requests"] > 0
@@ -0,0 +1,94 @@
+# secure-rag/tests/test_serving_store.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' and 'benchmarks'
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.ann_index import IndexSpec
+from app.indexing import create_and_save_vectorstore
+from app.retriever import PermissionRetriever
+from app.serving_store import SERVING_DIR, TEXT_BLOCK_ROWS, ServingStore, stored_vector_dtype
+from benchmarks.stubs import ROLES, HashingEmbeddings, make_corpus
+
+
+def test_mmap_retrieval_matches_faiss_load(tmp_path):
+    # Random vectors have no distance ties, so both paths must agree on the order too
+    embeddings = DeterministicFakeEmbedding(size=32)
+    create_and_save_vectorstore(make_corpus(300), str(tmp_path), embeddings)
+
+    mapped = PermissionRetriever(str(tmp_path), embeddings=embeddings)
+    loaded = PermissionRetriever(str(tmp_path), embeddings=embeddings, use_mmap=False)
+    assert mapped.serving is not None and mapped.vectorstore is None
+
+    for role in ROLES:
+        expected = loaded.get_relevant_documents("salary bonus payroll", role, k=5)
+        actual = mapped.get_relevant_documents("salary bonus payroll", role, k=5)
+        assert [d.metadata["chunk_id"] for d in actual] == [d.metadata["chunk_id"] for d in expected]
+
+
+def test_serving_format_does_not_need_the_pickled_docstore(tmp_path):
+    embeddings = HashingEmbeddings(size=64)
+    docs = [Document(page_content="Prime de fin d'année — 奖金 ✓", metadata={"title": "Bonus", "permission": ["HR"]})]
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings)
+    os.remove(tmp_path / "index.pkl")
+    os.remove(tmp_path / "index.faiss")
+
+    store = ServingStore(str(tmp_path / SERVING_DIR))
+    assert store.document(0).page_content == docs[0].page_content
+    assert store.document(0).metadata["permission"] == ["HR"]
+
+    retriever = PermissionRetriever(str(tmp_path), embeddings=embeddings)
+    assert [d.metadata["title"] for d in retriever.get_relevant_documents("奖金", "HR")] == ["Bonus"]
+    assert retriever.get_relevant_documents("奖金", "Engineer") == []
+
+
+def test_mmap_ann_index_respects_permissions(tmp_path):
+    embeddings = HashingEmbeddings(size=64)
+    create_and_save_vectorstore(make_corpus(400), str(tmp_path), embeddings, IndexSpec(kind="ivf_flat", nlist=8, nprobe=8))
+
+    retriever = PermissionRetriever(str(tmp_path), embeddings=embeddings)
+    assert retriever.serving.index is not None
+    docs = retriever.get_relevant_documents("password audit token", "Legal", k=4)
+    assert len(docs) == 4
+    assert all("Legal" in d.metadata["permission"] for d in docs)
+
+
+def test_compact_vectors_are_rescored_to_the_exact_ranking(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    create_and_save_vectorstore(make_corpus(300), str(tmp_path / "exact"), embeddings)
+    exact = PermissionRetriever(str(tmp_path / "exact"), embeddings=embeddings)
+
+    for vector_dtype in ("float16", "int8"):
+        path = tmp_path / vector_dtype
+        create_and_save_vectorstore(make_corpus(300), str(path), embeddings, vector_dtype=vector_dtype)
+        assert stored_vector_dtype(str(path / SERVING_DIR)) == vector_dtype
+        compact = PermissionRetriever(str(path), embeddings=embeddings)
+        assert compact.serving.scan_index is not None
+        for role in ROLES:
+            expected = exact.get_relevant_documents("salary bonus payroll", role, k=5)
+            actual = compact.get_relevant_documents("salary bonus payroll", role, k=5)
+            assert [d.metadata["chunk_id"] for d in actual] == [d.metadata["chunk_id"] for d in expected]
+
+        # A rebuild without an explicit type keeps the stored one
+        create_and_save_vectorstore(make_corpus(10), str(path), embeddings)
+        assert stored_vector_dtype(str(path / SERVING_DIR)) == vector_dtype
+
+
+def test_compressed_text_is_read_back_per_block(tmp_path):
+    embeddings = HashingEmbeddings(size=64)
+    docs = make_corpus(TEXT_BLOCK_ROWS * 2 + 5)
+    create_and_save_vectorstore(docs, str(tmp_path), embeddings)
+
+    store = ServingStore(str(tmp_path / SERVING_DIR))
+    assert store.text_codec is not None
+    assert os.path.getsize(tmp_path / SERVING_DIR / "texts.bin") < sum(len(d.page_content.encode()) for d in docs)
+    expected = {d.page_content: d.metadata["permission"] for d in docs}
+    for i in reversed(range(store.ntotal)):
+        doc = store.document(i)
+        assert expected[doc.page_content] == doc.metadata["permission"]
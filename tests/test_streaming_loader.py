@@ -0,0 +1,74 @@
+# secure-rag/tests/test_streaming_loader.py
+
+import json
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from app.indexing import DATA_PATH, create_and_save_vectorstore, iter_docs, iter_json_array, load_docs_from_json, load_manifest
+
+RECORDS = [
+    {"title": "Handbook", "content": "leave policy [with brackets] and \"quotes\"", "permission": ["HR"]},
+    {"title": "Broken", "content": "no permission field"},
+    {"title": "Bad permission", "content": "string instead of list", "permission": "HR"},
+    {"title": "Deploy", "content": "deploy with docker, then helm", "category": "Tech", "permission": ["Engineer", "PM"]},
+]
+
+
+def test_json_array_is_parsed_incrementally(tmp_path):
+    path = tmp_path / "docs.json"
+    path.write_text(json.dumps(RECORDS, indent=2), encoding="utf-8")
+    with open(path, encoding="utf-8") as f:
+        # A tiny read size forces records to span many reads
+        assert list(iter_json_array(f, read_size=7)) == RECORDS
+
+
+def test_invalid_records_are_skipped(tmp_path):
+    path = tmp_path / "docs.json"
+    path.write_text(json.dumps(RECORDS), encoding="utf-8")
+    docs = list(iter_docs(str(path)))
+    assert [doc.metadata["title"] for doc in docs] == ["Handbook", "Deploy"]
+    assert docs[1].metadata["category"] == "Tech"
+
+
+def test_jsonl_variant(tmp_path):
+    path = tmp_path / "docs.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS) + "\n", encoding="utf-8")
+    assert [doc.metadata["title"] for doc in iter_docs(str(path))] == ["Handbook", "Deploy"]
+
+
+def test_corrupt_jsonl_line_is_skipped(tmp_path):
+    path = tmp_path / "docs.jsonl"
+    lines = [json.dumps(RECORDS[0]), '{"title": "Half", "content": ', json.dumps(RECORDS[3])]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    assert [doc.metadata["title"] for doc in iter_docs(str(path))] == ["Handbook", "Deploy"]
+    assert [doc.metadata["title"] for doc in load_docs_from_json(str(path))] == ["Handbook", "Deploy"]
+
+
+def test_truncated_json_raises(tmp_path):
+    path = tmp_path / "docs.json"
+    path.write_text(json.dumps(RECORDS)[:-20], encoding="utf-8")
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_docs(str(path)))
+    assert load_docs_from_json(str(path)) == []
+
+
+def test_sample_corpus_streams_every_record():
+    data_path = os.path.join(project_root, "data", os.path.basename(DATA_PATH))
+    with open(data_path, encoding="utf-8") as f:
+        expected = [item["title"] for item in json.load(f)]
+    assert [doc.metadata["title"] for doc in iter_docs(data_path)] == expected
+
+
+def test_streaming_build_from_generator(tmp_path):
+    path = tmp_path / "docs.jsonl"
+    path.write_text("\n".join(json.dumps(record) for record in RECORDS), encoding="utf-8")
+    save_path = str(tmp_path / "vectorstore")
+    create_and_save_vectorstore(iter_docs(str(path)), save_path, embeddings=DeterministicFakeEmbedding(size=8))
+    assert sorted(load_manifest(save_path)["documents"]) == ["Deploy", "Handbook"]
@@ -0,0 +1,38 @@
+# secure-rag/tests/test_streaming_response.py
+
+import os
+import sys
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from langchain.docstore.document import Document
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+
+import app.rag_chain as rag_chain_module
+
+
+class StaticRetriever:
+    """Returns the same documents for every query."""
+
+    def get_relevant_documents(self, query: str, user_role: str, k: int = 4) -> list[Document]:
+        return [Document(page_content="Remote work is allowed on Fridays.", metadata={"title": "Remote Work Policy"})]
+
+
+def test_documents_arrive_before_answer_chunks():
+    llm = GenericFakeChatModel(messages=iter(["Remote work is allowed on Fridays."]))
+    service = rag_chain_module.RagService(retriever=StaticRetriever(), llm=llm)
+
+    events = list(service.stream_rag_response("Can I work remotely?", "PM"))
+    assert [doc.metadata["title"] for doc in events[0]["documents"]] == ["Remote Work Policy"]
+    answer_events = events[1:]
+    assert len(answer_events) > 1
+    assert "".join(event["answer"] for event in answer_events) == "Remote work is allowed on Fridays."
+
+
+def test_stream_reports_unavailable_chain(tmp_path):
+    service = rag_chain_module.RagService(vectorstore_path=str(tmp_path / "missing"), llm=GenericFakeChatModel(messages=iter([])))
+    events = list(service.stream_rag_response("q", "HR"))
+    assert len(events) == 1
+    assert events[0]["error"].startswith("错误: RAG 链不可用")
@@ -0,0 +1,141 @@
+# secure-rag/tests/test_tenants.py
+
+import os
+import sys
+import threading
+
+# Add project root directory to Python path to allow importing 'app' module
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import pytest
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app.indexing import create_and_save_vectorstore
+from app import tenants
+from app.tenants import TenantRegistry, index_size_bytes
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def build_tenants(root) -> dict[str, int]:
+    """One small vector store per business unit; returns each store's size."""
+    sizes = {}
+    for tenant in ("finance", "legal", "sales"):
+        docs = [Document(page_content=f"{tenant} policy {i}", metadata={"title": f"{tenant} {i}", "permission": ["HR"]})
+                for i in range(5)]
+        create_and_save_vectorstore(docs, str(root / tenant), embeddings=EMBEDDINGS)
+        sizes[tenant] = index_size_bytes(str(root / tenant))
+    return sizes
+
+
+def titles(registry: TenantRegistry, tenant: str) -> set[str]:
+    docs = registry.service(tenant).retriever.get_relevant_documents("policy", "HR")
+    return {doc.metadata["title"].split()[0] for doc in docs}
+
+
+def test_tenants_are_loaded_lazily_and_share_one_embedding_client(tmp_path):
+    build_tenants(tmp_path)
+    registry = TenantRegistry(root=str(tmp_path), embeddings=EMBEDDINGS, llm=FakeListChatModel(responses=["ok"]))
+    assert registry.health()["tenants"] == {}
+
+    assert registry.get_rag_response("finance", "policy?", "HR") == "ok"
+    assert titles(registry, "finance") == {"finance"}
+    assert titles(registry, "legal") == {"legal"}
+    assert registry.service("finance").retriever.embeddings is registry.service("legal").retriever.embeddings
+    assert registry.service("finance") is registry.service("finance")
+    assert registry.health()["loads"] == 2
+
+
+def test_loading_a_tenant_does_not_block_loaded_tenants(tmp_path, monkeypatch):
+    build_tenants(tmp_path)
+    registry = TenantRegistry(root=str(tmp_path), embeddings=EMBEDDINGS, llm=FakeListChatModel(responses=["ok"]))
+    finance = registry.service("finance")
+
+    # Stall the directory scan of a cold tenant
+    scanning, release = threading.Event(), threading.Event()
+
+    def slow_size(path: str) -> int:
+        scanning.set()
+        release.wait(5)
+        return index_size_bytes(path)
+
+    monkeypatch.setattr(tenants, "index_size_bytes", slow_size)
+    cold = threading.Thread(target=registry.service, args=("legal",))
+    cold.start()
+    try:
+        assert scanning.wait(5)
+        done = threading.Event()
+        threading.Thread(target=lambda: (registry.service("finance"), done.set()), daemon=True).start()
+        assert done.wait(1)
+        assert registry.service("finance") is finance
+    finally:
+        release.set()
+        cold.join()
+    assert set(registry.health()["tenants"]) == {"finance", "legal"}
+
+
+def test_stopping_an_evicted_watcher_does_not_block_other_tenants(tmp_path):
+    sizes = build_tenants(tmp_path)
+    registry = TenantRegistry(root=str(tmp_path), embeddings=EMBEDDINGS, llm=FakeListChatModel(responses=["ok"]),
+                              memory_budget=sizes["finance"] + sizes["legal"] + sizes["sales"] // 2)
+    finance = registry.service("finance")
+    legal = registry.service("legal")
+
+    # The evicted tenant's watcher is busy (e.g. reloading its index)
+    stopping, release = threading.Event(), threading.Event()
+
+    def slow_stop():
+        stopping.set()
+        release.wait(5)
+
+    finance.stop_watching = slow_stop
+    loader = threading.Thread(target=registry.service, args=("sales",))
+    loader.start()
+    try:
+        assert stopping.wait(5)
+        done = threading.Event()
+        threading.Thread(target=lambda: (registry.service("legal"), done.set()), daemon=True).start()
+        assert done.wait(1)
+    finally:
+        release.set()
+        loader.join()
+    assert registry.service("legal") is legal
+    assert set(registry.health()["tenants"]) == {"legal", "sales"}
+
+
+def test_least_recently_used_tenant_is_evicted_over_budget(tmp_path):
+    sizes = build_tenants(tmp_path)
+    budget = sizes["finance"] + sizes["legal"] + sizes["sales"] // 2
+    registry = TenantRegistry(root=str(tmp_path), embeddings=EMBEDDINGS, llm=FakeListChatModel(responses=["ok"]),
+                              memory_budget=budget)
+
+    registry.service("finance")
+    registry.service("legal")
+    registry.service("finance") # legal is now the least recently used
+    registry.service("sales")
+    health = registry.health()
+    assert set(health["tenants"]) == {"finance", "sales"}
+    assert health["evictions"] == 1
+    assert health["resident_bytes"] <= budget
+
+    # An evicted tenant is reloaded on its next request
+    assert titles(registry, "legal") == {"legal"}
+    assert registry.health()["loads"] == 4
+
+
+def test_tenant_names_cannot_escape_the_root(tmp_path):
+    build_tenants(tmp_path)
+    registry = TenantRegistry(root=str(tmp_path / "finance"), embeddings=EMBEDDINGS)
+    with pytest.raises(ValueError):
+        registry.service("../legal")
+    with pytest.raises(FileNotFoundError):
+        registry.service("marketing")
+
+    mapped = TenantRegistry(tenants={"fin": str(tmp_path / "finance")}, embeddings=EMBEDDINGS)
+    with pytest.raises(KeyError):
+        mapped.service("finance")
+    assert registry.health()["tenants"] == {}
+    assert mapped.health()["tenants"] == {}
@@ -12,23 +12,20 @@ import sys
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 
-# --- Import RAG Chain Function ---
-# 导入会执行 app/rag_chain.py 中的初始化代码
+# --- Import RAG Service ---
+# 导入本身很轻量；向量存储和聊天模型由 warmup() 构建，并在进程内缓存，
+# 因此 Streamlit 每次重新运行脚本时不会重复加载索引
 try:
-    # 确保环境变量在导入前已设置（由 .env 文件处理）
-    # 如果 rag_chain.py 没有成功加载 .env，这里可能会在初始化时出错
-    from app.rag_chain import get_rag_response
-    print("Successfully imported get_rag_response from app.rag_chain")
-    RAG_AVAILABLE = True
+    from app.rag_chain import get_default_service
+    rag_service = get_default_service()
+    # 构建失败时 (例如找不到向量存储或 API Key 问题)，错误会记录在 health 中，下一次运行时重试
+    rag_health = rag_service.warmup()
+    RAG_AVAILABLE = rag_health["ready"]
+    if not RAG_AVAILABLE:
+        st.error(f"初始化 RAG 链时出错: {rag_health}. 请检查向量存储、.env 文件和 API 密钥。")
 except ImportError as e:
     st.error(f"无法导入 RAG 链模块: {e}. 请确保 app/rag_chain.py 存在且无误。")
     RAG_AVAILABLE = False
-except FileNotFoundError as e: # 捕获向量存储加载错误
-     st.error(f"初始化 RAG 链时出错 (可能找不到向量存储): {e}")
-     RAG_AVAILABLE = False
-except Exception as e: # 捕获其他初始化错误 (例如 API Key 问题)
-     st.error(f"初始化 RAG 链时发生意外错误: {e}. 请检查 .env 文件和 API 密钥。")
-     RAG_AVAILABLE = False
 
 # --- Streamlit App ---
 
@@ -60,16 +57,33 @@ st.header("回答")
 
 if submit_button and RAG_AVAILABLE:
     if user_query:
-        # 显示加载状态
-        with st.spinner(f"正在以 **{selected_role}** 身份查找答案..."):
-            try:
-                # 调用 RAG 链获取答案
-                answer = get_rag_response(user_query, selected_role)
-
-                # 显示答案
-                st.markdown(answer) # 使用 markdown 以便格式化 (例如换行)
-            except Exception as e:
-                st.error(f"处理请求时发生错误: {e}")
+        try:
+            # 调用 RAG 链，以流式方式获取答案
+            events = rag_service.stream_rag_response(user_query, selected_role)
+
+            # 第一个事件是检索到的文档；在此之前显示加载状态
+            with st.spinner(f"正在以 **{selected_role}** 身份查找答案..."):
+                first_event = next(events, {"error": "错误: RAG 链没有返回任何结果。"})
+
+            if "error" in first_event:
+                st.error(first_event["error"])
+            else:
+                def answer_chunks():
+                    for event in events:
+                        if "error" in event:
+                            raise RuntimeError(event["error"])
+                        yield event["answer"]
+
+                # 逐块显示答案，而不是等待完整答案生成
+                st.write_stream(answer_chunks())
+
+                # 显示回答所依据的文档
+                documents = first_event["documents"]
+                with st.expander(f"参考文档 ({len(documents)})"):
+                    for doc in documents:
+                        st.markdown(f"- **{doc.metadata.get('title', 'N/A')}**")
+        except Exception as e:
+            st.error(f"处理请求时发生错误: {e}")
     else:
         st.warning("请输入你的问题。")
 elif not RAG_AVAILABLE: